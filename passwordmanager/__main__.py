@@ -0,0 +1,402 @@
+"""
+Command-line interface of the password manager, run from the repository root:
+    python -m passwordmanager --user NAME list
+    python -m passwordmanager --user NAME get ID --field password
+    python -m passwordmanager generate --length 24
+    python -m passwordmanager --user NAME import passwords.csv
+    python -m passwordmanager --user NAME export passwords.jsonl --passphrase
+
+Results are written to stdout as JSON, except for generate and get --field which write plain lines.
+Errors are written to stderr as JSON {"error": message} with exit status 1, 3 if logging in failed,
+or 4 if add or update lost a race with another edit of the same entry or a master password change.
+The master password is read from PM_PASSWORD if set, otherwise prompted for without echo.
+    python -m passwordmanager --user NAME agent
+unlocks the vault once and keeps it unlocked in the background until `lock`, `passwd` or 15 idle minutes;
+get, search and list are then answered by the agent without the master password, see database.unlock_agent.
+Modules are imported on first use, so generate and --help never load the database or the crypto stack.
+"""
+
+import argparse
+import os
+import sys
+from typing import Optional
+
+# modules of the app import each other from the passwordmanager directory
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_FIELDS = ('id', 'description', 'site', 'account_id', 'password', 'notes', 'timestamp')
+# formats of database.password_import, kept here so that --help does not load the database
+IMPORT_FORMATS = ('generic', 'chrome', 'firefox', 'bitwarden', 'keepass', 'keepass2')
+EXIT_FAILED = 1
+EXIT_LOGIN_FAILED = 3
+EXIT_CONFLICT = 4
+
+class CommandError(Exception):
+    def __init__(self, message: str, status: int = EXIT_FAILED):
+        super().__init__(message)
+        self.status = status
+
+def output(value) -> None:
+    import json
+    print(json.dumps(value, ensure_ascii=False))
+
+def parse_id(id: str) -> int:
+    try:
+        return int(id)
+    except ValueError:
+        raise CommandError(f'Invalid id {id}')
+
+def master_password(args: argparse.Namespace) -> str:
+    """
+    Get the master password from PM_PASSWORD, otherwise prompt for it once.
+    """
+    if getattr(args, 'master_password', None) is None:
+        password = os.environ.get('PM_PASSWORD')
+        if password is None:
+            import getpass
+            password = getpass.getpass(f'Master password for {args.user}: ')
+        args.master_password = password
+    return args.master_password
+
+def open_database(args: argparse.Namespace):
+    """
+    Open the database and log in as the user given by --user or PM_USER.
+    """
+    from database.pm_database import PMDatabase
+    if not args.user:
+        raise CommandError('No user given, use --user or PM_USER')
+    pmd = PMDatabase(args.db)
+    if not pmd.user_login(args.user, master_password(args)):
+        raise CommandError('Wrong username or password', EXIT_LOGIN_FAILED)
+    return pmd
+
+def get_entry(pmd, id: str):
+    records = pmd.get_passwords([parse_id(id)])
+    if not records:
+        raise CommandError(f'No entry with id {id}')
+    return records[0]
+
+def password_policy(args: argparse.Namespace, site: Optional[str] = None):
+    """
+    Get the policy of site if it has one and no option overrides it, otherwise the policy given by the options.
+    """
+    from backend.password_utils import PASSWORD_LEN, PasswordPolicy, policy_for_site
+    policy = policy_for_site(site) if args.length is None and not args.no_symbols and not args.no_ambiguous else None
+    if policy is None:
+        try:
+            policy = PasswordPolicy.from_dict({'length': PASSWORD_LEN if args.length is None else args.length, 'symbols': not args.no_symbols, 'exclude_ambiguous': args.no_ambiguous})
+        except ValueError as e:
+            raise CommandError(str(e))
+    return policy
+
+def new_password(args: argparse.Namespace, site: Optional[str]) -> str:
+    from backend.password_utils import generate_passwords
+    return generate_passwords(1, password_policy(args, site))[0] if args.generate else args.password
+
+def query_agent(args: argparse.Namespace, op: str, **params):
+    """
+    Send a lookup to the unlock agent if one is running for the same database and user.
+    :return: the result, or None if no agent serves the vault
+    """
+    if args.no_agent:
+        return None
+    from database.unlock_agent import AgentClient, AgentError
+    client = AgentClient(args.agent_socket)
+    try:
+        agent = client.request('ping')
+        if agent['db'] != os.path.realpath(args.db) or (args.user and agent['user'] != args.user):
+            return None
+        return client.request(op, **params)
+    except OSError:
+        return None
+    except AgentError as e:
+        raise CommandError(str(e))
+    finally:
+        client.close()
+
+def command_list(args: argparse.Namespace) -> None:
+    entries = None if args.show_passwords else query_agent(args, 'list')
+    if entries is None:
+        pmd = open_database(args)
+        entries = [record.as_dict(args.show_passwords) for record in pmd.show_all_passwords(lazy=True)]
+    output(entries)
+
+def command_get(args: argparse.Namespace) -> None:
+    entry = query_agent(args, 'get', id=args.id)
+    if entry is None:
+        entry = get_entry(open_database(args), args.id).as_dict(True)
+    if args.field:
+        print(entry[args.field] or '')
+    else:
+        output(entry)
+
+def command_search(args: argparse.Namespace) -> None:
+    keyword = ' '.join(args.keyword)
+    entries = None if args.show_passwords else query_agent(args, 'search', keyword=keyword)
+    if entries is None:
+        pmd = open_database(args)
+        entries = [record.as_dict(args.show_passwords) for record in pmd.search_password(keyword, lazy=True)]
+    output(entries)
+
+def command_add(args: argparse.Namespace) -> None:
+    if not args.password and not args.generate:
+        raise CommandError('No password given, use --password or --generate')
+    pmd = open_database(args)
+    password = new_password(args, args.site)
+    from database.pm_database import VaultKeyChangedError
+    try:
+        id = pmd.add_new_password(args.description, args.site, args.account_id, password, args.notes)
+    except VaultKeyChangedError as e:
+        raise CommandError(str(e), EXIT_CONFLICT)
+    if not id:
+        raise CommandError('Failed to add entry')
+    output({'id': str(id), 'password': password} if args.generate else {'id': str(id)})
+
+def command_update(args: argparse.Namespace) -> None:
+    pmd = open_database(args)
+    entry = get_entry(pmd, args.id).as_dict(True)
+    # fields not given keep their current values
+    for field in ('description', 'site', 'account_id', 'notes'):
+        if getattr(args, field) is not None:
+            entry[field] = getattr(args, field)
+    if args.password or args.generate:
+        entry['password'] = new_password(args, entry['site'])
+    from database.pm_database import UpdateConflictError, VaultKeyChangedError
+    try:
+        # based on the version just read, so a concurrent edit in between is not overwritten
+        updated = pmd.update_password(parse_id(args.id), entry['description'], entry['site'], entry['account_id'], entry['password'],
+                                      entry['notes'], version=entry['version'])
+    except (UpdateConflictError, VaultKeyChangedError) as e:
+        raise CommandError(str(e), EXIT_CONFLICT)
+    except ValueError as e:
+        # the stored password could not be decrypted and no new one was given
+        raise CommandError(str(e))
+    if not updated:
+        raise CommandError('Failed to update entry')
+    output({'id': args.id, 'password': entry['password']} if args.generate else {'id': args.id})
+
+def command_delete(args: argparse.Namespace) -> None:
+    pmd = open_database(args)
+    get_entry(pmd, args.id)
+    if not pmd.delete_password(parse_id(args.id)):
+        raise CommandError('Failed to delete entry')
+    output({'id': args.id})
+
+def command_reused(args: argparse.Namespace) -> None:
+    # grouped by fingerprint, no password is decrypted
+    pmd = open_database(args)
+    output([[record.as_dict(False) for record in pmd.get_passwords(ids)] for ids in pmd.reused_passwords()])
+
+def command_generate(args: argparse.Namespace) -> None:
+    from backend.password_utils import generate_passwords, generate_passphrases
+    if args.count < 1:
+        raise CommandError(f'Invalid count {args.count}, at least 1 password is generated')
+    if args.passphrase and args.words < 1:
+        raise CommandError(f'Invalid number of words {args.words}, a passphrase has at least 1 word')
+    if args.passphrase:
+        passwords = generate_passphrases(args.count, args.words, args.separator)
+    else:
+        passwords = generate_passwords(args.count, password_policy(args, args.site))
+    # one write for the whole batch
+    sys.stdout.write('\n'.join(passwords) + '\n')
+
+def command_passwd(args: argparse.Namespace) -> None:
+    pmd = open_database(args)
+    new_password = os.environ.get('PM_NEW_PASSWORD')
+    if new_password is None:
+        import getpass
+        new_password = getpass.getpass(f'New master password for {args.user}: ')
+        if getpass.getpass('Repeat the new master password: ') != new_password:
+            raise CommandError('The new passwords do not match')
+    if not new_password:
+        raise CommandError('The new password cannot be empty')
+    def progress(done: int, total: int, rate: float) -> None:
+        if sys.stderr.isatty():
+            print(f'\r{done}/{total} entries, {rate:.0f} rows/s', end='', file=sys.stderr, flush=True)
+    # a running agent holds the old vault key
+    query_agent(args, 'lock')
+    result = pmd.change_master_password(master_password(args), new_password, progress=progress)
+    if sys.stderr.isatty():
+        print(file=sys.stderr)
+    if result is None:
+        raise CommandError('An interrupted change to another password is pending, run passwd again with that password')
+    output(result)
+
+def command_import(args: argparse.Namespace) -> None:
+    from database.password_import import import_passwords
+    from database.pm_database import VaultKeyChangedError
+    if not os.path.isfile(args.path):
+        raise CommandError(f'No file {args.path}')
+    pmd = open_database(args)
+    def progress(rows: int, done: int, total: int) -> None:
+        if sys.stderr.isatty():
+            print(f'\r{rows} rows, {done / max(total, 1):.0%}', end='', file=sys.stderr, flush=True)
+    try:
+        # batches already imported by an interrupted run of the same file are skipped
+        result = import_passwords(pmd, args.path, args.format, progress=progress)
+    except ValueError as e:
+        raise CommandError(str(e))
+    except VaultKeyChangedError as e:
+        raise CommandError(str(e), EXIT_CONFLICT)
+    finally:
+        if sys.stderr.isatty():
+            print(file=sys.stderr)
+    output(result)
+
+def command_export(args: argparse.Namespace) -> None:
+    from database.password_export import export_passwords
+    passphrase = None
+    if args.passphrase:
+        passphrase = os.environ.get('PM_EXPORT_PASSPHRASE')
+        if passphrase is None:
+            import getpass
+            passphrase = getpass.getpass('Passphrase for the export: ')
+            if getpass.getpass('Repeat the passphrase: ') != passphrase:
+                raise CommandError('The passphrases do not match')
+        if not passphrase:
+            raise CommandError('The passphrase cannot be empty')
+    pmd = open_database(args)
+    def progress(rows: int, size: int) -> None:
+        if sys.stderr.isatty():
+            print(f'\r{rows} rows, {size / 1e6:.1f} MB', end='', file=sys.stderr, flush=True)
+    try:
+        result = export_passwords(pmd, args.path, args.format, passphrase, progress=progress)
+    except OSError as e:
+        raise CommandError(f'Cannot write {args.path}: {e.strerror}')
+    finally:
+        if sys.stderr.isatty():
+            print(file=sys.stderr)
+    print(f"{result['rows']} rows, {result['bytes'] / 1e6:.1f} MB in {result['seconds']:.2f}s: "
+          f"{result['rows_per_s']:.0f} rows/s, {result['mb_per_s']:.1f} MB/s", file=sys.stderr)
+    output(result)
+
+def command_agent(args: argparse.Namespace) -> None:
+    from database.unlock_agent import UnlockAgent, AgentError, prepare_socket_path, detach
+    try:
+        prepare_socket_path(args.agent_socket)
+    except AgentError as e:
+        raise CommandError(str(e))
+    # logging in here reports a wrong password to the terminal before detaching
+    pmd = open_database(args)
+    output({'socket': args.agent_socket, 'user': args.user, 'idle_timeout': args.idle_timeout})
+    if not args.foreground:
+        # an SQLite connection must not cross a fork, its locks belong to the parent process
+        pmd.close()
+        sys.stdout.flush()
+        detach()
+        pmd = open_database(args)
+    UnlockAgent(pmd, args.db, args.user, args.idle_timeout).run(args.agent_socket)
+
+def command_lock(args: argparse.Namespace) -> None:
+    from database.unlock_agent import AgentClient
+    client = AgentClient(args.agent_socket)
+    try:
+        client.request('lock')
+    except OSError:
+        raise CommandError('No agent is running')
+    finally:
+        client.close()
+    output({'socket': args.agent_socket})
+
+def add_policy_arguments(command: argparse.ArgumentParser) -> None:
+    command.add_argument('--length', type=int, help='length of the generated password, 16 unless the site has a policy')
+    command.add_argument('--no-symbols', action='store_true', help='generate passwords of letters and digits only')
+    command.add_argument('--no-ambiguous', action='store_true', help='leave out characters easily mistaken for others, e.g. l, 1 and I')
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m passwordmanager', description='Password Manager command-line interface')
+    parser.add_argument('--db', default=os.environ.get('PM_DB', 'pmd.db'), help='database file, PM_DB by default, otherwise pmd.db')
+    parser.add_argument('--user', default=os.environ.get('PM_USER'), help='username, PM_USER by default')
+    parser.add_argument('--agent-socket', help='socket of the unlock agent, PM_AGENT_SOCK by default, in a directory only the user can access')
+    parser.add_argument('--no-agent', action='store_true', help='always open the database, even if an agent is running')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('list', help='list all entries')
+    command.add_argument('--show-passwords', action='store_true', help='include decrypted passwords')
+    command.set_defaults(run=command_list)
+
+    command = commands.add_parser('get', help='get an entry with its password')
+    command.add_argument('id')
+    command.add_argument('--field', choices=ENTRY_FIELDS, help='print only the value of this field')
+    command.set_defaults(run=command_get)
+
+    command = commands.add_parser('search', help='search entries by words or word prefixes')
+    command.add_argument('keyword', nargs='+')
+    command.add_argument('--show-passwords', action='store_true', help='include decrypted passwords')
+    command.set_defaults(run=command_search)
+
+    for name, required, run in (('add', True, command_add), ('update', False, command_update)):
+        command = commands.add_parser(name, help=f'{name} an entry')
+        if not required:
+            command.add_argument('id')
+        command.add_argument('--description', required=required)
+        command.add_argument('--site', default='' if required else None)
+        command.add_argument('--account-id', dest='account_id', required=required)
+        command.add_argument('--notes', default='' if required else None)
+        password = command.add_mutually_exclusive_group()
+        password.add_argument('--password', help='avoid it on shared hosts, as command lines are visible to other users')
+        password.add_argument('--generate', action='store_true', help='generate a random password, written to the output')
+        add_policy_arguments(command)
+        command.set_defaults(run=run)
+
+    command = commands.add_parser('delete', help='delete an entry')
+    command.add_argument('id')
+    command.set_defaults(run=command_delete)
+
+    command = commands.add_parser('reused', help='list groups of entries sharing a password, most reused first')
+    command.set_defaults(run=command_reused)
+
+    command = commands.add_parser('passwd', help='change the master password, re-encrypting every entry; '
+                                  'the new password is read from PM_NEW_PASSWORD or prompted for')
+    command.set_defaults(run=command_passwd)
+
+    command = commands.add_parser('import', help='import entries from a CSV export of a browser or another password manager; '
+                                  'running it again after an interruption resumes where it stopped')
+    command.add_argument('path')
+    command.add_argument('--format', choices=IMPORT_FORMATS, help='detected from the header by default')
+    command.set_defaults(run=command_import)
+
+    command = commands.add_parser('export', help='export all entries with their passwords, decrypted one chunk at a time')
+    command.add_argument('path')
+    command.add_argument('--format', choices=('jsonl', 'csv'), default='jsonl', help='csv can be imported again with --format generic')
+    command.add_argument('--passphrase', action='store_true', help='encrypt the export with a passphrase read from PM_EXPORT_PASSPHRASE or prompted for')
+    command.set_defaults(run=command_export)
+
+    command = commands.add_parser('agent', help='unlock the vault once and serve get, search and list from memory')
+    command.add_argument('--idle-timeout', type=float, default=900, help='seconds without requests before the agent locks and exits')
+    command.add_argument('--foreground', action='store_true', help='do not fork into the background')
+    command.set_defaults(run=command_agent)
+
+    command = commands.add_parser('lock', help='stop the unlock agent')
+    command.set_defaults(run=command_lock)
+
+    command = commands.add_parser('generate', help='generate random passwords or passphrases')
+    add_policy_arguments(command)
+    command.add_argument('--site', help='follow the policy of this site, see PM_SITE_POLICIES')
+    command.add_argument('--count', type=int, default=1)
+    command.add_argument('--passphrase', action='store_true', help='generate passphrases of words from the bundled wordlist')
+    command.add_argument('--words', type=int, default=7, help='number of words in a passphrase')
+    command.add_argument('--separator', default='-', help='between the words of a passphrase')
+    command.set_defaults(run=command_generate)
+    return parser
+
+def main(argv: list) -> int:
+    args = build_parser().parse_args(argv)
+    if args.agent_socket is None and args.command in ('list', 'get', 'search', 'agent', 'lock', 'passwd'):
+        from database.unlock_agent import agent_socket_path
+        args.agent_socket = agent_socket_path()
+    try:
+        args.run(args)
+    except CommandError as e:
+        import json
+        print(json.dumps({'error': str(e)}), file=sys.stderr)
+        return e.status
+    except RuntimeError as e:
+        # PMDatabase failing to open or upgrade the database
+        import json
+        print(json.dumps({'error': str(e)}), file=sys.stderr)
+        return EXIT_FAILED
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,145 @@
+"""
+Functions relating to encrypting and decrypting many password records at once
+"""
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import contextvars
+from typing import Callable, Optional, Sequence, Union
+from backend.message_encrypting import *
+from backend.instrumentation import instrumented, record_rows
+import os
+
+BATCH_CHUNK_SIZE = 256
+
+def _decrypt_chunk(chunk: Sequence[tuple[bytes, bytes]], key: Union[bytes, str], scheme: int) -> list:
+    """
+    Decrypt a chunk of (token, salt) pairs, kept at module level so that process pools can pickle it.
+    :param key: the master password for scheme 1, the vault key for schemes 2 and 3
+    """
+    if scheme == RECORD_SCHEME_SCRYPT:
+        return [decrypt_message(token, key, salt) for token, salt in chunk]
+    return [decrypt_record(token, key, salt) for token, salt in chunk]
+
+def _encrypt_chunk(chunk: Sequence[str], vault_key: bytes) -> list:
+    """
+    Encrypt a chunk of messages, kept at module level so that process pools can pickle it.
+    """
+    return [encrypt_record(message, vault_key) for message in chunk]
+
+def _reencrypt_chunk(chunk: Sequence[tuple[bytes, bytes]], old_key: bytes, new_key: bytes) -> list:
+    """
+    Re-encrypt a chunk of (token, salt) pairs from one vault key to another, keeping the salts,
+    along with the fingerprints of the passwords for the new vault key.
+    """
+    fingerprint_key = generate_fingerprint_key(new_key)
+    results = []
+    for token, salt in chunk:
+        message = decrypt_record(token, old_key, salt)
+        results.append(None if message is None else (encrypt_record(message, new_key, salt)[0], password_fingerprint(message, fingerprint_key)))
+    return results
+
+def _fingerprint_chunk(chunk: Sequence[tuple[bytes, bytes]], vault_key: bytes) -> list:
+    """
+    Decrypt a chunk of (token, salt) pairs and fingerprint the passwords.
+    """
+    fingerprint_key = generate_fingerprint_key(vault_key)
+    fingerprints = []
+    for token, salt in chunk:
+        message = decrypt_record(token, vault_key, salt)
+        fingerprints.append(None if message is None else password_fingerprint(message, fingerprint_key))
+    return fingerprints
+
+@instrumented
+def decrypt_batch(items: Sequence[tuple[bytes, bytes]], key: Union[bytes, str], scheme: int = RECORD_SCHEME,
+                  workers: Optional[int] = None, use_processes: bool = False, chunk_size: int = BATCH_CHUNK_SIZE,
+                  progress: Optional[Callable[[int, int], None]] = None) -> list:
+    """
+    Decrypt (token, salt) pairs in chunks spread across a thread or process pool.
+    hashlib.scrypt releases the GIL, so threads scale for scheme 1; the cheap schemes 2 and 3 are mostly
+    Python overhead, so use_processes=True is the way to use more cores for it.
+    :param workers: pool size, defaults to the number of CPUs; 1 decrypts inline without a pool
+    :param progress: called with (rows done, rows total) after each chunk
+    :return: decrypted messages in the same order as items, None for those failed to decrypt
+    """
+    record_rows(len(items))
+    return _map_chunks(_decrypt_chunk, items, (key, scheme), workers, use_processes, chunk_size, progress)
+
+@instrumented
+def encrypt_batch(messages: Sequence[str], vault_key: bytes, workers: Optional[int] = None, use_processes: bool = False,
+                  chunk_size: int = BATCH_CHUNK_SIZE, progress: Optional[Callable[[int, int], None]] = None) -> list:
+    """
+    Encrypt messages with the vault key scheme in chunks spread across a thread or process pool.
+    :return: (token, salt) pairs in the same order as messages
+    """
+    record_rows(len(messages))
+    return _map_chunks(_encrypt_chunk, messages, (vault_key,), workers, use_processes, chunk_size, progress)
+
+@instrumented
+def reencrypt_batch(items: Sequence[tuple[bytes, bytes]], old_key: bytes, new_key: bytes, workers: Optional[int] = None,
+                    use_processes: bool = False, chunk_size: int = BATCH_CHUNK_SIZE,
+                    progress: Optional[Callable[[int, int], None]] = None) -> list:
+    """
+    Re-encrypt (token, salt) pairs of the vault key schemes with a new vault key, each record keeping its salt.
+    Scheme 2 records come out as scheme 3 envelopes.
+    Every record is decrypted and encrypted again by the same worker, so plaintext never leaves it.
+    :return: (new token, password fingerprint for new_key) pairs in the same order as items, None for those failed to decrypt
+    """
+    record_rows(len(items))
+    return _map_chunks(_reencrypt_chunk, items, (old_key, new_key), workers, use_processes, chunk_size, progress)
+
+@instrumented
+def fingerprint_batch(items: Sequence[tuple[bytes, bytes]], vault_key: bytes, workers: Optional[int] = None,
+                      use_processes: bool = False, chunk_size: int = BATCH_CHUNK_SIZE,
+                      progress: Optional[Callable[[int, int], None]] = None) -> list:
+    """
+    Get the password fingerprints of (token, salt) pairs of the vault key schemes, see password_fingerprint().
+    Records are decrypted by the worker fingerprinting them, so plaintext never leaves it.
+    :return: fingerprints in the same order as items, None for those failed to decrypt
+    """
+    record_rows(len(items))
+    return _map_chunks(_fingerprint_chunk, items, (vault_key,), workers, use_processes, chunk_size, progress)
+
+def _map_chunks(chunk_fn: Callable, items: Sequence, args: tuple, workers: Optional[int], use_processes: bool,
+                chunk_size: int, progress: Optional[Callable[[int, int], None]]) -> list:
+    """
+    Apply chunk_fn(chunk, *args) to consecutive chunks of items in a pool, and join the results in order.
+    """
+    total = len(items)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    chunks = [items[i:i + chunk_size] for i in range(0, total, chunk_size)]
+    results = [None] * len(chunks)
+    done = 0
+    # not worth starting a pool for a single chunk
+    if workers <= 1 or len(chunks) <= 1:
+        for i, chunk in enumerate(chunks):
+            results[i] = chunk_fn(chunk, *args)
+            done += len(chunk)
+            if progress is not None:
+                progress(done, total)
+    else:
+        executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with executor_class(max_workers=min(workers, len(chunks))) as executor:
+            if use_processes:
+                futures = {executor.submit(chunk_fn, chunk, *args): i for i, chunk in enumerate(chunks)}
+            else:
+                # each chunk runs in its own copy of the caller's context, so that its KDF runs count toward the
+                # instrumented operation in progress, a context can only be entered by one thread at a time
+                futures = {executor.submit(contextvars.copy_context().run, chunk_fn, chunk, *args): i for i, chunk in enumerate(chunks)}
+            for future in as_completed(futures):
+                i = futures[future]
+                # put each chunk back to its original position to keep the row order
+                results[i] = future.result()
+                done += len(chunks[i])
+                if progress is not None:
+                    progress(done, total)
+    return [result for chunk in results for result in chunk]
+
+if __name__ == '__main__':
+    import time
+    vault_key = os.urandom(32)
+    items = [encrypt_record(f'password {i}', vault_key) for i in range(10000)]
+    for workers, use_processes in ((1, False), (None, False), (None, True)):
+        start = time.perf_counter()
+        messages = decrypt_batch(items, vault_key, workers=workers, use_processes=use_processes)
+        print(workers, use_processes, f'{time.perf_counter() - start:.3f}s', messages[:2] == ['password 0', 'password 1'])
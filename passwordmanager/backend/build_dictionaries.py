@@ -0,0 +1,47 @@
+"""
+Compile ranked word lists into the dictionaries file read by the password strength check, see password_utils.py.
+
+Usage: python build_dictionaries.py passwords=passwords.txt english_wikipedia=english_wikipedia.txt ...
+Each list has one word per line, most frequent first. The bundled file is compiled from the frequency lists of zxcvbn
+(MIT license, https://github.com/dropbox/zxcvbn), the passwords list first.
+"""
+
+import gzip
+import sys
+
+from password_utils import DICTIONARIES_PATH, DICTIONARY_COUNT
+
+# shorter words are never looked up
+MIN_WORD_LENGTH = 3
+
+def compile_dictionaries(lists: dict, path: str = DICTIONARIES_PATH) -> dict:
+    """
+    Write a gzipped file of one line per dictionary, its name then its words separated by spaces, most frequent first.
+    A word in several lists is kept in the one where it ranks highest, and the words after it move up a rank.
+    :param lists: name -> words ranked by frequency
+    :return: name -> number of words written
+    :raise ValueError: if there are too many lists for the ranks encoded by password_utils._load_dictionaries()
+    """
+    if len(lists) >= DICTIONARY_COUNT:
+        raise ValueError(f'At most {DICTIONARY_COUNT - 1} lists can be compiled')
+    ranks = {}
+    for name, words in lists.items():
+        for rank, word in enumerate(dict.fromkeys(word.strip().lower() for word in words), 1):
+            if len(word) >= MIN_WORD_LENGTH and not any(char.isspace() for char in word):
+                if word not in ranks or rank < ranks[word][0]:
+                    ranks[word] = (rank, name)
+    dictionaries = {name: [] for name in lists}
+    for word, (rank, name) in sorted(ranks.items(), key=lambda item: item[1][0]):
+        dictionaries[name].append(word)
+    with gzip.open(path, 'wt', encoding='utf-8', compresslevel=9) as file:
+        for name, words in dictionaries.items():
+            file.write(f'{name} {" ".join(words)}\n')
+    return {name: len(words) for name, words in dictionaries.items()}
+
+if __name__ == '__main__':
+    lists = {}
+    for arg in sys.argv[1:]:
+        name, _, source = arg.partition('=')
+        with open(source, encoding='utf-8') as file:
+            lists[name] = file.read().split()
+    print(compile_dictionaries(lists))
@@ -0,0 +1,199 @@
+"""
+Functions relating to opt-in instrumentation of the database operations and the crypto backend:
+call counts, latency histograms, rows touched and KDF runs per operation, and a slow-operation log
+"""
+
+import contextvars
+import functools
+import logging
+import math
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# latency histogram buckets grow by a factor of 2 ** (1 / HISTOGRAM_STEPS) from 1 microsecond up
+HISTOGRAM_STEPS = 4
+HISTOGRAM_BUCKETS = 32 * HISTOGRAM_STEPS
+
+# checked on every call of an instrumented function, nothing else is done while it is False
+_enabled = False
+_slow_threshold: Optional[float] = None
+_lock = threading.Lock()
+_operations: dict = {}
+# operations in progress in the current context, rows and KDF runs are attributed to them,
+# also from pool threads running work of the operation in a copy of its context, see batch_crypto._map_chunks()
+_frames: contextvars.ContextVar = contextvars.ContextVar('frames', default=())
+
+class OperationStats:
+    """
+    Aggregated measurements of one operation.
+    """
+    __slots__ = ('calls', 'errors', 'total', 'max', 'rows', 'kdf_calls', 'histogram')
+
+    def __init__(self):
+        self.calls = self.errors = self.rows = self.kdf_calls = 0
+        self.total = self.max = 0.0
+        self.histogram = [0] * HISTOGRAM_BUCKETS
+
+    def add(self, seconds: float, rows: int, kdf_calls: int, failed: bool) -> None:
+        self.calls += 1
+        self.errors += failed
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.rows += rows
+        self.kdf_calls += kdf_calls
+        self.histogram[bucket(seconds)] += 1
+
+    def percentile(self, p: float) -> float:
+        """
+        Estimate the p-th percentile latency as the upper bound of the histogram bucket it falls in.
+        """
+        rank = math.ceil(self.calls * p / 100)
+        seen = 0
+        for i, count in enumerate(self.histogram):
+            seen += count
+            if seen >= rank:
+                return min(bucket_bound(i), self.max)
+        return self.max
+
+    def as_dict(self) -> dict:
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'total': self.total,
+            'mean': self.total / self.calls if self.calls else 0.0,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max,
+            'rows': self.rows,
+            'kdf_calls': self.kdf_calls,
+        }
+
+class _Frame:
+    __slots__ = ('rows', 'kdf_calls')
+
+    def __init__(self):
+        self.rows = self.kdf_calls = 0
+
+def bucket(seconds: float) -> int:
+    if seconds <= 1e-6:
+        return 0
+    return min(int(math.log2(seconds * 1e6) * HISTOGRAM_STEPS) + 1, HISTOGRAM_BUCKETS - 1)
+
+def bucket_bound(i: int) -> float:
+    return 1e-6 * 2 ** (i / HISTOGRAM_STEPS)
+
+def enable(slow_threshold: Optional[float] = None) -> None:
+    """
+    Start recording.
+    :param slow_threshold: if given, operations taking at least this many seconds are logged as warnings
+    """
+    global _enabled, _slow_threshold
+    _slow_threshold = slow_threshold
+    _enabled = True
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+def is_enabled() -> bool:
+    return _enabled
+
+def reset() -> None:
+    with _lock:
+        _operations.clear()
+
+def stats() -> dict:
+    """
+    Get the measurements recorded so far, keyed by operation name.
+    Latencies are in seconds, rows and kdf_calls are totals over all calls of the operation.
+    """
+    with _lock:
+        return {name: operation.as_dict() for name, operation in sorted(_operations.items())}
+
+def record_rows(rows: int) -> None:
+    """
+    Add rows touched to the innermost instrumented operation running in the current context.
+    """
+    if _enabled:
+        frames = _frames.get()
+        if frames:
+            # pool threads may add to the same operation at once
+            with _lock:
+                frames[-1].rows += rows
+
+def instrumented(fn: Optional[Callable] = None, *, name: Optional[str] = None, kdf: bool = False) -> Callable:
+    """
+    Decorator recording every call of fn while instrumentation is enabled.
+    :param name: operation name, the qualified name of fn by default
+    :param kdf: fn runs a key derivation, counted for every operation it is called from in the same context,
+                including from the threads of a pool the operation runs work in, but not from other processes
+    """
+    if fn is None:
+        return functools.partial(instrumented, name=name, kdf=kdf)
+    operation_name = name or fn.__qualname__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return fn(*args, **kwargs)
+        frames = _frames.get()
+        if kdf and frames:
+            with _lock:
+                for frame in frames:
+                    frame.kdf_calls += 1
+        frame = _Frame()
+        frame.kdf_calls = int(kdf)
+        # a new tuple, so that pool threads working for an outer operation keep their own stack
+        token = _frames.set(frames + (frame,))
+        failed = True
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            seconds = time.perf_counter() - start
+            _frames.reset(token)
+            with _lock:
+                operation = _operations.get(operation_name)
+                if operation is None:
+                    operation = _operations[operation_name] = OperationStats()
+                operation.add(seconds, frame.rows, frame.kdf_calls, failed)
+            if _slow_threshold is not None and seconds >= _slow_threshold:
+                logger.warning('slow operation %s took %.1fms (%d rows, %d kdf calls)',
+                               operation_name, seconds * 1000, frame.rows, frame.kdf_calls)
+    return wrapper
+
+# PM_SLOW_MS=<milliseconds> enables instrumentation with the slow-operation log from startup, e.g. for the GUI
+if os.environ.get('PM_SLOW_MS'):
+    enable(float(os.environ['PM_SLOW_MS']) / 1000)
+
+if __name__ == '__main__':
+    @instrumented(kdf=True)
+    def derive():
+        time.sleep(0.002)
+
+    @instrumented
+    def operation(rows: int):
+        derive()
+        record_rows(rows)
+
+    @instrumented
+    def pooled_operation(count: int):
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(4) as executor:
+            for future in [executor.submit(contextvars.copy_context().run, derive) for _ in range(count)]:
+                future.result()
+
+    logging.basicConfig()
+    enable(slow_threshold=0.01)
+    for i in range(100):
+        operation(i)
+    pooled_operation(8)
+    assert stats()['pooled_operation']['kdf_calls'] == 8
+    print(stats())
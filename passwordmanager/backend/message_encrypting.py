@@ -3,10 +3,31 @@ Functions relating to encrypting messages
 """
 
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from typing import Optional
 from backend.password_hashing import hash_password
+from backend.instrumentation import instrumented
 import os
 import base64
+import hashlib
+import hmac
+
+# record encryption schemes, stored along with each password record
+# scheme 1: every record key is derived from the master password with a full scrypt run
+# scheme 2: every record key is derived from the vault key (derived once per login) with HMAC-SHA256, tokens are Fernet
+# scheme 3: like scheme 2, but tokens are binary AES-256-GCM envelopes, see encrypt_record()
+RECORD_SCHEME_SCRYPT = 1
+RECORD_SCHEME_VAULT = 2
+RECORD_SCHEME_AEAD = 3
+RECORD_SCHEME = RECORD_SCHEME_AEAD
+
+# first byte of an envelope, Fernet tokens start with the base64 character 'g' instead
+ENVELOPE_VERSION = b'\x01'
+ENVELOPE_NONCE_SIZE = 12
+# associated data of a wrapped vault key, so it cannot be passed off as a record envelope
+WRAPPED_KEY_LABEL = b'vault-key'
+# bytes of a password fingerprint, see password_fingerprint()
+FINGERPRINT_SIZE = 16
 
 def generate_key(master_password: str, salt: Optional[bytes] = None) -> tuple[bytes, bytes]:
     """
@@ -19,17 +40,19 @@ def generate_key(master_password: str, salt: Optional[bytes] = None) -> tuple[by
     key = base64.urlsafe_b64encode(hash_password(master_password, salt)[0])
     return key, salt
 
+@instrumented
 def encrypt_message(message: str, master_password: str) -> tuple[bytes, bytes]:
     """
-    Encrypt message with master_password and unique salt.
+    Encrypt message with master_password and unique salt (record scheme 1).
     :return: a tuple of salt and encrypted token
     """
     key, salt = generate_key(master_password)
     return Fernet(key).encrypt(message.encode()), salt
 
+@instrumented
 def decrypt_message(token: bytes, master_password: str, salt: bytes) -> Optional[str]:
     """
-    Decrypt token with master_password and salt.
+    Decrypt token with master_password and salt (record scheme 1).
     :return: message decrypted
     """
     key = generate_key(master_password, salt)[0]
@@ -39,8 +62,96 @@ def decrypt_message(token: bytes, master_password: str, salt: bytes) -> Optional
         # if exception shows up during decryption, return None
         return None
 
+def generate_record_key(vault_key: bytes, salt: Optional[bytes] = None) -> tuple[bytes, bytes]:
+    """
+    Generate record key from vault_key and salt (if not already exists in database) for further encryption / decryption.
+    Unlike generate_key(), this only costs one HMAC-SHA256, as the expensive scrypt run is done once per login.
+    :return: a tuple of key and salt
+    """
+    if salt is None:
+        salt = os.urandom(32)
+    key = base64.urlsafe_b64encode(hmac.new(vault_key, b'record-key:' + salt, hashlib.sha256).digest())
+    return key, salt
+
+def generate_envelope_key(vault_key: bytes, salt: bytes) -> bytes:
+    """
+    Generate the raw 256-bit AES-GCM key of a record from vault_key and salt.
+    Derived with its own label, so it never equals the Fernet key of scheme 2 records with the same salt.
+    """
+    return hmac.new(vault_key, b'record-envelope-key:' + salt, hashlib.sha256).digest()
+
+def wrap_key(vault_key: bytes, key_encryption_key: bytes) -> bytes:
+    """
+    Encrypt a random vault key with the key derived from the master password, in an envelope like those of records.
+    Changing the scrypt parameters then only takes wrapping the same vault key again, the records stay as they are.
+    """
+    nonce = os.urandom(ENVELOPE_NONCE_SIZE)
+    return ENVELOPE_VERSION + nonce + AESGCM(key_encryption_key).encrypt(nonce, vault_key, WRAPPED_KEY_LABEL)
+
+def unwrap_key(wrapped: Optional[bytes], key_encryption_key: bytes) -> Optional[bytes]:
+    """
+    Decrypt a vault key wrapped with wrap_key().
+    Users created before vault keys were wrapped have none, their records are encrypted with key_encryption_key itself.
+    :return: the vault key, or None if wrapped cannot be decrypted with key_encryption_key
+    """
+    if wrapped is None:
+        return key_encryption_key
+    try:
+        return AESGCM(key_encryption_key).decrypt(wrapped[1:1 + ENVELOPE_NONCE_SIZE], wrapped[1 + ENVELOPE_NONCE_SIZE:], WRAPPED_KEY_LABEL)
+    except:
+        return None
+
+def generate_fingerprint_key(vault_key: bytes) -> bytes:
+    """
+    Generate the key of a user's password fingerprints from vault_key, with its own label so it is unrelated to any record key.
+    """
+    return hmac.new(vault_key, b'password-fingerprint-key', hashlib.sha256).digest()
+
+def password_fingerprint(message: str, fingerprint_key: bytes) -> bytes:
+    """
+    Get the keyed fingerprint of a password, the same for the same password of a user, so that reused passwords are found
+    without decrypting. Unlike a plain hash it cannot be checked against a list of common passwords without the key.
+    Truncated to FINGERPRINT_SIZE bytes, which keeps collisions within a vault negligible and the index small.
+    """
+    return hmac.new(fingerprint_key, message.encode(), hashlib.sha256).digest()[:FINGERPRINT_SIZE]
+
+@instrumented
+def encrypt_record(message: str, vault_key: bytes, salt: Optional[bytes] = None, scheme: int = RECORD_SCHEME) -> tuple[bytes, bytes]:
+    """
+    Encrypt message with vault_key and unique salt.
+    Scheme 3 tokens are envelopes of version byte + 12-byte random nonce + ciphertext + 16-byte tag, with the version byte
+    authenticated as associated data: 29 bytes over the message, against 58 to 73 bytes for Fernet before its base64 encoding adds a third.
+    :param scheme: RECORD_SCHEME_AEAD, or RECORD_SCHEME_VAULT for a Fernet token
+    :return: a tuple of encrypted token and salt
+    """
+    if scheme == RECORD_SCHEME_VAULT:
+        key, salt = generate_record_key(vault_key, salt)
+        return Fernet(key).encrypt(message.encode()), salt
+    if salt is None:
+        salt = os.urandom(32)
+    nonce = os.urandom(ENVELOPE_NONCE_SIZE)
+    return ENVELOPE_VERSION + nonce + AESGCM(generate_envelope_key(vault_key, salt)).encrypt(nonce, message.encode(), ENVELOPE_VERSION), salt
+
+@instrumented
+def decrypt_record(token: bytes, vault_key: bytes, salt: bytes) -> Optional[str]:
+    """
+    Decrypt token with vault_key and salt, either an envelope (record scheme 3) or a Fernet token (record scheme 2).
+    :return: message decrypted
+    """
+    try:
+        if token[:1] == ENVELOPE_VERSION:
+            nonce = token[1:1 + ENVELOPE_NONCE_SIZE]
+            return AESGCM(generate_envelope_key(vault_key, salt)).decrypt(nonce, token[1 + ENVELOPE_NONCE_SIZE:], ENVELOPE_VERSION).decode()
+        return Fernet(generate_record_key(vault_key, salt)[0]).decrypt(token).decode()
+    except:
+        return None
+
 if __name__ == '__main__':
     token, salt = encrypt_message('play the world', 'hello')
     message = decrypt_message(token, 'hello', salt)
     print(salt, token, message)
-
+    vault_key = os.urandom(32)
+    token, salt = encrypt_record('play the world', vault_key)
+    print(salt, token, decrypt_record(token, vault_key, salt))
+    token, salt = encrypt_record('play the world', vault_key, scheme=RECORD_SCHEME_VAULT)
+    print(salt, token, decrypt_record(token, vault_key, salt))
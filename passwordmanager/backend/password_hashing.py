@@ -7,26 +7,82 @@ import os
 # from typing import Union
 from typing import Optional
 import hmac 
+import time
+from backend.instrumentation import instrumented
+
+# scrypt parameters (n, r, p) of users created before they were stored per user, and of scheme 1 record keys
+KDF_PARAMS = (16384, 8, 1)
+# calibrate_kdf() picks the parameters taking about this long on the current machine, within the memory budget
+KDF_TARGET_SECONDS = 0.2
+KDF_MAX_MEMORY = 64 << 20
+# never calibrate below these, however slow the machine
+KDF_MIN_N = 8192
+KDF_R = 8
+
+def kdf_memory(params: tuple[int, int, int]) -> int:
+    """
+    Get the bytes of memory scrypt needs with parameters (n, r, p).
+    """
+    n, r, p = params
+    return 128 * r * (n + p)
+
+def scrypt(password: str, salt: bytes, params: tuple[int, int, int], dklen: int) -> bytes:
+    n, r, p = params
+    # the default limit of OpenSSL is 32 MiB, too little for n above 16384 with r = 8
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, dklen=dklen, maxmem=kdf_memory(params) + (1 << 20))
+
+def calibrate_kdf(target_seconds: float = KDF_TARGET_SECONDS, max_memory: int = KDF_MAX_MEMORY) -> tuple[int, int, int]:
+    """
+    Pick scrypt parameters taking about target_seconds on the current machine without exceeding max_memory.
+    n is doubled while the time and memory allow, then p is raised to use up the remaining time,
+    as scrypt runs the p lanes one after another with the same memory.
+    Costs about twice target_seconds.
+    :return: (n, r, p)
+    """
+    n = KDF_MIN_N
+    salt = os.urandom(32)
+    while True:
+        start = time.perf_counter()
+        scrypt('calibration', salt, (n, KDF_R, 1), 32)
+        seconds = time.perf_counter() - start
+        if seconds * 2 > target_seconds or kdf_memory((n * 2, KDF_R, 1)) > max_memory:
+            break
+        n *= 2
+    return n, KDF_R, max(1, round(target_seconds / seconds))
 
 # def hash_password(password: str, salt: Union[bytes, None] = None) -> tuple[bytes, bytes]:
-def hash_password(password: str, salt: Optional[bytes] = None) -> tuple[bytes, bytes]:
+@instrumented(kdf=True)
+def hash_password(password: str, salt: Optional[bytes] = None, params: tuple[int, int, int] = KDF_PARAMS) -> tuple[bytes, bytes]:
     """
     Hash the provided password with a randomly-generated or provided salt and return the salt and hash.
+    :param params: scrypt parameters (n, r, p)
     """
     # use os.urandom to generate random bytes from an OS-specific randomness source
     # salt should be about 16 or more bytes from a proper source, e.g. os.urandom()
     if salt is None:
         salt = os.urandom(32)
-    password_hash = hashlib.scrypt(password.encode(), salt=salt, n=16384, r=8, p=1, dklen=32)
+    password_hash = scrypt(password, salt, params, 32)
     return password_hash, salt
 
-def is_correct_password(password_provided: str, password_hash_stored: bytes, salt_stored: bytes) -> bool:
+@instrumented(kdf=True)
+def hash_password_with_key(password: str, salt: bytes, params: tuple[int, int, int] = KDF_PARAMS) -> tuple[bytes, bytes]:
+    """
+    Hash the provided password and derive the vault key from the same scrypt run.
+    The first 32 bytes of a 64-byte scrypt output equal the 32-byte output of hash_password(),
+    so they can be checked against the stored hash, while the last 32 bytes serve as the vault key.
+    :return: a tuple of password hash and vault key
+    """
+    derived = scrypt(password, salt, params, 64)
+    return derived[:32], derived[32:]
+
+def is_correct_password(password_provided: str, password_hash_stored: bytes, salt_stored: bytes,
+                        params: tuple[int, int, int] = KDF_PARAMS) -> bool:
     """
     Check wether a password provided by user while logging in, with previously stored password hash and salt.
     """
     # hmac.compare_digest uses an approach designed to prevent timing analysis by avoiding
     # content-based short circuiting behaviour, making it appropriate for cryptography
-    return hmac.compare_digest(hash_password(password_provided, salt_stored)[0], password_hash_stored)
+    return hmac.compare_digest(hash_password(password_provided, salt_stored, params)[0], password_hash_stored)
 
 if __name__ == '__main__':
     password_hash, salt = hash_password('hello')
@@ -35,4 +91,8 @@ if __name__ == '__main__':
     assert is_correct_password('hello', password_hash, salt)
     assert not is_correct_password('hellooo', password_hash, salt)
     assert not is_correct_password('Tr0ub4dor&3', password_hash, salt)
+    params = calibrate_kdf()
+    start = time.perf_counter()
+    hash_password('hello', params=params)
+    print(params, f'{time.perf_counter() - start:.3f}s')
 
@@ -2,9 +2,16 @@
 Functions relating to password generating, password strength checking
 """
 
+import datetime
+import functools
+import gzip
+import json
+import math
+import os
+import re
 import string
-import secrets
-import random
+from itertools import combinations
+from typing import Optional, Sequence
 
 PASSWORD_CHARS_UPPERS = string.ascii_uppercase
 PASSWORD_CHARS_LOWERS = string.ascii_lowercase
@@ -12,24 +19,693 @@ PASSWORD_CHARS_DIGITS = string.digits
 PASSWORD_CHARS_SYMBOLS = string.punctuation
 PASSWORD_CHARS = (PASSWORD_CHARS_UPPERS, PASSWORD_CHARS_LOWERS, PASSWORD_CHARS_DIGITS, PASSWORD_CHARS_SYMBOLS)
 PASSWORD_LEN = 16
+# characters easily mistaken for one another when read out or copied from paper
+AMBIGUOUS_CHARS = 'Il1|O0o`\'"'
+
+PASSPHRASE_WORDS = 7
+PASSPHRASE_SEPARATOR = '-'
+# one word per line, each drawn with the same probability
+WORDLIST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wordlist.txt')
+# JSON file of per-site policies, see load_site_policies()
+SITE_POLICIES_ENV = 'PM_SITE_POLICIES'
+
+class PasswordPolicy:
+    """
+    Rules for generated passwords: the length, the character classes of which each password has at least one character,
+    and characters never used, e.g. AMBIGUOUS_CHARS or symbols a site rejects.
+    """
+    def __init__(self, length: int = PASSWORD_LEN, classes: Sequence[str] = PASSWORD_CHARS, exclude: str = ''):
+        """
+        :raise ValueError: if a class is left empty by exclude, or length is too short for one character of each class
+        """
+        self.length = length
+        self.exclude = exclude
+        # a character in several classes only counts for the first, so that the alphabet has no duplicates
+        seen = set(exclude)
+        self.classes = []
+        for characters in classes:
+            characters = ''.join(dict.fromkeys(char for char in characters if char not in seen))
+            if not characters:
+                raise ValueError('Every character class needs at least one character not excluded')
+            seen.update(characters)
+            self.classes.append(characters)
+        if length < len(self.classes):
+            raise ValueError(f'Length {length} is too short for one character of each of {len(self.classes)} classes')
+        self.alphabet = ''.join(self.classes)
+        self._class_sets = [frozenset(characters) for characters in self.classes]
+
+    @classmethod
+    def from_dict(cls, rules: dict) -> 'PasswordPolicy':
+        """
+        Make a policy from rules as found in a site policies file, e.g.
+        {"length": 12, "symbols": "!#$%", "exclude_ambiguous": true}
+        Keys are optional: length, uppers, lowers, digits (false to leave the class out),
+        symbols (false, or the allowed symbols), exclude (characters never used) and exclude_ambiguous.
+        """
+        classes = [characters for key, characters in (('uppers', PASSWORD_CHARS_UPPERS), ('lowers', PASSWORD_CHARS_LOWERS),
+                                                      ('digits', PASSWORD_CHARS_DIGITS)) if rules.get(key, True)]
+        symbols = rules.get('symbols', True)
+        if symbols:
+            classes.append(PASSWORD_CHARS_SYMBOLS if symbols is True else symbols)
+        exclude = rules.get('exclude', '') + (AMBIGUOUS_CHARS if rules.get('exclude_ambiguous') else '')
+        return cls(rules.get('length', PASSWORD_LEN), classes, exclude)
+
+    def accepts(self, password: str) -> bool:
+        characters = set(password)
+        return all(characters & class_set for class_set in self._class_sets)
+
+    def valid_fraction(self) -> float:
+        """
+        Get the fraction of the strings of the alphabet which have every class, by inclusion-exclusion over the classes missing.
+        """
+        total = len(self.alphabet)
+        valid = 0
+        for missing in range(len(self.classes) + 1):
+            for subset in combinations(self.classes, missing):
+                valid += (-1) ** missing * ((total - sum(map(len, subset))) / total) ** self.length
+        return valid
+
+    def entropy(self) -> float:
+        """
+        Get the bits of entropy of a password generated with this policy, all valid passwords being equally likely.
+        """
+        return self.length * math.log2(len(self.alphabet)) + math.log2(self.valid_fraction())
+
+    def __repr__(self) -> str:
+        return f'PasswordPolicy(length={self.length!r}, classes={self.classes!r})'
+
+DEFAULT_POLICY = PasswordPolicy()
+# policies by site, matched by domain or parent domain, e.g. SITE_POLICIES['bank.example'] = PasswordPolicy(12, exclude='<>')
+SITE_POLICIES = {}
+
+@functools.lru_cache(maxsize=32)
+def _translation(alphabet: str) -> tuple[bytes, bytes]:
+    """
+    Get a table mapping random bytes to the characters of an ASCII alphabet, and the bytes to reject.
+    Bytes from 256 - 256 % len(alphabet) up are rejected, as they would make the first characters more likely.
+    """
+    size = len(alphabet)
+    limit = 256 - 256 % size
+    return bytes(ord(alphabet[byte % size]) for byte in range(256)), bytes(range(limit, 256))
+
+def random_indices(size: int, count: int) -> list:
+    """
+    Draw count integers uniformly distributed in [0, size) from os.urandom, with rejection sampling to avoid modulo bias.
+    Random bytes are drawn in bulk, one byte per integer for sizes up to 256 and two bytes up to 65536.
+    """
+    if not 0 < size <= 1 << 16:
+        raise ValueError(f'Cannot draw integers below {size}')
+    width = 1 if size <= 256 else 2
+    span = 1 << 8 * width
+    limit = span - span % size
+    indices = []
+    while len(indices) < count:
+        # enough for the expected number of rejections in one draw
+        data = os.urandom(math.ceil((count - len(indices)) * span / limit * 1.05 + 8) * width)
+        values = data if width == 1 else memoryview(data).cast('H')
+        indices += [value % size for value in values if value < limit]
+    del indices[count:]
+    return indices
+
+def random_chars(alphabet: str, count: int) -> str:
+    """
+    Draw count characters uniformly from alphabet with os.urandom.
+    """
+    if len(alphabet) > 256 or not alphabet.isascii():
+        return ''.join(alphabet[index] for index in random_indices(len(alphabet), count))
+    table, rejected = _translation(alphabet)
+    chars = b''
+    while len(chars) < count:
+        # bytes.translate maps and rejects in C, without a Python step per character
+        chars += os.urandom(math.ceil((count - len(chars)) * 256 / (256 - len(rejected)) * 1.05) + 8).translate(table, rejected)
+    return chars[:count].decode()
+
+def generate_passwords(count: int, policy: PasswordPolicy = DEFAULT_POLICY) -> list:
+    """
+    Generate count random passwords following policy, e.g. for provisioning a whole team at once.
+    Candidates are drawn from the whole alphabet and those missing a class are thrown away, so every valid password is
+    equally likely, unlike putting one character of each class at random positions.
+    """
+    passwords = []
+    # the fraction of candidates kept is known, so the random bytes for nearly all of them are drawn at once
+    fraction = policy.valid_fraction()
+    while len(passwords) < count:
+        candidates = math.ceil((count - len(passwords)) / fraction * 1.05) + 1
+        chars = random_chars(policy.alphabet, candidates * policy.length)
+        passwords += [password for password in (chars[i:i + policy.length] for i in range(0, len(chars), policy.length))
+                      if policy.accepts(password)]
+    del passwords[count:]
+    return passwords
 
 def generate_password(characters: tuple = PASSWORD_CHARS, length: int = PASSWORD_LEN) -> str:
     """
-    Generate a random password with at least one character from each category in provided password character tuple. 
+    Generate a random password with at least one character from each category in provided password character tuple.
+    """
+    policy = DEFAULT_POLICY if characters is PASSWORD_CHARS and length == PASSWORD_LEN else PasswordPolicy(length, characters)
+    return generate_passwords(1, policy)[0]
+
+@functools.lru_cache(maxsize=1)
+def load_wordlist(path: str = WORDLIST_PATH) -> tuple:
+    with open(path, encoding='utf-8') as file:
+        words = tuple(dict.fromkeys(line.strip() for line in file if line.strip()))
+    if len(words) < 2:
+        raise ValueError(f'{path} has too few words')
+    return words
+
+def generate_passphrases(count: int, words: int = PASSPHRASE_WORDS, separator: str = PASSPHRASE_SEPARATOR,
+                         wordlist: Optional[Sequence[str]] = None) -> list:
+    """
+    Generate count diceware-style passphrases of words drawn uniformly from the bundled wordlist,
+    each word adding log2(len(wordlist)) bits, see passphrase_entropy().
+    :raise ValueError: if count or words is less than 1
+    """
+    if count < 1 or words < 1:
+        raise ValueError(f'Cannot generate {count} passphrases of {words} words, both must be at least 1')
+    wordlist = wordlist or load_wordlist()
+    indices = random_indices(len(wordlist), count * words)
+    return [separator.join(wordlist[index] for index in indices[i:i + words]) for i in range(0, count * words, words)]
+
+def generate_passphrase(words: int = PASSPHRASE_WORDS, separator: str = PASSPHRASE_SEPARATOR) -> str:
+    return generate_passphrases(1, words, separator)[0]
+
+def passphrase_entropy(words: int = PASSPHRASE_WORDS, wordlist: Optional[Sequence[str]] = None) -> float:
+    return words * math.log2(len(wordlist or load_wordlist()))
+
+def load_site_policies(path: str) -> dict:
+    """
+    Read per-site policies from a JSON object of site to rules, see PasswordPolicy.from_dict(), into SITE_POLICIES.
+    :return: the policies read
+    """
+    with open(path, encoding='utf-8') as file:
+        policies = {site.lower(): PasswordPolicy.from_dict(rules) for site, rules in json.load(file).items()}
+    SITE_POLICIES.update(policies)
+    return policies
+
+@functools.lru_cache(maxsize=1)
+def _load_site_policies_env() -> None:
+    if os.environ.get(SITE_POLICIES_ENV):
+        load_site_policies(os.environ[SITE_POLICIES_ENV])
+
+def policy_for_site(site: Optional[str]) -> Optional[PasswordPolicy]:
+    """
+    Get the policy of site or its closest parent domain, from SITE_POLICIES and the file named by PM_SITE_POLICIES.
+    :param site: a domain or URL, e.g. 'https://login.bank.example/path'
+    :return: the policy, or None if the site has none
+    """
+    _load_site_policies_env()
+    if not site:
+        return None
+    host = site.lower().split('://')[-1].split('/')[0].split(':')[0]
+    labels = host.split('.')
+    for i in range(len(labels)):
+        policy = SITE_POLICIES.get('.'.join(labels[i:]))
+        if policy is not None:
+            return policy
+    return None
+
+# strength is estimated like zxcvbn: the password is split into the sequence of matches (dictionary words, keyboard
+# walks, repeats, sequences, dates, or bruteforce runs in between) which altogether need the fewest guesses
+# ref: https://www.usenix.org/conference/usenixsecurity16/technical-sessions/presentation/wheeler
+# ranked lists of common passwords and English words, compiled by build_dictionaries.py
+DICTIONARIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dictionaries.gz')
+# the most dictionaries the file may have, plus the passphrase wordlist
+DICTIONARY_COUNT = 8
+# characters past this are not analysed, so that a check stays fast, the estimate of a longer password is a lower bound
+STRENGTH_MAX_LENGTH = 64
+BRUTEFORCE_CARDINALITY = 10
+MIN_SUBMATCH_GUESSES_SINGLE_CHAR = 10
+MIN_SUBMATCH_GUESSES_MULTI_CHAR = 50
+# added for every match, so that splitting the password into more matches is not free
+MIN_GUESSES_BEFORE_GROWING_SEQUENCE = 10000
+REFERENCE_YEAR = datetime.date.today().year
+MIN_YEAR_SPACE = 20
+# guesses per second of an attacker: online with rate limiting, online, offline against scrypt, offline against a fast hash
+CRACK_RATES = {
+    'online_throttled': 100 / 3600,
+    'online': 10,
+    'offline_slow_hash': 1e4,
+    'offline_fast_hash': 1e10,
+}
+# a password needing fewer guesses than SCORE_GUESSES[i] scores i, 4 otherwise
+SCORE_GUESSES = (1e3 + 5, 1e6 + 5, 1e8 + 5, 1e10 + 5)
+# (offset of the first key in key widths, unshifted keys, shifted keys) of each row of a QWERTY keyboard
+KEYBOARD_ROWS = (
+    (0.0, '`1234567890-=', '~!@#$%^&*()_+'),
+    (1.5, 'qwertyuiop[]\\', 'QWERTYUIOP{}|'),
+    (1.75, "asdfghjkl;'", 'ASDFGHJKL:"'),
+    (2.25, 'zxcvbnm,./', 'ZXCVBNM<>?'),
+)
+# substitutions undone before looking words up, '1' and '|' stand for either 'i' or 'l'
+L33T_TABLES = (
+    str.maketrans('4@8({36!1|0$5+7%2', 'aabccegiiiossttxz'),
+    str.maketrans('4@8({36!1|0$5+7%2', 'aabccegillossttxz'),
+)
+SEQUENCE_MAX_DELTA = 5
+DATE_SEPARATED = re.compile(r'(?=(\d{1,4})([\s/\\_.-])(\d{1,2})\2(\d{1,4}))')
+DIGITS = re.compile(r'\d{4,}')
+YEAR = re.compile(r'19\d\d|20\d\d')
+REPEAT_GREEDY = re.compile(r'(.+)\1+')
+REPEAT_LAZY = re.compile(r'(.+?)\1+')
+REPEAT_LAZY_ANCHORED = re.compile(r'(.+?)\1+$')
+
+@functools.lru_cache(maxsize=1)
+def _load_dictionaries() -> tuple[dict, list, dict]:
+    """
+    Load the dictionaries into one dict of lowercase word -> rank * DICTIONARY_COUNT + index of the dictionary name,
+    on the first check rather than when the app starts. Ints rather than tuples keep loading 80000 words quick.
+    Each word is in one dictionary only, see build_dictionaries.py.
+    :return: the dict, the dictionary names, and the length of the longest word of each 3 letter prefix, which bounds
+             the substrings looked up
+    """
+    words = {}
+    names = []
+    with gzip.open(DICTIONARIES_PATH, 'rt', encoding='utf-8') as file:
+        for index, line in enumerate(file):
+            name, *ranked = line.split()
+            names.append(name)
+            words.update(zip(ranked, range(DICTIONARY_COUNT + index, (len(ranked) + 1) * DICTIONARY_COUNT, DICTIONARY_COUNT)))
+    # the passphrase wordlist is not ordered by frequency, every word is ranked as if guessed last
+    wordlist = load_wordlist()
+    names.append('wordlist')
+    for word in wordlist:
+        words.setdefault(word, len(wordlist) * DICTIONARY_COUNT + len(names) - 1)
+    return words, names, _longest_by_prefix(words)
+
+def _longest_by_prefix(words: dict) -> dict:
+    longest = {}
+    for word in words:
+        prefix = word[:3]
+        if len(word) > longest.get(prefix, 0):
+            longest[prefix] = len(word)
+    return longest
+
+@functools.lru_cache(maxsize=1)
+def _keyboard_graph() -> tuple[dict, dict, int, float]:
+    """
+    Map each character of a QWERTY keyboard to its adjacent characters and the direction to them (rows down, right or left).
+    Keys are adjacent if they are next to each other in a row, or overlap in adjacent rows.
+    :return: the graph, whether each character is shifted, the number of keys and their average number of adjacent keys
     """
-    password_chars = []
-    # First, get one random character from each category in characters so that the final password contains characters from all categories.
-    for char_category in characters:
-        # secrets.choice(sequence) returns a randomly chosen element from a non-empty sequence.
-        password_chars.append(secrets.choice(char_category))
-    # Second, get the rest characters.
-    password_chars += [secrets.choice(secrets.choice(characters)) for i in range(length - len(password_chars))]
-    # Third, shuffle the password_chars list in place.
-    random.shuffle(password_chars)
-    return ''.join(password_chars)
+    keys = {}
+    for row, (offset, unshifted, shifted) in enumerate(KEYBOARD_ROWS):
+        for column, chars in enumerate(zip(unshifted, shifted)):
+            for is_shifted, char in enumerate(chars):
+                keys[char] = (row, offset + column, bool(is_shifted))
+    graph = {}
+    for char, (row, x, _) in keys.items():
+        graph[char] = {other: (other_row - row, 1 if other_x > x else -1) for other, (other_row, other_x, _) in keys.items()
+                       if (other_row == row and abs(other_x - x) == 1) or (abs(other_row - row) == 1 and abs(other_x - x) < 1)}
+    shifted = {char: key[2] for char, key in keys.items()}
+    unshifted = [char for char in graph if not shifted[char]]
+    # the shifted and unshifted character of an adjacent key count once
+    degree = sum(len(graph[char]) / 2 for char in unshifted) / len(unshifted)
+    return graph, shifted, len(unshifted), degree
 
-def check_password_strength(password: str) -> bool:
-    pass
+def _variations(upper: int, lower: int) -> int:
+    """
+    Get the number of ways to pick which of upper + lower characters are altered, up to min(upper, lower) of them.
+    """
+    return sum(math.comb(upper + lower, count) for count in range(1, min(upper, lower) + 1))
+
+def _uppercase_variations(token: str) -> int:
+    if token.islower() or not any(char.isalpha() for char in token):
+        return 1
+    # capitalized, ending with a capital and all caps are tried first
+    if token.isupper() or (token[0].isupper() and token[1:].islower()) or (token[-1].isupper() and token[:-1].islower()):
+        return 2
+    return _variations(sum(map(str.isupper, token)), sum(map(str.islower, token)))
+
+def _l33t_variations(token: str, word: str) -> int:
+    token = token.lower()
+    variations = 1
+    for sub, letter in {(char, letter) for char, letter in zip(token, word) if char != letter}:
+        substituted = token.count(sub)
+        unsubstituted = token.count(letter)
+        variations *= 2 if not unsubstituted else _variations(substituted, unsubstituted)
+    return variations
+
+def _user_dictionary(user_inputs: tuple) -> dict:
+    """
+    Make a dictionary of user_inputs and the words of 3 or more characters in them, e.g. 'bank' for 'https://bank.example'.
+    """
+    words = {}
+    for user_input in user_inputs:
+        user_input = user_input.lower().strip()
+        for word in [user_input] + re.findall(r'[^\W_]{3,}', user_input):
+            words.setdefault(word, (len(words) + 1, 'user_inputs'))
+    return words
+
+def _dictionary_matches(password: str, user_words: dict) -> list:
+    """
+    Find the words of the dictionaries in password, reversed, or with l33t substitutions undone.
+    """
+    words, names, longest = _load_dictionaries()
+    user_longest = _longest_by_prefix(user_words)
+    lower = password.lower()
+    n = len(password)
+    texts = [(lower, False, None)]
+    for table in L33T_TABLES:
+        unl33ted = lower.translate(table)
+        if unl33ted != lower and all(unl33ted != text for text, _, _ in texts):
+            texts.append((unl33ted, False, table))
+    if lower[::-1] != lower:
+        # a palindrome has the same words reversed
+        texts.append((lower[::-1], True, None))
+    matches = []
+    for text, reversed_, table in texts:
+        for i in range(n - 2):
+            # most substrings start with 3 letters no word starts with, and are not looked up any further
+            prefix = text[i:i + 3]
+            stop = max(longest.get(prefix, 0), user_longest.get(prefix, 0))
+            for j in range(i + 3, min(n, i + stop) + 1):
+                word = text[i:j]
+                entry = user_words.get(word)
+                if entry is None:
+                    code = words.get(word)
+                    if code is None:
+                        continue
+                    entry = (code // DICTIONARY_COUNT, names[code % DICTIONARY_COUNT])
+                start, end = (n - j, n - i - 1) if reversed_ else (i, j - 1)
+                token = password[start:end + 1]
+                if table is not None and token.lower() == word:
+                    # found without substitutions already
+                    continue
+                rank, dictionary = entry
+                guesses = rank * _uppercase_variations(token)
+                if table is not None:
+                    guesses *= _l33t_variations(token, word)
+                if reversed_:
+                    guesses *= 2
+                matches.append({'pattern': 'dictionary', 'i': start, 'j': end, 'token': token, 'word': word,
+                                'dictionary': dictionary, 'rank': rank, 'l33t': table is not None, 'reversed': reversed_,
+                                'guesses': guesses})
+    return matches
+
+def _spatial_matches(password: str) -> list:
+    """
+    Find walks of 3 or more adjacent keys, e.g. 'qwerty' or 'zaq1@WSX'.
+    """
+    graph, shifted, keys, degree = _keyboard_graph()
+    matches = []
+    i = 0
+    while i < len(password) - 2:
+        j = i
+        direction = None
+        turns = 0
+        shifted_count = int(shifted.get(password[i], False))
+        while j + 1 < len(password) and password[j + 1] in graph.get(password[j], ()):
+            step = graph[password[j]][password[j + 1]]
+            if step != direction:
+                turns += 1
+                direction = step
+            shifted_count += shifted[password[j + 1]]
+            j += 1
+        if j - i < 2:
+            i += 1
+            continue
+        length = j - i + 1
+        # any start key, then up to turns changes of direction each to any adjacent key
+        guesses = sum(math.comb(k - 1, t - 1) * keys * degree ** t for k in range(2, length + 1) for t in range(1, min(turns, k - 1) + 1))
+        if shifted_count:
+            unshifted_count = length - shifted_count
+            guesses *= 2 if not unshifted_count else _variations(shifted_count, unshifted_count)
+        matches.append({'pattern': 'spatial', 'i': i, 'j': j, 'token': password[i:j + 1], 'turns': turns,
+                        'shifted_count': shifted_count, 'guesses': guesses})
+        i = j
+    return matches
+
+def _repeat_matches(password: str, user_words: dict, estimates: dict) -> list:
+    """
+    Find repeats of the same base, e.g. 'aaa' or 'abcabc', guessed as the base then the number of repeats.
+    :param estimates: guesses of the bases estimated during this check, as the same base is found at every repeat
+    """
+    matches = []
+    i = 0
+    while i < len(password):
+        greedy = REPEAT_GREEDY.search(password, i)
+        if greedy is None:
+            break
+        lazy = REPEAT_LAZY.search(password, i)
+        # the greedy match finds 'aabaab' as 'aab' repeated, the lazy one finds 'aa' first
+        if len(greedy.group(0)) > len(lazy.group(0)):
+            match = greedy
+            base = REPEAT_LAZY_ANCHORED.match(match.group(0)).group(1)
+        else:
+            match = lazy
+            base = lazy.group(1)
+        # a base is at most half of the text searched, so the recursion is at most log2(STRENGTH_MAX_LENGTH) deep
+        if base not in estimates:
+            estimates[base] = _estimate(base, user_words, estimates)[0]
+        base_guesses = estimates[base]
+        matches.append({'pattern': 'repeat', 'i': match.start(), 'j': match.end() - 1, 'token': match.group(0),
+                        'base_token': base, 'guesses': base_guesses * (len(match.group(0)) // len(base))})
+        i = match.end()
+    return matches
+
+def _sequence_matches(password: str) -> list:
+    """
+    Find runs of 3 or more characters with the same step between code points, e.g. 'abcd', '97531' or 'ZYX'.
+    """
+    matches = []
+
+    def add(i: int, j: int, delta: int) -> None:
+        if j - i < 2 or not 0 < abs(delta) <= SEQUENCE_MAX_DELTA:
+            return
+        token = password[i:j + 1]
+        # starting from an end of the alphabet or digits is tried first
+        base = 4 if token[0] in 'aAzZ019' else 10 if token[0].isdigit() else 26
+        if delta < 0:
+            base *= 2
+        matches.append({'pattern': 'sequence', 'i': i, 'j': j, 'token': token, 'ascending': delta > 0,
+                        'guesses': base * len(token)})
+
+    i = 0
+    last_delta = None
+    for k in range(1, len(password)):
+        delta = ord(password[k]) - ord(password[k - 1])
+        if last_delta is None:
+            last_delta = delta
+        if delta == last_delta:
+            continue
+        add(i, k - 1, last_delta)
+        i = k - 1
+        last_delta = delta
+    if last_delta is not None:
+        add(i, len(password) - 1, last_delta)
+    return matches
+
+def _date_year(first: str, second: str, third: str) -> Optional[int]:
+    """
+    Get the year of a date written as day, month and year, with the year first or last and day and month in either order.
+    :return: the year, or None if it is not a valid date
+    """
+    for year, day_month in ((third, (first, second)), (first, (second, third))):
+        if len(year) not in (2, 4) or not all(1 <= len(part) <= 2 for part in day_month):
+            continue
+        a, b = map(int, day_month)
+        if not ((1 <= a <= 12 and 1 <= b <= 31) or (1 <= b <= 12 and 1 <= a <= 31)):
+            continue
+        value = int(year)
+        if len(year) == 2:
+            value += 1900 if value > REFERENCE_YEAR % 100 else 2000
+        if 1900 <= value <= REFERENCE_YEAR + 30:
+            return value
+    return None
+
+@functools.lru_cache(maxsize=4096)
+def _digits_year(token: str) -> Optional[int]:
+    """
+    Get the year of a date written without separators, e.g. '130587', cached as runs of digits are mostly repeated.
+    :return: the year closest to now of the ways to read token as a date, or None if there is none
+    """
+    years = [_date_year(token[:a], token[a:b], token[b:]) for a in (1, 2, 4) for b in (a + 1, a + 2) if b < len(token)]
+    years = [year for year in years if year is not None]
+    return min(years, key=lambda year: abs(year - REFERENCE_YEAR)) if years else None
+
+def _year_guesses(year: int) -> int:
+    return max(abs(year - REFERENCE_YEAR), MIN_YEAR_SPACE)
+
+def _date_matches(password: str) -> list:
+    """
+    Find dates, e.g. '13.05.1987', '1987-5-13' or '130587', and years from 1900 to 2099.
+    """
+    matches = []
+    for match in DATE_SEPARATED.finditer(password):
+        first, separator, second, third = match.groups()
+        year = _date_year(first, second, third)
+        if year is not None:
+            i = match.start()
+            j = i + len(first) + len(second) + len(third) + 1
+            matches.append({'pattern': 'date', 'i': i, 'j': j, 'token': password[i:j + 1], 'separator': separator,
+                            'year': year, 'guesses': _year_guesses(year) * 365 * 4})
+    for match in DIGITS.finditer(password):
+        digits = match.group(0)
+        for i in range(len(digits) - 3):
+            for j in range(i + 4, min(len(digits), i + 8) + 1):
+                token = digits[i:j]
+                year = _digits_year(token)
+                if year is not None:
+                    matches.append({'pattern': 'date', 'i': match.start() + i, 'j': match.start() + j - 1, 'token': token,
+                                    'separator': '', 'year': year, 'guesses': _year_guesses(year) * 365})
+    for match in YEAR.finditer(password):
+        matches.append({'pattern': 'year', 'i': match.start(), 'j': match.end() - 1, 'token': match.group(0),
+                        'year': int(match.group(0)), 'guesses': _year_guesses(int(match.group(0)))})
+    return matches
+
+def _bruteforce_match(password: str, i: int, j: int) -> dict:
+    length = j - i + 1
+    guesses = float(BRUTEFORCE_CARDINALITY) ** length
+    return {'pattern': 'bruteforce', 'i': i, 'j': j, 'token': password[i:j + 1],
+            'guesses': max(guesses, MIN_SUBMATCH_GUESSES_SINGLE_CHAR + 1 if length == 1 else MIN_SUBMATCH_GUESSES_MULTI_CHAR + 1)}
+
+def _estimate(password: str, user_words: dict, estimates: dict) -> tuple[float, list]:
+    """
+    Find the sequence of non-overlapping matches covering password with the fewest guesses, gaps being bruteforced.
+    A sequence of count matches takes count! * product of their guesses, as the attacker does not know the order of the
+    patterns, plus MIN_GUESSES_BEFORE_GROWING_SEQUENCE ** (count - 1).
+    :param estimates: see _repeat_matches()
+    :return: a tuple of guesses and the sequence of matches
+    """
+    n = len(password)
+    if not n:
+        return 1, []
+    matches = (_dictionary_matches(password, user_words) + _spatial_matches(password) + _repeat_matches(password, user_words, estimates)
+               + _sequence_matches(password) + _date_matches(password))
+    # only the most guessable match of each span can be part of the best sequence
+    spans = {}
+    for match in matches:
+        if len(match['token']) < n:
+            # a match of part of the password needs at least as many guesses as bruteforcing a short run
+            minimum = MIN_SUBMATCH_GUESSES_SINGLE_CHAR if len(match['token']) == 1 else MIN_SUBMATCH_GUESSES_MULTI_CHAR
+            match['guesses'] = max(match['guesses'], minimum)
+        span = (match['i'], match['j'])
+        if span not in spans or match['guesses'] < spans[span]['guesses']:
+            spans[span] = match
+    by_end = [[] for _ in range(n)]
+    for match in spans.values():
+        by_end[match['j']].append(match)
+    # the guesses of a cover by a single match, or a match and a bruteforce run before or after it, bound the estimate,
+    # so that longer bruteforce runs and sequences needing more guesses are not tried, e.g. in 'abcabc...abca'
+    bound = _bruteforce_match(password, 0, n - 1)['guesses'] + 1
+    for match in spans.values():
+        if match['i'] == 0 and match['j'] == n - 1:
+            bound = min(bound, match['guesses'] + 1)
+        elif match['i'] == 0 or match['j'] == n - 1:
+            rest = _bruteforce_match(password, match['j'] + 1, n - 1) if match['i'] == 0 else _bruteforce_match(password, 0, match['i'] - 1)
+            bound = min(bound, 2 * match['guesses'] * rest['guesses'] + MIN_GUESSES_BEFORE_GROWING_SEQUENCE)
+    # allow for rounding, the guesses of the cover found may be computed in another order
+    bound *= 1 + 1e-9
+    longest_bruteforce = math.ceil(math.log10(bound))
+    # best[k][count]: (product of guesses, guesses, last match) of the best sequence of count matches covering password[:k + 1]
+    best = [{} for _ in range(n)]
+
+    def update(match: dict, count: int) -> None:
+        k = match['j']
+        product = match['guesses']
+        if count > 1:
+            product *= best[match['i'] - 1][count - 1][0]
+        guesses = math.factorial(count) * product + MIN_GUESSES_BEFORE_GROWING_SEQUENCE ** (count - 1)
+        if guesses > bound:
+            # a sequence only needs more guesses as it grows
+            return
+        # a sequence of fewer or as many matches needing fewer guesses is always preferred
+        # and the sequences this one is preferred to are dropped, so that they are not extended any further
+        entries = best[k]
+        dropped = []
+        for other_count, (_, other_guesses, _) in entries.items():
+            if other_guesses <= guesses:
+                if other_count <= count:
+                    return
+            elif other_count >= count:
+                dropped.append(other_count)
+        for other_count in dropped:
+            del entries[other_count]
+        entries[count] = (product, guesses, match)
+
+    # counts of the sequences ending at each position which a bruteforce run may follow, a bruteforce run is extended
+    # rather than followed by another one
+    extendable = []
+    for k in range(n):
+        for match in by_end[k]:
+            if match['i'] == 0:
+                update(match, 1)
+            else:
+                for count in list(best[match['i'] - 1]):
+                    update(match, count + 1)
+        if k < longest_bruteforce:
+            update(_bruteforce_match(password, 0, k), 1)
+        for i in range(max(1, k + 1 - longest_bruteforce), k + 1):
+            if extendable[i - 1]:
+                match = _bruteforce_match(password, i, k)
+                for count in extendable[i - 1]:
+                    update(match, count + 1)
+        extendable.append([count for count, (_, _, last) in best[k].items() if last['pattern'] != 'bruteforce'])
+    count = min(best[n - 1], key=lambda count: best[n - 1][count][1])
+    guesses = best[n - 1][count][1]
+    sequence = []
+    k = n - 1
+    while k >= 0:
+        match = best[k][count][2]
+        sequence.insert(0, match)
+        k = match['i'] - 1
+        count -= 1
+    return guesses, sequence
+
+def _display_time(seconds: float) -> str:
+    for unit, length in (('century', 100 * 31 * 86400 * 12), ('year', 31 * 86400 * 12), ('month', 31 * 86400),
+                         ('day', 86400), ('hour', 3600), ('minute', 60), ('second', 1)):
+        if seconds >= length:
+            if unit == 'century':
+                return 'centuries'
+            count = round(seconds / length)
+            return f'{count} {unit}' + ('s' if count != 1 else '')
+    return 'less than a second'
+
+def _warning(sequence: list) -> Optional[str]:
+    matches = [match for match in sequence if match['pattern'] != 'bruteforce']
+    if not matches:
+        return None
+    match = max(matches, key=lambda match: len(match['token']))
+    if match['pattern'] == 'dictionary':
+        if match['dictionary'] == 'passwords':
+            return 'This is a commonly used password' if len(sequence) == 1 else 'Parts of common passwords are easy to guess'
+        if match['dictionary'] == 'user_inputs':
+            return 'The site or account name is easy to guess'
+        return 'A word by itself is easy to guess' if len(sequence) == 1 else 'Common words are easy to guess'
+    return {
+        'spatial': 'Keyboard patterns like qwerty are easy to guess',
+        'repeat': 'Repeated characters or words are easy to guess',
+        'sequence': 'Sequences like abc or 6543 are easy to guess',
+        'date': 'Dates are easy to guess',
+        'year': 'Years are easy to guess',
+    }[match['pattern']]
+
+def check_password_strength(password: str, user_inputs: Sequence[str] = ()) -> dict:
+    """
+    Estimate the number of guesses needed to crack password, and score it from 0 (too guessable) to 4 (very unguessable).
+    Quick enough to run on every keystroke, the dictionaries are loaded on the first check.
+    :param user_inputs: strings the password should not be based on, e.g. the site and account id of the entry
+    :return: a dict of score, guesses, guesses_log10, crack_seconds (by attacker in CRACK_RATES), crack_time (of an offline
+             attack on a slow hash, for display), warning (None if the score is 3 or more) and sequence, the matches of the estimate
+    """
+    guesses, sequence = _estimate(password[:STRENGTH_MAX_LENGTH], _user_dictionary(tuple(user_inputs)), {})
+    score = next((score for score, limit in enumerate(SCORE_GUESSES) if guesses < limit), len(SCORE_GUESSES))
+    crack_seconds = {attack: guesses / rate for attack, rate in CRACK_RATES.items()}
+    return {
+        'score': score,
+        'guesses': guesses,
+        'guesses_log10': math.log10(guesses),
+        'crack_seconds': crack_seconds,
+        'crack_time': _display_time(crack_seconds['offline_slow_hash']),
+        'warning': _warning(sequence) if score < 3 else None,
+        'sequence': sequence,
+    }
 
 if __name__ == '__main__':
     print(generate_password())
+    print(generate_passphrase(), f'{passphrase_entropy():.1f} bits')
+    policy = PasswordPolicy(12, exclude=AMBIGUOUS_CHARS)
+    print(generate_passwords(3, policy), f'{policy.entropy():.1f} bits')
+    for password in ('password1', 'Tr0ub4dour&3', 'qwerty123', '13.05.1987', generate_passphrase(4)):
+        result = check_password_strength(password)
+        print(password, result['score'], result['crack_time'], result['warning'])
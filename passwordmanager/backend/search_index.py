@@ -0,0 +1,117 @@
+"""
+In-memory token prefix index for filtering password entries while typing
+"""
+
+import bisect
+import re
+
+TOKEN_PATTERN = re.compile(r'\w+')
+# prefixes up to this length get their own postings, as they match the most tokens
+SHORT_PREFIX_LEN = 2
+
+def tokenize(text: str) -> list:
+    """
+    Split text into lowercase word tokens, similar to the unicode61 tokenizer of SQLite FTS5.
+    """
+    return TOKEN_PATTERN.findall(text.lower()) if text else []
+
+def short_prefixes(tokens: set) -> set:
+    """
+    Get all prefixes of tokens not longer than SHORT_PREFIX_LEN.
+    """
+    return {token[:length] for token in tokens for length in range(1, SHORT_PREFIX_LEN + 1)}
+
+class PrefixIndex:
+    """
+    Maps word tokens of the non-secret fields of each entry to entry ids.
+    Tokens are also kept in a sorted list, so all tokens starting with a prefix form one contiguous
+    slice found with two binary searches. The shortest prefixes, typed first and matching most tokens,
+    are looked up directly in their own postings instead.
+    """
+    def __init__(self) -> None:
+        self._tokens = []
+        self._postings = dict()
+        self._short_postings = dict()
+        self._entries = dict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, id: int, *fields: str) -> None:
+        """
+        Index an entry by the tokens of its fields, replacing the entry if already indexed.
+        """
+        if id in self._entries:
+            self.remove(id)
+        tokens = set()
+        for field in fields:
+            tokens.update(tokenize(field))
+        self._entries[id] = tuple(tokens)
+        for token in tokens:
+            ids = self._postings.get(token)
+            if ids is None:
+                self._postings[token] = ids = set()
+                bisect.insort(self._tokens, token)
+            ids.add(id)
+        for prefix in short_prefixes(tokens):
+            ids = self._short_postings.get(prefix)
+            if ids is None:
+                self._short_postings[prefix] = ids = set()
+            ids.add(id)
+
+    def remove(self, id: int) -> None:
+        tokens = self._entries.pop(id, ())
+        for token in tokens:
+            ids = self._postings[token]
+            ids.discard(id)
+            if not ids:
+                del self._postings[token]
+                del self._tokens[bisect.bisect_left(self._tokens, token)]
+        for prefix in short_prefixes(tokens):
+            ids = self._short_postings[prefix]
+            ids.discard(id)
+            if not ids:
+                del self._short_postings[prefix]
+
+    def clear(self) -> None:
+        self._tokens.clear()
+        self._postings.clear()
+        self._short_postings.clear()
+        self._entries.clear()
+
+    def _prefix_ids(self, prefix: str) -> set:
+        """
+        Get ids of all entries having a token starting with prefix.
+        """
+        if len(prefix) <= SHORT_PREFIX_LEN:
+            return self._short_postings.get(prefix, set())
+        start = bisect.bisect_left(self._tokens, prefix)
+        end = bisect.bisect_left(self._tokens, prefix + '\U0010ffff', start)
+        if end - start == 1:
+            return self._postings[self._tokens[start]]
+        postings = self._postings
+        return set().union(*[postings[token] for token in self._tokens[start:end]])
+
+    def search(self, query: str) -> list:
+        """
+        Get ids of entries matching every token of query as a prefix, in ascending order.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+        matches = None
+        # start from the longest terms, which usually match the fewest entries
+        for term in sorted(set(terms), key=len, reverse=True):
+            ids = self._prefix_ids(term)
+            matches = set(ids) if matches is None else matches & ids
+            if not matches:
+                return []
+        return sorted(matches)
+
+if __name__ == '__main__':
+    index = PrefixIndex()
+    index.add(1, 'gmail', 'google.com', 'freedempire', 'gmail account')
+    index.add(2, 'trust wallet', 'trustwallet.com', 'tony', None)
+    print(index.search('g'), index.search('goo acc'), index.search('tr'), index.search('xyz'))
+    index.remove(1)
+    print(index.search('g'))
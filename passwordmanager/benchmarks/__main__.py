@@ -0,0 +1,50 @@
+"""
+Run the benchmarks from the passwordmanager directory:
+    python -m benchmarks run --sizes 1000 10000 100000 --output results.json
+    python -m benchmarks compare baseline.json results.json
+Both exit with status 1 if a benchmark regressed against the baseline.
+"""
+
+import argparse
+import sys
+from benchmarks.suite import *
+
+def print_comparison(comparison: list) -> bool:
+    """
+    Print the comparison table.
+    :return: True if any benchmark regressed
+    """
+    width = max((len(row[0]) for row in comparison), default=10)
+    for name, before, after, ratio, regressed in comparison:
+        print(f'{name:<{width}}  {before * 1000:10.3f}ms  {after * 1000:10.3f}ms  {ratio:6.2f}x  {"REGRESSION" if regressed else ""}')
+    return any(row[4] for row in comparison)
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Password manager benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help='run the benchmarks')
+    run.add_argument('--sizes', type=int, nargs='+', default=list(BENCHMARK_SIZES), help='vault sizes in rows')
+    run.add_argument('--repeat', type=int, default=BENCHMARK_REPEAT, help='samples per benchmark')
+    run.add_argument('--field-size', type=int, default=16, help='approximate length of each entry field')
+    run.add_argument('--output', help='write the results as JSON to this file')
+    run.add_argument('--baseline', help='compare the results against this JSON file')
+    run.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD, help='slowdown flagged as regression, 0.2 for 20%%')
+    compare = commands.add_parser('compare', help='compare two result files')
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD, help='slowdown flagged as regression, 0.2 for 20%%')
+    args = parser.parse_args(argv)
+
+    if args.command == 'compare':
+        return int(print_comparison(compare_results(load_results(args.baseline), load_results(args.current), args.threshold)))
+    results = run_suite(tuple(args.sizes), args.repeat, args.field_size, progress=lambda stage: print(f'benchmarking {stage}', file=sys.stderr))
+    if args.output:
+        save_results(results, args.output)
+    for name, result in results['results'].items():
+        print(f'{name:<32}  {result["median"] * 1000:10.3f}ms')
+    if args.baseline:
+        return int(print_comparison(compare_results(load_results(args.baseline), results, args.threshold)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
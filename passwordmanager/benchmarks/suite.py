@@ -0,0 +1,160 @@
+"""
+Functions relating to timing the crypto backend and the database operations, and comparing results against a baseline
+"""
+
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Optional
+from backend.password_hashing import hash_password
+from backend.message_encrypting import encrypt_message, decrypt_message, encrypt_record, decrypt_record, RECORD_SCHEME_VAULT
+from backend.password_utils import generate_password, generate_passwords, generate_passphrases, check_password_strength
+from database.pm_database import PMDatabase
+from benchmarks.synthetic_vault import build_vault, synthetic_entry, VAULT_PASSWORD
+
+BENCHMARK_SIZES = (1000, 10000, 100000)
+BENCHMARK_REPEAT = 5
+# startup paths timed in a fresh interpreter each: python arguments, run from the repository root
+STARTUP_COMMANDS = {
+    'startup[python]': ('-c', 'pass'),
+    # everything pmapp.py imports before the login window is painted
+    'startup[login window]': ('-c', 'import sys; sys.path.insert(0, "passwordmanager"); import tkinter, view.entry_frame, view.task_executor'),
+    'startup[database]': ('-c', 'import sys; sys.path.insert(0, "passwordmanager"); import database.pm_database'),
+    'startup[cli generate]': ('-m', 'passwordmanager', 'generate'),
+}
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# a benchmark is a regression if its median is this much slower than the baseline's
+REGRESSION_THRESHOLD = 0.2
+
+def time_calls(fn: Callable, repeat: int = BENCHMARK_REPEAT, number: int = 1, setup: Optional[Callable] = None) -> dict:
+    """
+    Time repeat samples of number calls of fn each, setup is called untimed before every sample.
+    :return: seconds per call of the fastest, median and mean sample
+    """
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    return {'calls': repeat * number, 'min': min(samples), 'median': statistics.median(samples), 'mean': statistics.fmean(samples)}
+
+def bench_crypto(repeat: int = BENCHMARK_REPEAT) -> dict:
+    """
+    Time the crypto backend functions, which do not depend on the vault size.
+    """
+    vault_key = os.urandom(32)
+    token, salt = encrypt_message('Tr0ub4dor&3', VAULT_PASSWORD)
+    record_token, record_salt = encrypt_record('Tr0ub4dor&3', vault_key)
+    fernet_token, fernet_salt = encrypt_record('Tr0ub4dor&3', vault_key, scheme=RECORD_SCHEME_VAULT)
+    results = {
+        'hash_password': time_calls(lambda: hash_password(VAULT_PASSWORD), repeat),
+        'encrypt_message': time_calls(lambda: encrypt_message('Tr0ub4dor&3', VAULT_PASSWORD), repeat),
+        'decrypt_message': time_calls(lambda: decrypt_message(token, VAULT_PASSWORD, salt), repeat),
+        'encrypt_record': time_calls(lambda: encrypt_record('Tr0ub4dor&3', vault_key), repeat, 1000),
+        'decrypt_record': time_calls(lambda: decrypt_record(record_token, vault_key, record_salt), repeat, 1000),
+        # legacy Fernet records, still read and written by older versions
+        'encrypt_record_fernet': time_calls(lambda: encrypt_record('Tr0ub4dor&3', vault_key, scheme=RECORD_SCHEME_VAULT), repeat, 1000),
+        'decrypt_record_fernet': time_calls(lambda: decrypt_record(fernet_token, vault_key, fernet_salt), repeat, 1000),
+        'generate_password': time_calls(generate_password, repeat, 1000),
+        'generate_passwords[1000]': time_calls(lambda: generate_passwords(1000), repeat),
+        'generate_passphrases[1000]': time_calls(lambda: generate_passphrases(1000), repeat),
+        # run on every keystroke in the password input, the dictionaries are loaded by the first call
+        'check_password_strength': time_calls(lambda: check_password_strength('Tr0ub4dor&3', ('bank.example', 'john.doe')), repeat, 100),
+        # the longest analysed, with a repeat, dates and dictionary words at every position
+        'check_password_strength[repeat]': time_calls(lambda: check_password_strength('1987' * 16), repeat, 100),
+    }
+    # stored size of the token of an 11-character password
+    results['encrypt_record']['token_bytes'] = len(record_token)
+    results['encrypt_record_fernet']['token_bytes'] = len(fernet_token)
+    return results
+
+def bench_startup(repeat: int = BENCHMARK_REPEAT) -> dict:
+    """
+    Time the startup paths, each in a fresh interpreter so that nothing is imported beforehand.
+    Paths that cannot run here, e.g. the GUI without tkinter, are left out.
+    """
+    results = {}
+    for name, args in STARTUP_COMMANDS.items():
+        run = lambda: subprocess.run((sys.executable, *args), cwd=ROOT_DIRECTORY, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode
+        if run() == 0:
+            results[name] = time_calls(run, repeat)
+    return results
+
+def bench_database(path: str, rows: int, repeat: int = BENCHMARK_REPEAT, field_size: int = 16) -> dict:
+    """
+    Build a vault of rows entries at path and time the PMDatabase operations on it.
+    """
+    username = build_vault(path, rows=rows, field_size=field_size)[0]
+    rng = random.Random(rows)
+    pmd = PMDatabase(path)
+    results = {'user_login': time_calls(lambda: pmd.user_login(username, VAULT_PASSWORD), repeat, setup=pmd.user_logout)}
+    ids = [row[0] for row in pmd._con.execute('SELECT id FROM password')]
+    results['show_all_passwords'] = time_calls(pmd.show_all_passwords, repeat)
+    results['search_password'] = time_calls(lambda: pmd.search_password('mail'), repeat)
+    results['add_new_password'] = time_calls(lambda: pmd.add_new_password(*synthetic_entry(rng, field_size)), repeat, 20)
+    results['update_password'] = time_calls(lambda: pmd.update_password(rng.choice(ids), *synthetic_entry(rng, field_size)), repeat, 20)
+    pmd.user_logout()
+    pmd._con.close()
+    return results
+
+def run_suite(sizes: tuple = BENCHMARK_SIZES, repeat: int = BENCHMARK_REPEAT, field_size: int = 16,
+              progress: Optional[Callable[[str], None]] = None) -> dict:
+    """
+    Run all benchmarks, database ones once per vault size, each vault built in a temporary directory.
+    :return: environment info and results keyed by benchmark name, with the vault size in brackets
+    """
+    results = {}
+    if progress is not None:
+        progress('startup')
+    results.update(bench_startup(repeat))
+    if progress is not None:
+        progress('crypto')
+    results.update(bench_crypto(repeat))
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in sizes:
+            if progress is not None:
+                progress(f'database with {rows} rows')
+            for name, result in bench_database(os.path.join(directory, f'{rows}.db'), rows, repeat, field_size).items():
+                results[f'{name}[{rows}]'] = result
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+def compare_results(baseline: dict, current: dict, threshold: float = REGRESSION_THRESHOLD) -> list:
+    """
+    Compare the medians of the benchmarks present in both results.
+    :return: (name, baseline median, current median, ratio, regressed) of each benchmark
+    """
+    comparison = []
+    for name, result in current['results'].items():
+        if name in baseline['results']:
+            before, after = baseline['results'][name]['median'], result['median']
+            ratio = after / before if before > 0 else float('inf')
+            comparison.append((name, before, after, ratio, ratio > 1 + threshold))
+    return comparison
+
+def load_results(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+def save_results(results: dict, path: str) -> None:
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
@@ -0,0 +1,52 @@
+"""
+Functions relating to building synthetic vaults for benchmarking
+"""
+
+import random
+import string
+from database.pm_database import PMDatabase
+
+# words the synthetic fields are made of, so that searching them behaves like searching real entries
+VAULT_WORDS = ('mail', 'bank', 'shop', 'cloud', 'work', 'home', 'game', 'music', 'photo', 'video', 'news', 'travel',
+               'social', 'forum', 'wallet', 'crypto', 'school', 'health', 'admin', 'server', 'router', 'backup', 'dev', 'test')
+VAULT_DOMAINS = ('com', 'org', 'net', 'io', 'dev')
+VAULT_PASSWORD = 'benchmark'
+
+def synthetic_entry(rng: random.Random, field_size: int = 16) -> tuple:
+    """
+    Make a random entry of (description, site, account_id, password, notes), with fields of about field_size characters.
+    """
+    def words(size: int) -> str:
+        text = []
+        while sum(len(word) + 1 for word in text) < size:
+            text.append(rng.choice(VAULT_WORDS) + str(rng.randrange(100)))
+        return ' '.join(text)
+    description = words(field_size)
+    site = f'{description.split()[0]}.{rng.choice(VAULT_DOMAINS)}'
+    account_id = ''.join(rng.choices(string.ascii_lowercase + string.digits, k=field_size)) + '@' + site
+    password = ''.join(rng.choices(string.ascii_letters + string.digits + string.punctuation, k=field_size))
+    return description, site, account_id, password, words(field_size * 2)
+
+def build_vault(path: str, users: int = 1, rows: int = 1000, field_size: int = 16, seed: int = 0) -> list:
+    """
+    Build a vault database at path with the given number of users, each having rows entries.
+    Every user's master password is VAULT_PASSWORD.
+    :return: names of the users created
+    """
+    rng = random.Random(seed)
+    pmd = PMDatabase(path)
+    usernames = []
+    for i in range(users):
+        username = f'user{i}'
+        pmd.add_new_user(username, VAULT_PASSWORD)
+        pmd.user_login(username, VAULT_PASSWORD)
+        for start in range(0, rows, 5000):
+            pmd.add_new_passwords([synthetic_entry(rng, field_size) for _ in range(min(5000, rows - start))])
+        pmd.user_logout()
+        usernames.append(username)
+    pmd._con.close()
+    return usernames
+
+if __name__ == '__main__':
+    import sys
+    print(build_vault(sys.argv[1], rows=int(sys.argv[2]) if len(sys.argv) > 2 else 1000))
@@ -0,0 +1,85 @@
+"""
+Snowflake-style id allocation for database rows
+"""
+
+import threading
+import time
+
+# id layout, same as the snowflake ids generated before: milliseconds since the unix epoch, instance, sequence
+INSTANCE_BITS = 10
+SEQUENCE_BITS = 12
+MAX_INSTANCE = (1 << INSTANCE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+class IdAllocator:
+    """
+    Thread-safe allocator of 63-bit ids that increase strictly with every allocation, so they sort by creation time.
+    Up to 4096 ids are allocated per millisecond; beyond that, or when the clock goes backwards,
+    the allocator carries on from the last millisecond it used instead of waiting.
+    """
+    def __init__(self, instance: int, last_id: int = 0):
+        """
+        :param instance: id of this installation, between 0 and 1023
+        :param last_id: the largest id already in use, allocation continues after it
+        """
+        if not 0 <= instance <= MAX_INSTANCE:
+            raise ValueError(f'Instance id must be between 0 and {MAX_INSTANCE}')
+        self._instance = instance
+        self._lock = threading.Lock()
+        self._last_ms = max(last_id, 0) >> (INSTANCE_BITS + SEQUENCE_BITS)
+        self._sequence = MAX_SEQUENCE
+
+    def advance(self, last_id: int) -> None:
+        """
+        Make sure the next id is larger than last_id, e.g. one allocated by another allocator with the same instance id.
+        """
+        with self._lock:
+            if last_id < (self._last_ms << (INSTANCE_BITS + SEQUENCE_BITS)) | (self._instance << SEQUENCE_BITS) | max(self._sequence, 0):
+                return
+            instance = (last_id >> SEQUENCE_BITS) & MAX_INSTANCE
+            self._last_ms = last_id >> (INSTANCE_BITS + SEQUENCE_BITS)
+            if instance == self._instance:
+                self._sequence = last_id & MAX_SEQUENCE
+            else:
+                # a smaller instance id leaves the whole sequence of that millisecond, a larger one none of it
+                self._sequence = -1 if instance < self._instance else MAX_SEQUENCE
+
+    def next_id(self) -> int:
+        return self.reserve(1)[0]
+
+    def reserve(self, count: int) -> list:
+        """
+        Reserve a block of count ids at once, e.g. for a bulk insert.
+        :return: the ids in ascending order
+        """
+        ids = []
+        with self._lock:
+            now_ms = time.time_ns() // 1_000_000
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._sequence = -1
+            while len(ids) < count:
+                if self._sequence == MAX_SEQUENCE:
+                    # sequence of this millisecond used up, borrow the next one
+                    self._last_ms += 1
+                    self._sequence = -1
+                take = min(count - len(ids), MAX_SEQUENCE - self._sequence)
+                base = (self._last_ms << (INSTANCE_BITS + SEQUENCE_BITS)) | (self._instance << SEQUENCE_BITS)
+                ids.extend(range(base + self._sequence + 1, base + self._sequence + 1 + take))
+                self._sequence += take
+        return ids
+
+def id_timestamp(id: int) -> float:
+    """
+    Get the creation time of an id in seconds since the unix epoch.
+    """
+    return (id >> (INSTANCE_BITS + SEQUENCE_BITS)) / 1000
+
+if __name__ == '__main__':
+    allocator = IdAllocator(1)
+    ids = [allocator.next_id() for _ in range(10000)] + allocator.reserve(100000) + [allocator.next_id()]
+    assert ids == sorted(ids) and len(set(ids)) == len(ids)
+    other = IdAllocator(1)
+    other.advance(ids[-1])
+    assert other.next_id() > ids[-1]
+    print(ids[0], ids[-1], time.time() - id_timestamp(ids[-1]))
@@ -0,0 +1,296 @@
+"""
+Versioned schema migrations of the password database, tracked with PRAGMA user_version
+"""
+
+import logging
+import secrets
+import sqlite3
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+def _table_exists(con: sqlite3.Connection, name: str) -> bool:
+    return con.execute('SELECT 1 FROM sqlite_master WHERE name = ?', (name,)).fetchone() is not None
+
+def _column_exists(con: sqlite3.Connection, table: str, column: str) -> bool:
+    return column in [row[1] for row in con.execute(f'PRAGMA table_info({table})')]
+
+def create_tables(con: sqlite3.Connection) -> None:
+    # databases created before migrations existed already have these tables
+    con.execute('''
+        CREATE TABLE IF NOT EXISTS user(
+            id INTEGER PRIMARY KEY,
+            username TEXT NOT NULL UNIQUE,
+            password BLOB NOT NULL,
+            salt BLOB NOT NULL,
+            timestamp REAL NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    con.execute('''
+        CREATE TABLE IF NOT EXISTS password(
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NUll,
+            description TEXT NOT NULL,
+            site TEXT,
+            account_id TEXT NOT NULL,
+            password BLOB NOT NULL,
+            notes TEXT,
+            salt BLOB NOT NULL,
+            timestamp REAL NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES user(id)
+                ON UPDATE CASCADE
+                ON DELETE CASCADE
+        )
+    ''')
+    # create trigger for updating password entries
+    # ref: https://www.sqlitetutorial.net/sqlite-trigger/
+    #      https://stackoverflow.com/questions/6578439/on-update-current-timestamp-with-sqlite
+    con.execute('''
+        CREATE TRIGGER IF NOT EXISTS password_updated
+        UPDATE OF salt ON password
+        BEGIN
+            UPDATE password SET timestamp = CURRENT_TIMESTAMP WHERE salt = old.salt;
+        END;
+    ''')
+
+def add_record_scheme(con: sqlite3.Connection) -> None:
+    if not _column_exists(con, 'password', 'scheme'):
+        # rows written before the scheme column existed use per-record scrypt keys
+        con.execute('ALTER TABLE password ADD COLUMN scheme INTEGER NOT NULL DEFAULT 1')
+
+def create_import_job(con: sqlite3.Connection) -> None:
+    # checkpoints of bulk imports, so that an interrupted import resumes where it stopped
+    con.execute('''
+        CREATE TABLE IF NOT EXISTS import_job(
+            id TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            rows_done INTEGER NOT NULL DEFAULT 0,
+            timestamp REAL NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, user_id)
+        )
+    ''')
+
+def create_search_index(con: sqlite3.Connection) -> None:
+    """
+    Create the FTS5 full-text index over (description, site, account_id, notes),
+    along with the triggers keeping it in sync with the password table.
+    user_id is indexed as well so that every search is scoped to one user inside the index.
+    Skipped if SQLite is built without FTS5, searching then falls back to a full scan.
+    """
+    if _table_exists(con, 'password_fts'):
+        return
+    try:
+        con.execute('SAVEPOINT fts')
+        # external content table, the index stores no copy of the columns
+        # ref: https://www.sqlite.org/fts5.html#external_content_tables
+        con.execute('''
+            CREATE VIRTUAL TABLE password_fts USING fts5(
+                user_id, description, site, account_id, notes,
+                content='password', content_rowid='id', prefix='2 3'
+            )
+        ''')
+    except sqlite3.OperationalError:
+        con.execute('ROLLBACK TO fts')
+        logger.warning('FTS5 is not available, search_password falls back to a full scan')
+        return
+    finally:
+        con.execute('RELEASE fts')
+    con.execute('''
+        CREATE TRIGGER password_fts_inserted
+        AFTER INSERT ON password
+        BEGIN
+            INSERT INTO password_fts(rowid, user_id, description, site, account_id, notes)
+            VALUES (new.id, new.user_id, new.description, new.site, new.account_id, new.notes);
+        END;
+    ''')
+    con.execute('''
+        CREATE TRIGGER password_fts_deleted
+        AFTER DELETE ON password
+        BEGIN
+            INSERT INTO password_fts(password_fts, rowid, user_id, description, site, account_id, notes)
+            VALUES ('delete', old.id, old.user_id, old.description, old.site, old.account_id, old.notes);
+        END;
+    ''')
+    con.execute('''
+        CREATE TRIGGER password_fts_updated
+        AFTER UPDATE OF user_id, description, site, account_id, notes ON password
+        BEGIN
+            INSERT INTO password_fts(password_fts, rowid, user_id, description, site, account_id, notes)
+            VALUES ('delete', old.id, old.user_id, old.description, old.site, old.account_id, old.notes);
+            INSERT INTO password_fts(rowid, user_id, description, site, account_id, notes)
+            VALUES (new.id, new.user_id, new.description, new.site, new.account_id, new.notes);
+        END;
+    ''')
+    # index the rows already in the password table
+    con.execute("INSERT INTO password_fts(password_fts) VALUES ('rebuild')")
+
+def index_user_id(con: sqlite3.Connection) -> None:
+    # every listing, count and page of entries is per user, the index also covers ORDER BY id as id is the rowid
+    con.execute('CREATE INDEX IF NOT EXISTS password_user_id ON password(user_id)')
+
+def rewrite_password_updated(con: sqlite3.Connection) -> None:
+    # salt is not indexed, so matching the row by old.salt scanned the whole table on every update
+    con.execute('DROP TRIGGER IF EXISTS password_updated')
+    con.execute('''
+        CREATE TRIGGER password_updated
+        AFTER UPDATE OF salt ON password
+        BEGIN
+            UPDATE password SET timestamp = CURRENT_TIMESTAMP WHERE id = new.id;
+        END;
+    ''')
+
+def create_setting(con: sqlite3.Connection) -> None:
+    # per-installation settings, starting with the instance id embedded in every id allocated here
+    con.execute('''
+        CREATE TABLE IF NOT EXISTS setting(
+            key TEXT PRIMARY KEY,
+            value
+        )
+    ''')
+    con.execute("INSERT OR IGNORE INTO setting(key, value) VALUES('instance_id', ?)", (secrets.randbelow(1024),))
+
+def add_row_version(con: sqlite3.Connection) -> None:
+    # incremented on every update, so that an update based on an outdated read is detected
+    if not _column_exists(con, 'password', 'version'):
+        con.execute('ALTER TABLE password ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+
+def create_key_rotation(con: sqlite3.Connection) -> None:
+    # the vault key each row is encrypted with, bumped for all of a user's rows by a master password change
+    for table in ('user', 'password'):
+        if not _column_exists(con, table, 'key_version'):
+            con.execute(f'ALTER TABLE {table} ADD COLUMN key_version INTEGER NOT NULL DEFAULT 0')
+    # a master password change in progress, with the new hash and salt put into user once every row is re-encrypted
+    con.execute('''
+        CREATE TABLE IF NOT EXISTS key_rotation(
+            user_id INTEGER PRIMARY KEY,
+            password BLOB NOT NULL,
+            salt BLOB NOT NULL,
+            key_version INTEGER NOT NULL,
+            rows_done INTEGER NOT NULL DEFAULT 0,
+            timestamp REAL NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES user(id)
+                ON UPDATE CASCADE
+                ON DELETE CASCADE
+        )
+    ''')
+
+def add_kdf_params(con: sqlite3.Connection) -> None:
+    # scrypt parameters of each user's master password hash and vault key, calibrated per machine for new users
+    # existing users and pending key rotations keep the parameters which used to be hard-coded
+    for table in ('user', 'key_rotation'):
+        for column, default in (('kdf_n', 16384), ('kdf_r', 8), ('kdf_p', 1)):
+            if not _column_exists(con, table, column):
+                con.execute(f'ALTER TABLE {table} ADD COLUMN {column} INTEGER NOT NULL DEFAULT {default}')
+
+def add_password_fingerprint(con: sqlite3.Connection) -> None:
+    # keyed fingerprint of each password, so that reused passwords are found with the index instead of decrypting the vault
+    # entries written before are fingerprinted when their user logs in
+    if not _column_exists(con, 'password', 'fingerprint'):
+        con.execute('ALTER TABLE password ADD COLUMN fingerprint BLOB')
+    con.execute('CREATE INDEX IF NOT EXISTS password_fingerprint ON password(user_id, fingerprint)')
+
+def add_wrapped_key(con: sqlite3.Connection) -> None:
+    # random vault key encrypted with the key derived from the master password, NULL for users created before,
+    # whose vault key is the derived key itself until their scrypt parameters or master password change
+    for table in ('user', 'key_rotation'):
+        if not _column_exists(con, table, 'wrapped_key'):
+            con.execute(f'ALTER TABLE {table} ADD COLUMN wrapped_key BLOB')
+
+def add_rotation_keys(con: sqlite3.Connection) -> None:
+    # the new vault key of a master password change wrapped with the old one, and the old one wrapped with the new one,
+    # so that a session opened with either password reads every entry and can finish the change, NULL for changes started before
+    for column in ('pending_key', 'previous_key'):
+        if not _column_exists(con, 'key_rotation', column):
+            con.execute(f'ALTER TABLE key_rotation ADD COLUMN {column} BLOB')
+
+# a probe is timed before and after its migration, inside a savepoint rolled back afterwards
+PROBE_LIST_PASSWORDS = 'SELECT COUNT(*) FROM password WHERE user_id = (SELECT user_id FROM password ORDER BY id DESC LIMIT 1)'
+PROBE_UPDATE_PASSWORD = 'UPDATE password SET salt = salt WHERE id = (SELECT MAX(id) FROM password)'
+
+# (version, description, migration, probe), the version becomes PRAGMA user_version once the migration is committed
+MIGRATIONS = [
+    (1, 'create user and password tables', create_tables, None),
+    (2, 'add record encryption scheme to password', add_record_scheme, None),
+    (3, 'create import_job table', create_import_job, None),
+    (4, 'create password_fts full-text index', create_search_index, None),
+    (5, 'index password by user_id', index_user_id, PROBE_LIST_PASSWORDS),
+    (6, 'match the row by id in trigger password_updated', rewrite_password_updated, PROBE_UPDATE_PASSWORD),
+    (7, 'create setting table with the instance id', create_setting, None),
+    (8, 'add row version to password', add_row_version, None),
+    (9, 'add key versions and key_rotation table', create_key_rotation, None),
+    (10, 'add scrypt parameters to user and key_rotation', add_kdf_params, None),
+    (11, 'add password fingerprint to password with its index', add_password_fingerprint, None),
+    (12, 'add wrapped vault key to user and key_rotation', add_wrapped_key, None),
+    (13, 'add the vault keys wrapped with each other to key_rotation', add_rotation_keys, None),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def _time_probe(con: sqlite3.Connection, probe: str) -> float:
+    con.execute('SAVEPOINT probe')
+    start = time.perf_counter()
+    try:
+        con.execute(probe).fetchall()
+        return time.perf_counter() - start
+    finally:
+        con.execute('ROLLBACK TO probe')
+        con.execute('RELEASE probe')
+
+def migrate(con: sqlite3.Connection, target: int = SCHEMA_VERSION) -> int:
+    """
+    Upgrade the database in place to the target schema version, one transaction per migration,
+    so an interrupted upgrade leaves the database at the last completed version.
+    Each migration is recorded in the schema_migration table with its duration and probe timings.
+    :return: number of migrations applied
+    """
+    version = con.execute('PRAGMA user_version').fetchone()[0]
+    applied = 0
+    for migration_version, description, migration, probe in MIGRATIONS:
+        if migration_version <= version or migration_version > target:
+            continue
+        # take the write lock up front, another process may be upgrading the same database
+        con.execute('BEGIN IMMEDIATE')
+        try:
+            version = con.execute('PRAGMA user_version').fetchone()[0]
+            if migration_version <= version:
+                con.rollback()
+                continue
+            before = _time_probe(con, probe) if probe else None
+            start = time.perf_counter()
+            migration(con)
+            seconds = time.perf_counter() - start
+            after = _time_probe(con, probe) if probe else None
+            con.execute('''
+                CREATE TABLE IF NOT EXISTS schema_migration(
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    seconds REAL NOT NULL,
+                    probe_before REAL,
+                    probe_after REAL,
+                    timestamp REAL NOT NULL DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            con.execute('INSERT OR REPLACE INTO schema_migration(version, description, seconds, probe_before, probe_after) VALUES(?, ?, ?, ?, ?)',
+                        (migration_version, description, seconds, before, after))
+            # PRAGMA does not take parameters, the version is an int from MIGRATIONS
+            con.execute(f'PRAGMA user_version = {migration_version}')
+            con.commit()
+        except:
+            con.rollback()
+            raise
+        applied += 1
+        if probe:
+            logger.info('migration %d (%s) took %.3fs, probe %.3fms before, %.3fms after',
+                        migration_version, description, seconds, before * 1000, after * 1000)
+        else:
+            logger.info('migration %d (%s) took %.3fs', migration_version, description, seconds)
+    return applied
+
+def migration_log(con: sqlite3.Connection) -> list:
+    """
+    Get (version, description, seconds, probe_before, probe_after, timestamp) of the applied migrations.
+    """
+    if not _table_exists(con, 'schema_migration'):
+        return []
+    return con.execute('SELECT version, description, seconds, probe_before, probe_after, timestamp FROM schema_migration ORDER BY version').fetchall()
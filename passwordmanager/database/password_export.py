@@ -0,0 +1,136 @@
+"""
+Functions relating to exporting passwords as JSON Lines or CSV, optionally encrypted with a passphrase
+"""
+
+import csv
+import io
+import json
+import os
+import struct
+import time
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from typing import BinaryIO, Callable, Iterator, Optional
+from backend.password_hashing import hash_password
+from database.pm_database import PMDatabase
+
+EXPORT_FORMATS = ('jsonl', 'csv')
+EXPORT_FIELDS = ('id', 'description', 'site', 'account_id', 'password', 'notes', 'timestamp')
+# number of entries decrypted and written at a time
+EXPORT_CHUNK_SIZE = 1000
+
+# encrypted export file: magic, scrypt salt, nonce prefix, then frames of 4-byte length and AES-GCM ciphertext
+ENCRYPTED_MAGIC = b'PMEXPORT\x01'
+ENCRYPTED_FRAME_SIZE = 1 << 16
+
+class EncryptedWriter:
+    """
+    Encrypts a byte stream with a key derived from a passphrase, frame by frame, in constant memory.
+    Each frame's nonce is the nonce prefix, the frame number and a flag marking the last frame
+    (the STREAM construction), so frames cannot be reordered, dropped or truncated unnoticed.
+    """
+    def __init__(self, f: BinaryIO, passphrase: str):
+        self.f = f
+        key, salt = hash_password(passphrase)
+        self.aead = AESGCM(key)
+        self.prefix = os.urandom(7)
+        self.counter = 0
+        self.buffer = bytearray()
+        self.f.write(ENCRYPTED_MAGIC + salt + self.prefix)
+
+    def write(self, data: bytes) -> None:
+        self.buffer += data
+        while len(self.buffer) > ENCRYPTED_FRAME_SIZE:
+            self._write_frame(bytes(self.buffer[:ENCRYPTED_FRAME_SIZE]), False)
+            del self.buffer[:ENCRYPTED_FRAME_SIZE]
+
+    def close(self) -> None:
+        self._write_frame(bytes(self.buffer), True)
+        self.buffer.clear()
+
+    def _write_frame(self, data: bytes, last: bool) -> None:
+        frame = self.aead.encrypt(frame_nonce(self.prefix, self.counter, last), data, None)
+        self.f.write(struct.pack('>I', len(frame)) + frame)
+        self.counter += 1
+
+def frame_nonce(prefix: bytes, counter: int, last: bool) -> bytes:
+    return prefix + struct.pack('>I?', counter, last)
+
+def read_encrypted_export(path: str, passphrase: str) -> Iterator[bytes]:
+    """
+    Decrypt an encrypted export frame by frame.
+    :raise ValueError: if the file is not an encrypted export, the passphrase is wrong or the file is damaged
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(ENCRYPTED_MAGIC)) != ENCRYPTED_MAGIC:
+            raise ValueError('Not an encrypted export')
+        salt, prefix = f.read(32), f.read(7)
+        aead = AESGCM(hash_password(passphrase, salt)[0])
+        counter = 0
+        while True:
+            header = f.read(4)
+            if len(header) < 4:
+                raise ValueError('Export is truncated')
+            frame = f.read(struct.unpack('>I', header)[0])
+            # the last frame is the one followed by the end of the file
+            last = not f.peek(1)
+            try:
+                yield aead.decrypt(frame_nonce(prefix, counter, last), frame, None)
+            except Exception as e:
+                raise ValueError('Wrong passphrase or damaged export') from e
+            if last:
+                return
+            counter += 1
+
+def format_chunk(rows: list, format: str, header: bool) -> bytes:
+    """
+    Serialize decrypted rows of (id, description, site, account_id, password, notes, timestamp, salt, version).
+    """
+    if format == 'jsonl':
+        # the id as a string like PasswordRecord.as_dict(), since it exceeds the integer precision of many JSON readers
+        return ''.join(json.dumps(dict(zip(EXPORT_FIELDS, (str(row[0]), *row[1:]))), ensure_ascii=False) + '\n'
+                       for row in rows).encode()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_FIELDS)
+    writer.writerows(row[:len(EXPORT_FIELDS)] for row in rows)
+    return buffer.getvalue().encode()
+
+def export_passwords(pmd: PMDatabase, path: str, format: str = 'jsonl', passphrase: Optional[str] = None,
+                     chunk_size: int = EXPORT_CHUNK_SIZE, workers: Optional[int] = 1,
+                     progress: Optional[Callable[[int, int], None]] = None) -> dict:
+    """
+    Export all password entries of the current user, decrypting and writing one chunk at a time,
+    so memory use does not grow with the size of the vault.
+    :param format: 'jsonl' or 'csv' (readable by the generic CSV import)
+    :param passphrase: if given, the whole export is encrypted with it, see read_encrypted_export()
+    :param progress: called with (rows written, bytes written) after each chunk
+    :return: rows and bytes written, seconds taken, and throughput in rows/s and MB/s
+    """
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f'Unknown export format {format}')
+    start = time.perf_counter()
+    rows = size = 0
+    with open(path, 'wb') as f:
+        sink = EncryptedWriter(f, passphrase) if passphrase else f
+        for chunk in pmd.iter_passwords(chunk_size, workers=workers):
+            data = format_chunk(chunk, format, rows == 0)
+            sink.write(data)
+            rows += len(chunk)
+            size += len(data)
+            if progress is not None:
+                progress(rows, size)
+        if format == 'csv' and rows == 0:
+            data = format_chunk([], format, True)
+            sink.write(data)
+            size += len(data)
+        if passphrase:
+            sink.close()
+    seconds = max(time.perf_counter() - start, 1e-9)
+    return {'rows': rows, 'bytes': size, 'seconds': seconds, 'rows_per_s': rows / seconds, 'mb_per_s': size / seconds / 1e6}
+
+if __name__ == '__main__':
+    import sys
+    pmd = PMDatabase()
+    if pmd.user_login(sys.argv[1], sys.argv[2]):
+        print(export_passwords(pmd, sys.argv[3], sys.argv[4] if len(sys.argv) > 4 else 'jsonl'))
@@ -0,0 +1,132 @@
+"""
+Functions relating to importing passwords from CSV exports of browsers and other password managers
+"""
+
+import csv
+import hashlib
+import os
+from typing import Callable, Iterator, Optional
+from urllib.parse import urlsplit
+from database.pm_database import PMDatabase
+
+# number of entries encrypted and inserted per transaction
+IMPORT_BATCH_SIZE = 5000
+
+# column of each field (description, site, account_id, password, notes) in the supported CSV formats
+IMPORT_FORMATS = {
+    'generic': ('description', 'site', 'account_id', 'password', 'notes'),
+    'chrome': ('name', 'url', 'username', 'password', 'note'),
+    'firefox': (None, 'url', 'username', 'password', None),
+    'bitwarden': ('name', 'login_uri', 'login_username', 'login_password', 'notes'),
+    'keepass': ('Title', 'URL', 'Username', 'Password', 'Notes'),
+    'keepass2': ('Account', 'Web Site', 'Login Name', 'Password', 'Comments'),
+}
+
+class ImportSource:
+    """
+    Streams the rows of a CSV file as dicts, keeping count of the bytes read for progress report.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.bytes_read = 0
+
+    def job_id(self) -> str:
+        """
+        Identify the file by its content, so that an import can be resumed even if the file is moved.
+        """
+        digest = hashlib.sha256()
+        with open(self.path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _lines(self, f) -> Iterator[str]:
+        self.bytes_read = 0
+        for line in f:
+            # strip the byte order mark some exporters write at the beginning of the file
+            yield line.decode('utf-8-sig' if self.bytes_read == 0 else 'utf-8')
+            self.bytes_read += len(line)
+
+    def rows(self) -> Iterator[dict]:
+        with open(self.path, 'rb') as f:
+            yield from csv.DictReader(self._lines(f))
+
+    def header(self) -> list:
+        with open(self.path, 'rb') as f:
+            return next(csv.reader(self._lines(f)), [])
+
+def detect_format(header: list) -> Optional[str]:
+    """
+    Detect the CSV format by its header.
+    """
+    columns = set(header)
+    # firefox has a subset of the columns of chrome, so check chrome first
+    for format in ('bitwarden', 'keepass2', 'keepass', 'chrome', 'firefox', 'generic'):
+        required = {column for column in IMPORT_FORMATS[format][:4] if column is not None}
+        if required <= columns:
+            return format
+    return None
+
+def map_row(row: dict, format: str) -> Optional[tuple]:
+    """
+    Map a CSV row to an entry of (description, site, account_id, password, notes).
+    :return: the entry, or None if the row lacks account ID or password, or is not a login
+    """
+    if format == 'bitwarden' and row.get('type', 'login') != 'login':
+        return None
+    description, site, account_id, password, notes = ((row.get(column) or '') if column else '' for column in IMPORT_FORMATS[format])
+    if not (account_id and password):
+        return None
+    # description must not be empty, fall back to the host name of the site
+    if not description:
+        description = urlsplit(site).hostname or site or account_id
+    return description.strip(), site.strip(), account_id.strip(), password, notes.strip()
+
+def import_passwords(pmd: PMDatabase, path: str, format: Optional[str] = None, batch_size: int = IMPORT_BATCH_SIZE,
+                     workers: Optional[int] = None, progress: Optional[Callable[[int, int, int], None]] = None) -> dict:
+    """
+    Import password entries from a CSV file into the current user's vault.
+    Entries are encrypted in parallel and inserted batch by batch, each batch in one transaction along with a
+    checkpoint, so running the same import again after an interruption skips the rows already imported.
+    :param format: one of IMPORT_FORMATS, detected from the header if not given
+    :param progress: called with (rows read, bytes read, bytes total) after each batch
+    :return: counts of imported, skipped and previously imported rows
+    """
+    source = ImportSource(path)
+    if format is None:
+        format = detect_format(source.header())
+        if format is None:
+            raise ValueError(f'Unknown CSV format of {path}')
+    job_id = source.job_id()
+    resumed = pmd.get_import_checkpoint(job_id)
+    imported = skipped = rows_read = 0
+    batch = []
+    for row in source.rows():
+        rows_read += 1
+        if rows_read <= resumed:
+            continue
+        entry = map_row(row, format)
+        if entry is None:
+            skipped += 1
+        else:
+            batch.append(entry)
+        if len(batch) >= batch_size:
+            imported += pmd.add_new_passwords(batch, workers=workers, checkpoint=(job_id, rows_read))
+            batch = []
+            if progress is not None:
+                progress(rows_read, source.bytes_read, source.size)
+    imported += pmd.add_new_passwords(batch, workers=workers, checkpoint=(job_id, rows_read))
+    pmd.finish_import(job_id)
+    if progress is not None:
+        progress(rows_read, source.bytes_read, source.size)
+    return {'imported': imported, 'skipped': skipped, 'resumed': resumed}
+
+if __name__ == '__main__':
+    import sys
+    import time
+    pmd = PMDatabase()
+    if pmd.user_login(sys.argv[1], sys.argv[2]):
+        start = time.perf_counter()
+        print(import_passwords(pmd, sys.argv[3], progress=lambda rows, done, total: print(f'{rows} rows, {done / max(total, 1):.0%}')))
+        print(f'{time.perf_counter() - start:.2f}s')
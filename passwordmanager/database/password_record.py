@@ -0,0 +1,45 @@
+"""
+Password record returned by PMDatabase in lazy result mode
+"""
+
+from typing import Callable, Optional
+
+class PasswordRecord:
+    """
+    A password entry holding the encrypted token and salt instead of the plaintext password.
+    The password is only decrypted when the password attribute is accessed, and it is never kept by the record itself.
+    """
+    __slots__ = ('id', 'description', 'site', 'account_id', 'notes', 'timestamp', 'salt', 'version', '_token', '_decrypt')
+
+    def __init__(self, row: tuple, decrypt: Callable[[int, bytes, bytes], Optional[str]]) -> None:
+        """
+        :param row: a row of (id, description, site, account_id, password token, notes, timestamp, salt, version)
+        :param decrypt: function taking id, token and salt and returning the plaintext password
+        """
+        self.id, self.description, self.site, self.account_id, self._token, self.notes, self.timestamp, self.salt, self.version = row
+        self._decrypt = decrypt
+
+    @property
+    def password(self) -> Optional[str]:
+        return self._decrypt(self.id, self._token, self.salt)
+
+    def values(self, password: Optional[str] = None) -> tuple:
+        """
+        Get the record as a row in the same column order as the eager result mode, without decrypting.
+        :param password: text to put in the password column, e.g. a mask
+        """
+        return self.id, self.description, self.site, self.account_id, password, self.notes, self.timestamp
+
+    def as_dict(self, password: bool = False) -> dict:
+        """
+        Get the record as a dict for JSON output, with the id as a string since it exceeds the integer precision of many JSON readers.
+        :param password: include the decrypted password
+        """
+        entry = {'id': str(self.id), 'description': self.description, 'site': self.site, 'account_id': self.account_id}
+        if password:
+            entry['password'] = self.password
+        entry['notes'], entry['timestamp'], entry['version'] = self.notes, self.timestamp, self.version
+        return entry
+
+    def __repr__(self) -> str:
+        return f'PasswordRecord(id={self.id!r}, description={self.description!r}, account_id={self.account_id!r})'
@@ -1,63 +1,110 @@
 import sqlite3
+import hmac
+import functools
+import logging
 import os
+import platform
+import random
+import threading
+import time
 from backend.password_hashing import *
 from backend.message_encrypting import *
-import snowflake
-from random import randint
-from typing import Optional
+from backend.batch_crypto import decrypt_batch, encrypt_batch, reencrypt_batch, fingerprint_batch
+from backend.instrumentation import instrumented, record_rows
+import backend.instrumentation as instrumentation
+from backend.search_index import PrefixIndex
+from database.password_record import PasswordRecord
+from database.migrations import migrate
+from database.id_allocator import IdAllocator
+from database.record_cache import RecordCache
+from typing import Any, Callable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+def synchronized(method: Callable) -> Callable:
+    """
+    Decorator serializing calls to a PMDatabase method, as the connection and the index are shared across threads.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+# database file used when PMDatabase is given no path, relative to the working directory
+DATABASE_PATH = 'pmd.db'
+# seconds a statement waits for another connection to release the write lock
+BUSY_TIMEOUT = 5.0
+# a write transaction still finding the database locked after the busy timeout is retried with exponential backoff
+BUSY_RETRIES = 4
+BUSY_RETRY_DELAY = 0.05
+# decrypted passwords kept in memory for repeated access within a session, see RecordCache
+RECORD_CACHE_SIZE = 256
+RECORD_CACHE_TTL = 300.0
+# rows re-encrypted per transaction by a master password change, each transaction also advances its checkpoint
+ROTATION_BATCH_SIZE = 2000
+# the largest id of a user or an entry, ids of both come from the same allocator
+LAST_ID_QUERY = 'SELECT MAX(id) FROM (SELECT MAX(id) AS id FROM user UNION ALL SELECT MAX(id) FROM password)'
+# kinds of change events, see PMDatabase.subscribe()
+ENTRIES_INSERTED = 'inserted'
+ENTRIES_UPDATED = 'updated'
+ENTRIES_DELETED = 'deleted'
+
+class UpdateConflictError(Exception):
+    """
+    Raised by update_password when the entry has been changed or deleted since the given version was read.
+    """
+    def __init__(self, id: int):
+        super().__init__(f'Entry {id} has been changed or deleted by someone else')
+        self.id = id
+
+class VaultKeyChangedError(Exception):
+    """
+    Raised inside a write transaction when the master password has been changed by another session since logging in,
+    so that no entry is written with the old vault key.
+    """
 
 class PMDatabase:
-    def __init__(self) -> None:
-        # only check if database exists and is connectable
-        self._db_exists = os.path.isfile('pmd.db')
+    def __init__(self, path: str = DATABASE_PATH, busy_timeout: float = BUSY_TIMEOUT,
+                 cache_size: int = RECORD_CACHE_SIZE, cache_ttl: float = RECORD_CACHE_TTL) -> None:
+        """
+        :param path: database file, shared safely by several processes, e.g. the app and a script
+        :param busy_timeout: seconds to wait for the write lock held by another process
+        :param cache_size: number of decrypted passwords cached for the session, 0 to never keep plaintext in memory
+        :param cache_ttl: seconds a decrypted password stays cached
+        """
         try:
-            self._con = sqlite3.connect('pmd.db')
+            # the connection may be used from a background worker thread, calls are serialized with self._lock
+            # writes begin with BEGIN IMMEDIATE, so a transaction never fails halfway on upgrading its read lock
+            self._con = sqlite3.connect(path, timeout=busy_timeout, isolation_level='IMMEDIATE', check_same_thread=False)
         except Exception as e:
             raise RuntimeError('Failed to open database') from e
-        else:
-            if not self._db_exists:
-                # create user table
-                # CREATE TABLE IF NOT EXISTS user ...
-                self._con.execute('''
-                    CREATE TABLE user(
-                        id INTEGER PRIMARY KEY,
-                        username TEXT NOT NULL UNIQUE,
-                        password BLOB NOT NULL,
-                        salt BLOB NOT NULL,
-                        timestamp REAL NOT NULL DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                # create password table
-                self._con.execute('''
-                    CREATE TABLE password(
-                        id INTEGER PRIMARY KEY,
-                        user_id INTEGER NOT NUll,
-                        description TEXT NOT NULL,
-                        site TEXT,
-                        account_id TEXT NOT NULL,
-                        password BLOB NOT NULL,
-                        notes TEXT,
-                        salt BLOB NOT NULL,
-                        timestamp REAL NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (user_id) REFERENCES user(id)
-                            ON UPDATE CASCADE
-                            ON DELETE CASCADE
-                    )
-                ''')
-                # create trigger for updating password entries
-                # ref: https://www.sqlitetutorial.net/sqlite-trigger/
-                #      https://stackoverflow.com/questions/6578439/on-update-current-timestamp-with-sqlite
-                self._con.execute('''
-                    CREATE TRIGGER password_updated
-                    UPDATE OF salt ON password
-                    BEGIN
-                        UPDATE password SET timestamp = CURRENT_TIMESTAMP WHERE salt = old.salt;
-                    END;
-                ''')
-            self._userinfo = dict()
-            self._login = False
-
+        try:
+            # in WAL mode readers never block the writer and the writer never blocks readers
+            # the mode is stored in the database file, so this is a no-op after the first time
+            self._con.execute('PRAGMA journal_mode = WAL')
+        except sqlite3.OperationalError:
+            logger.warning('Failed to switch %s to WAL mode, another process is using it', path)
+        try:
+            # create or upgrade the schema in place
+            migrate(self._con)
+        except Exception as e:
+            raise RuntimeError('Failed to upgrade database') from e
+        self._fts = self._con.execute("SELECT 1 FROM sqlite_master WHERE name = 'password_fts'").fetchone() is not None
+        # ids of users and entries come from one allocator, continuing after the largest id in use
+        # in case the clock has gone backwards since they were allocated
+        instance_id = self._con.execute("SELECT value FROM setting WHERE key = 'instance_id'").fetchone()[0]
+        last_id = self._con.execute(LAST_ID_QUERY).fetchone()[0]
+        self._ids = IdAllocator(instance_id, last_id or 0)
+        self._userinfo = dict()
+        self._login = False
+        # prefix index over the non-secret fields of the current user's entries, for filtering while typing
+        self._index = PrefixIndex()
+        self._lock = threading.RLock()
+        self._subscribers = []
+        self._cache = RecordCache(cache_size, cache_ttl)
 
+    @instrumented
     def user_login(self, username: str, password: str) -> bool:
         """
         Log into the app with provided username and password.
@@ -65,153 +112,838 @@ class PMDatabase:
         """
         # first check login status and user existence
         if (not self._login) and self.user_exists(username):
-            res = self._con.execute('SELECT id, username, password, salt, timestamp FROM user WHERE username = ?', (username,)).fetchone()
-            # check if password is correct
-            if is_correct_password(password, res[2], res[3]):
-                self._userinfo['userid'], self._userinfo['username'], *_, self._userinfo['usertimestamp'] = res
-                self._userinfo['userpassword'] = password
-                self._login = True
-                return True
+            with self._lock:
+                res = self._con.execute('SELECT id, username, password, salt, timestamp, key_version, kdf_n, kdf_r, kdf_p, wrapped_key FROM user WHERE username = ?',
+                                        (username,)).fetchone()
+            # check if password is correct, the key unwrapping the vault key comes out of the same scrypt run
+            # scrypt runs without holding the lock, so other threads can still use the database meanwhile
+            params = tuple(res[6:9])
+            password_hash, key_encryption_key = hash_password_with_key(password, res[3], params)
+            if hmac.compare_digest(password_hash, res[2]):
+                vault_key = unwrap_key(res[9], key_encryption_key)
+                if vault_key is None:
+                    logger.error('The vault key of %s cannot be decrypted', username)
+                    return False
             else:
-                return False
+                # the new password of an interrupted master password change logs in too, with the old vault key,
+                # which is still the one of the user row, and the change is finished below
+                keys = self._pending_keys(res[0], password)
+                if keys is None:
+                    return False
+                vault_key = keys[0]
+            with self._lock:
+                self._userinfo['userid'], self._userinfo['username'], _, _, self._userinfo['usertimestamp'], self._userinfo['keyversion'] = res[:6]
+                self._userinfo['vaultkey'] = vault_key
+                self._userinfo['fingerprintkey'] = generate_fingerprint_key(vault_key)
+                self._login = True
+                self._migrate_records(password)
+                self._backfill_fingerprints()
+                self._build_index()
+                pending = self.rotation_pending()
+            if not pending:
+                self._upgrade_kdf(password, password_hash, params)
+            elif self._resume_rotation() is None:
+                logger.warning('A master password change of %s was interrupted and cannot be finished yet, '
+                               'resume it with change_master_password()', username)
+            return True
         else:
             return False
         
+    @synchronized
     def user_logout(self) -> None:
         self._userinfo = dict()
+        self._cache.clear()
         self._login = False
+        self._index.clear()
+
+    @synchronized
+    def close(self) -> None:
+        """
+        Log out and close the database connection, e.g. before forking, this PMDatabase cannot be used afterwards.
+        """
+        self.user_logout()
+        self._con.close()
 
+    @instrumented
     def add_new_user(self, username: str, password: str) -> bool:
         """
         Create a new user of the app.
         :return: True if add successfully, otherwise False
         """
-        password_hash, salt = hash_password(password)
+        params = self.kdf_params()
+        salt = os.urandom(32)
+        password_hash, key_encryption_key = hash_password_with_key(password, salt, params)
+        # a random vault key, so that the scrypt parameters can change without re-encrypting the entries
+        wrapped_key = wrap_key(os.urandom(32), key_encryption_key)
         try:
-            with self._con:
-                self._con.execute('INSERT INTO user(id, username, password, salt) VALUES(?, ?, ?, ?)',
-                                  (generate_id(), username, password_hash, salt))
+            with self._lock:
+                self._transaction(lambda: self._con.execute('INSERT INTO user(id, username, password, salt, kdf_n, kdf_r, kdf_p, wrapped_key) VALUES(?, ?, ?, ?, ?, ?, ?, ?)',
+                                                            (self._reserve_ids(1)[0], username, password_hash, salt, *params, wrapped_key)))
             return True
-        except:
+        except sqlite3.Error:
             return False
         
+    def kdf_params(self) -> tuple[int, int, int]:
+        """
+        Get the scrypt parameters (n, r, p) for new master password hashes on this machine.
+        They are calibrated with calibrate_kdf() the first time and kept in the setting table per host name,
+        so that a database shared by machines of different speed gets parameters fitting each of them.
+        """
+        key = f'kdf_params:{platform.node()}'
+        with self._lock:
+            res = self._con.execute('SELECT value FROM setting WHERE key = ?', (key,)).fetchone()
+        if res is not None:
+            return tuple(int(value) for value in res[0].split(','))
+        params = calibrate_kdf()
+        logger.info('Calibrated scrypt parameters n=%d, r=%d, p=%d', *params)
+        with self._lock:
+            self._transaction(lambda: self._con.execute('INSERT OR IGNORE INTO setting(key, value) VALUES(?, ?)', (key, ','.join(map(str, params)))))
+        return params
+
+    def _upgrade_kdf(self, password: str, password_hash: bytes, params: tuple[int, int, int]) -> None:
+        """
+        Re-hash the master password of the user just logged in with the calibrated parameters if the stored ones are cheaper.
+        Only the vault key is wrapped again with the new derived key, entries and other sessions are unaffected.
+        Parameters are never lowered automatically, lowering them takes change_master_password() with kdf_params.
+        :param password_hash: the hash the user logged in with, the upgrade is skipped if another session has changed it since
+        """
+        calibrated = self.kdf_params()
+        if params[0] * params[1] * params[2] >= calibrated[0] * calibrated[1] * calibrated[2]:
+            return
+        start = time.perf_counter()
+        salt = os.urandom(32)
+        new_hash, key_encryption_key = hash_password_with_key(password, salt, calibrated)
+        with self._lock:
+            if not self._login:
+                return
+            wrapped_key = wrap_key(self._userinfo['vaultkey'], key_encryption_key)
+            cursor = self._transaction(lambda: self._con.execute('''
+                UPDATE user SET password = ?, salt = ?, kdf_n = ?, kdf_r = ?, kdf_p = ?, wrapped_key = ?
+                WHERE id = ? AND password = ? AND key_version = ?
+            ''', (new_hash, salt, *calibrated, wrapped_key, self._userinfo['userid'], password_hash, self._userinfo['keyversion'])))
+        if cursor.rowcount:
+            logger.info('Upgraded scrypt parameters from n=%d, r=%d, p=%d to n=%d, r=%d, p=%d in %.3fs', *params, *calibrated, time.perf_counter() - start)
+
+    @synchronized
     def user_exists(self, username: str) -> bool:
         with self._con:
             res = self._con.execute('SELECT username FROM user WHERE username = ?', (username,)).fetchone()
         return False if res is None else True
 
+    @synchronized
     def user_authenticate(self, username: str, password: str) -> bool:
         """
         Check whether username and password match
         """
         with self._con:
-            password_hash, salt = self._con.execute('SELECT password, salt FROM user WHERE username = ?', (username,)).fetchone()
-        return is_correct_password(password, password_hash, salt)
+            password_hash, salt, *params = self._con.execute('SELECT password, salt, kdf_n, kdf_r, kdf_p FROM user WHERE username = ?', (username,)).fetchone()
+        return is_correct_password(password, password_hash, salt, tuple(params))
      
+    @synchronized
     def get_all_users(self) -> list:
         with self._con:
             return self._con.execute('SELECT username FROM user').fetchall()
 
+    @synchronized
     def delete_user(self, username: str, password: str) -> bool:
         """
         Delete user after checking the password.
         """
         if self.user_authenticate(username, password):
-            with self._con:
-                self._con.execute('DELETE FROM user WHERE username = ?', (username,))
+            self._transaction(lambda: self._con.execute('DELETE FROM user WHERE username = ?', (username,)))
             return True
         else:
             return False
         
+    @instrumented
+    @synchronized
     def add_new_password(self, description: str, site: Optional[str], account_id: str, password: str, notes: Optional[str]) -> bool:
         """
         Add new entry in password table.
+        :return: id of the new entry, or False if failed
+        :raise VaultKeyChangedError: if the master password has been changed by another session since logging in
         """
         # first check login status
         if self._login:
             try:
-                token, salt = encrypt_message(password, self._userinfo['userpassword'])
-                with self._con:
-                    self._con.execute('INSERT INTO password(id, user_id, description, site, account_id, password, notes, salt) VALUES(?, ?, ?, ?, ?, ?, ?, ?)',
-                                      (generate_id(), self._userinfo['userid'], description, site, account_id, token, notes, salt))
-                return True
-            except:
+                token, salt = encrypt_record(password, self._userinfo['vaultkey'])
+                fingerprint = password_fingerprint(password, self._userinfo['fingerprintkey'])
+                def insert() -> int:
+                    id = self._reserve_ids(1)[0]
+                    self._con.execute('INSERT INTO password(id, user_id, description, site, account_id, password, notes, salt, scheme, key_version, fingerprint) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                      (id, self._userinfo['userid'], description, site, account_id, token, notes, salt, RECORD_SCHEME, self._userinfo['keyversion'], fingerprint))
+                    return id
+                id = self._transaction(insert, vault=True)
+                self._index.add(id, description, site, account_id, notes)
+                record_rows(1)
+                self._notify(ENTRIES_INSERTED, [id])
+                return id
+            except sqlite3.Error:
                 return False
         return False
         
-    def show_all_passwords(self) -> Optional[list]:
+    @instrumented
+    def add_new_passwords(self, entries: list, workers: Optional[int] = None, checkpoint: Optional[tuple[str, int]] = None) -> int:
+        """
+        Add many entries of (description, site, account_id, password, notes) in a single transaction.
+        Passwords are encrypted in parallel before the transaction starts.
+        :param checkpoint: (import job id, source rows done) stored in the same transaction, see get_import_checkpoint()
+        :return: number of entries added
+        """
+        if not self._login or not entries:
+            return 0
+        tokens = encrypt_batch([entry[3] for entry in entries], self._userinfo['vaultkey'], workers=workers)
+        # one HMAC per password, cheap enough next to the encryption not to need the pool
+        fingerprints = [password_fingerprint(entry[3], self._userinfo['fingerprintkey']) for entry in entries]
+        values = [(self._userinfo['userid'], description, site, account_id, token, notes, salt, RECORD_SCHEME, self._userinfo['keyversion'], fingerprint)
+                  for (description, site, account_id, _, notes), (token, salt), fingerprint in zip(entries, tokens, fingerprints)]
+        rows = []
+        def insert() -> None:
+            rows[:] = [(id, *row) for id, row in zip(self._reserve_ids(len(values)), values)]
+            self._con.executemany('INSERT INTO password(id, user_id, description, site, account_id, password, notes, salt, scheme, key_version, fingerprint) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            if checkpoint is not None:
+                self._con.execute('''
+                    INSERT INTO import_job(id, user_id, rows_done) VALUES(?1, ?2, ?3)
+                    ON CONFLICT(id, user_id) DO UPDATE SET rows_done = ?3, timestamp = CURRENT_TIMESTAMP
+                ''', (checkpoint[0], self._userinfo['userid'], checkpoint[1]))
+        with self._lock:
+            self._transaction(insert, vault=True)
+            record_rows(len(rows))
+            for id, _, description, site, account_id, _, notes, _, _, _, _ in rows:
+                self._index.add(id, description, site, account_id, notes)
+            self._notify(ENTRIES_INSERTED, [row[0] for row in rows])
+        return len(rows)
+
+    @synchronized
+    def get_import_checkpoint(self, job_id: str) -> int:
+        """
+        Get the number of source rows already imported by an interrupted import job of the current user.
+        """
+        res = self._con.execute('SELECT rows_done FROM import_job WHERE id = ? AND user_id = ?',
+                                (job_id, self._userinfo.get('userid'))).fetchone()
+        return 0 if res is None else res[0]
+
+    @synchronized
+    def finish_import(self, job_id: str) -> None:
+        self._transaction(lambda: self._con.execute('DELETE FROM import_job WHERE id = ? AND user_id = ?', (job_id, self._userinfo.get('userid'))))
+
+    @instrumented
+    @synchronized
+    def show_all_passwords(self, lazy: bool = False) -> Optional[list]:
+        """
+        Get all password entries of the current user, ordered by id, i.e. by creation time.
+        :param lazy: if True, return PasswordRecord objects which only decrypt the password on access
+        """
         if self._login:
             with self._con:
-                res = self._con.execute('SELECT id, description, site, account_id, password, notes, timestamp, salt FROM password WHERE user_id = ?', (self._userinfo['userid'],)).fetchall()
-                self.decrypt_password(res)
+                res = self._con.execute('SELECT id, description, site, account_id, password, notes, timestamp, salt, version FROM password WHERE user_id = ? ORDER BY id', (self._userinfo['userid'],)).fetchall()
+            record_rows(len(res))
+            if lazy:
+                return self.lazy_records(res)
+            self.decrypt_password(res)
             return res
         return None
-    
-    def search_password(self, keyword: str) -> Optional[list]:
+
+    def iter_passwords(self, chunk_size: int = 1000, workers: Optional[int] = 1) -> Iterator[list]:
+        """
+        Iterate over all password entries of the current user in chunks of decrypted rows, ordered by id.
+        Only one chunk is held in memory at a time, and each chunk is read with its own keyset query,
+        so no cursor or lock is held between chunks.
+        :param workers: number of threads to decrypt each chunk with, None for one per CPU
+        """
+        last_id = -1 << 63
+        while True:
+            with self._lock:
+                if not self._login:
+                    return
+                res = self._con.execute('''
+                    SELECT id, description, site, account_id, password, notes, timestamp, salt, version FROM password
+                    WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?
+                ''', (self._userinfo['userid'], last_id, chunk_size)).fetchall()
+            if not res:
+                return
+            last_id = res[-1][0]
+            # an export passes every entry once, keep it from flushing the entries in use out of the cache
+            yield self.decrypt_password(res, workers=workers, cache=False)
+
+    @instrumented
+    @synchronized
+    def count_passwords(self) -> Optional[int]:
+        """
+        Count the password entries of the current user.
+        """
+        if self._login:
+            return self._con.execute('SELECT COUNT(*) FROM password WHERE user_id = ?', (self._userinfo['userid'],)).fetchone()[0]
+        return None
+
+    @instrumented
+    @synchronized
+    def get_passwords_page(self, offset: int, limit: int) -> Optional[list]:
+        """
+        Get a page of the current user's password entries ordered by id, as lazy PasswordRecord objects.
+        """
+        if self._login:
+            res = self._con.execute('''
+                SELECT id, description, site, account_id, password, notes, timestamp, salt, version FROM password
+                WHERE user_id = ? ORDER BY id LIMIT ? OFFSET ?
+            ''', (self._userinfo['userid'], limit, offset)).fetchall()
+            record_rows(len(res))
+            return self.lazy_records(res)
+        return None
+
+    @instrumented
+    @synchronized
+    def search_password(self, keyword: str, lazy: bool = False) -> Optional[list]:
         """
         Search keyword in columns (description, site, account_id, notes).
+        Every whitespace-separated term of keyword is matched as a word prefix and all terms must match,
+        best-ranked entries come first.
+        :param lazy: if True, return PasswordRecord objects which only decrypt the password on access
         """
         if self._login:
-            with self._con:
+            res = None
+            if self._fts:
+                try:
+                    res = self._con.execute('''
+                        SELECT p.id, p.description, p.site, p.account_id, p.password, p.notes, p.timestamp, p.salt, p.version
+                        FROM password_fts JOIN password AS p ON p.id = password_fts.rowid
+                        WHERE password_fts MATCH ? AND p.user_id = ?
+                        ORDER BY bm25(password_fts, 0.0, 10.0, 5.0, 5.0, 1.0)
+                    ''', (search_query(self._userinfo['userid'], keyword), self._userinfo['userid'])).fetchall()
+                except sqlite3.OperationalError:
+                    pass
+            if res is None:
+                # fall back to a full scan when FTS5 is not available
                 res = self._con.execute('''
-                    SELECT id, description, site, account_id, password, notes, timestamp, salt FROM password
-                    WHERE description LIKE ?1 OR site LIKE ?1 OR account_id LIKE ?1 OR notes LIKE ?1
-                ''', ('%' + keyword + '%',)).fetchall()
+                    SELECT id, description, site, account_id, password, notes, timestamp, salt, version FROM password
+                    WHERE user_id = ?2 AND (description LIKE ?1 OR site LIKE ?1 OR account_id LIKE ?1 OR notes LIKE ?1)
+                ''', ('%' + keyword + '%', self._userinfo['userid'])).fetchall()
+            record_rows(len(res))
+            if lazy:
+                return self.lazy_records(res)
             if len(res) > 0:
                 self.decrypt_password(res)
             return res
         return None
+
+    @instrumented
+    @synchronized
+    def filter_passwords(self, query: str) -> Optional[list]:
+        """
+        Filter the current user's entries with the in-memory prefix index, without touching the database.
+        Every term of query must match the start of a word in description, site, account_id or notes.
+        :return: ids of the matching entries in ascending order
+        """
+        if self._login:
+            return self._index.search(query)
+        return None
+
+    @instrumented
+    @synchronized
+    def get_passwords(self, ids: list) -> Optional[list]:
+        """
+        Get the current user's entries with the given ids as lazy PasswordRecord objects, in the order of ids.
+        """
+        if self._login:
+            res = self._con.execute(f'''
+                SELECT id, description, site, account_id, password, notes, timestamp, salt, version FROM password
+                WHERE user_id = ? AND id IN ({', '.join('?' * len(ids))})
+            ''', (self._userinfo['userid'], *ids)).fetchall()
+            record_rows(len(res))
+            rows = {row[0]: row for row in res}
+            return self.lazy_records([rows[id] for id in ids if id in rows])
+        return None
+
+    @instrumented
+    @synchronized
+    def reveal_password(self, id: int) -> Optional[str]:
+        """
+        Decrypt the password of a single entry of the current user.
+        :return: the plaintext password, or None if not logged in or the entry does not exist
+        """
+        if self._login:
+            res = self._con.execute('SELECT password, salt FROM password WHERE id = ? AND user_id = ?',
+                                    (id, self._userinfo['userid'])).fetchone()
+            if res is not None:
+                return self._decrypt_cached(int(id), *res)
+        return None
         
-    def update_password(self, id: int, description: str, site: Optional[str], account_id: str, password: str, notes: Optional[str]) -> Optional[bool]:
+    @instrumented
+    @synchronized
+    def update_password(self, id: int, description: str, site: Optional[str], account_id: str, password: str, notes: Optional[str],
+                        version: Optional[int] = None) -> Optional[bool]:
         """
         Update all the user-input info of a certain entry.
-        The salt and timestamp will be changed automatically.
+        The salt, timestamp and version will be changed automatically.
+        :param version: the version of the entry the update is based on, see PasswordRecord.version;
+                        if given, the update only succeeds if nobody else has changed the entry since
+        :raise UpdateConflictError: if the entry has been changed or deleted since version
+        :raise ValueError: if password is None, e.g. because the stored one could not be decrypted
+        :raise VaultKeyChangedError: if the master password has been changed by another session since logging in
         """
         if self._login:
-            token, salt = encrypt_message(password, self._userinfo['userpassword'])
+            if password is None:
+                raise ValueError(f'Entry {id} has no password to store')
+            token, salt = encrypt_record(password, self._userinfo['vaultkey'])
+            fingerprint = password_fingerprint(password, self._userinfo['fingerprintkey'])
             try:
-                with self._con:
-                    self._con.execute('''
-                        UPDATE password SET
-                            description = ?,
-                            site = ?,
-                            account_id = ?,
-                            password = ?,
-                            notes = ?,
-                            salt = ?
-                        WHERE id = ?
-                    ''', (description, site, account_id, token, notes, salt, id))
-                return True
-            except:
+                cursor = self._transaction(lambda: self._con.execute('''
+                    UPDATE password SET
+                        description = ?,
+                        site = ?,
+                        account_id = ?,
+                        password = ?,
+                        notes = ?,
+                        salt = ?,
+                        scheme = ?,
+                        key_version = ?,
+                        fingerprint = ?,
+                        version = version + 1
+                    WHERE id = ? AND user_id = ? AND (?12 IS NULL OR version = ?12)
+                ''', (description, site, account_id, token, notes, salt, RECORD_SCHEME, self._userinfo['keyversion'], fingerprint, id, self._userinfo['userid'], version)),
+                                           vault=True)
+            except sqlite3.Error:
+                return False
+            self._cache.invalidate(int(id))
+            if cursor.rowcount == 0:
+                if version is not None:
+                    raise UpdateConflictError(id)
                 return False
+            self._index.add(int(id), description, site, account_id, notes)
+            record_rows(1)
+            self._notify(ENTRIES_UPDATED, [int(id)])
+            return True
         return None
     
+    @instrumented
+    @synchronized
     def delete_password(self, id: int) -> Optional[bool]:
         if self._login:
             try:
-                with self._con:
-                    self._con.execute('DELETE FROM password WHERE id = ?', (id,))
+                cursor = self._transaction(lambda: self._con.execute('DELETE FROM password WHERE id = ? AND user_id = ?', (id, self._userinfo['userid'])))
+                self._index.remove(int(id))
+                self._cache.invalidate(int(id))
+                record_rows(1)
+                if cursor.rowcount:
+                    self._notify(ENTRIES_DELETED, [int(id)])
                 return True
-            except:
+            except sqlite3.Error:
                 return False
         return None
         
-    def decrypt_password(self, res: list) -> list:
+    @instrumented
+    @synchronized
+    def password_in_use(self, password: str, exclude_id: Optional[int] = None) -> Optional[list]:
+        """
+        Find the current user's entries with the given password, with one index lookup of its fingerprint and no decryption.
+        :param exclude_id: the entry being edited, which does not count as reusing its own password
+        :return: ids of the entries in ascending order, empty if the password is not in use, or None if not logged in
+        """
+        if self._login:
+            res = self._con.execute('SELECT id FROM password WHERE user_id = ? AND fingerprint = ? AND id IS NOT ? ORDER BY id',
+                                    (self._userinfo['userid'], password_fingerprint(password, self._userinfo['fingerprintkey']), exclude_id)).fetchall()
+            return [row[0] for row in res]
+        return None
+
+    @instrumented
+    @synchronized
+    def reused_passwords(self) -> Optional[list]:
+        """
+        Group the current user's entries sharing a password by their fingerprints, in a single GROUP BY over the index.
+        Fingerprints reveal which entries share a password to anyone with the database file, but not the passwords.
+        :return: lists of entry ids in ascending order, one per password used by more than one entry, most reused first,
+                 or None if not logged in
+        """
+        if self._login:
+            res = self._con.execute('''
+                SELECT group_concat(id) FROM password WHERE user_id = ? AND fingerprint IS NOT NULL
+                GROUP BY fingerprint HAVING COUNT(*) > 1 ORDER BY COUNT(*) DESC
+            ''', (self._userinfo['userid'],)).fetchall()
+            record_rows(len(res))
+            return [sorted(int(id) for id in row[0].split(',')) for row in res]
+        return None
+
+    @synchronized
+    def rotation_pending(self) -> bool:
+        """
+        Check whether a master password change of the current user has been interrupted and is waiting to be resumed.
+        """
+        if self._login:
+            return self._con.execute('SELECT 1 FROM key_rotation WHERE user_id = ?', (self._userinfo['userid'],)).fetchone() is not None
+        return False
+
+    @instrumented
+    def change_master_password(self, old_password: str, new_password: str, workers: Optional[int] = None,
+                               batch_size: int = ROTATION_BATCH_SIZE,
+                               progress: Optional[Callable[[int, int, float], None]] = None,
+                               kdf_params: Optional[tuple[int, int, int]] = None) -> Optional[dict]:
+        """
+        Change the current user's master password, re-encrypting every entry with the new vault key.
+        Entries are re-encrypted in parallel and committed in batches, each batch along with a checkpoint in key_rotation,
+        while the user row keeps the old hash until the last batch, so the old password stays the one to log in with.
+        key_rotation also keeps each vault key wrapped with the other, so entries stay readable by sessions of either
+        password meanwhile, and a change interrupted is finished by the next login with either password.
+        Other sessions of the user cannot write entries once the change is done and have to log in again.
+        :param workers: number of threads to re-encrypt with, None for one per CPU
+        :param progress: called with (rows done, rows total, rows per second) after each batch
+        :param kdf_params: scrypt parameters (n, r, p) for the new password, the current ones by default
+        :return: dict of rows re-encrypted, rows failed to decrypt (left as they were), seconds and rows per second,
+                 or None if not logged in, old_password is wrong, or an interrupted change to another password is pending
+        """
+        if not self._login:
+            return None
+        with self._lock:
+            user = self._con.execute('SELECT password, salt, key_version, kdf_n, kdf_r, kdf_p, wrapped_key FROM user WHERE id = ?',
+                                     (self._userinfo['userid'],)).fetchone()
+            pending = self._con.execute('SELECT password, salt, kdf_n, kdf_r, kdf_p, wrapped_key FROM key_rotation WHERE user_id = ?',
+                                        (self._userinfo['userid'],)).fetchone()
+        old_hash, old_key_encryption_key = hash_password_with_key(old_password, user[1], tuple(user[3:6]))
+        if not hmac.compare_digest(old_hash, user[0]) or user[2] != self._userinfo['keyversion']:
+            return None
+        old_key = unwrap_key(user[6], old_key_encryption_key)
+        if old_key is None:
+            return None
+        if pending is not None:
+            # entries already re-encrypted can only be read with the password and parameters the change was started with
+            new_hash, new_key_encryption_key = hash_password_with_key(new_password, pending[1], tuple(pending[2:5]))
+            if not hmac.compare_digest(new_hash, pending[0]):
+                return None
+            new_key = unwrap_key(pending[5], new_key_encryption_key)
+            if new_key is None:
+                return None
+            return self._rotate(old_key, new_key, workers, batch_size, progress)
+        params = tuple(kdf_params or user[3:6])
+        new_salt = os.urandom(32)
+        new_hash, new_key_encryption_key = hash_password_with_key(new_password, new_salt, params)
+        # a fresh vault key, the old one may have been exposed along with the old password
+        new_key = os.urandom(32)
+        with self._lock:
+            self._transaction(lambda: self._con.execute('''
+                INSERT INTO key_rotation(user_id, password, salt, key_version, kdf_n, kdf_r, kdf_p, wrapped_key, pending_key, previous_key)
+                VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (self._userinfo['userid'], new_hash, new_salt, user[2] + 1, *params, wrap_key(new_key, new_key_encryption_key),
+                  wrap_key(new_key, old_key), wrap_key(old_key, new_key))))
+        return self._rotate(old_key, new_key, workers, batch_size, progress)
+
+    def _pending_keys(self, user_id: int, password: str) -> Optional[tuple[bytes, bytes]]:
+        """
+        Get the old and new vault keys of an interrupted master password change to password.
+        :return: the keys, or None if no change to password is pending or it was started by a version not storing them
+        """
+        with self._lock:
+            pending = self._con.execute('SELECT password, salt, kdf_n, kdf_r, kdf_p, wrapped_key, previous_key FROM key_rotation WHERE user_id = ?',
+                                        (user_id,)).fetchone()
+        if pending is None or pending[6] is None:
+            return None
+        new_hash, new_key_encryption_key = hash_password_with_key(password, pending[1], tuple(pending[2:5]))
+        if not hmac.compare_digest(new_hash, pending[0]):
+            return None
+        new_key = unwrap_key(pending[5], new_key_encryption_key)
+        old_key = None if new_key is None else unwrap_key(pending[6], new_key)
+        return None if old_key is None else (old_key, new_key)
+
+    def _resume_rotation(self) -> Optional[dict]:
+        """
+        Finish the interrupted master password change of the user just logged in, with either password.
+        """
+        try:
+            return self._rotate(self._userinfo['vaultkey'])
+        except Exception:
+            # entries not re-encrypted yet keep working, and the change is resumed on the next login
+            logger.exception('Failed to resume the master password change')
+            return None
+
+    def _rotate(self, old_key: bytes, new_key: Optional[bytes] = None, workers: Optional[int] = None,
+                batch_size: int = ROTATION_BATCH_SIZE, progress: Optional[Callable[[int, int, float], None]] = None) -> Optional[dict]:
+        """
+        Re-encrypt the entries of the current user's pending master password change in batches, then finish it.
+        :param new_key: the new vault key, unwrapped with old_key from key_rotation if not given
+        :return: see change_master_password(), or None if the change was started by a version not storing the new key
+        """
+        with self._lock:
+            new_hash, new_salt, key_version, done, kdf_n, kdf_r, kdf_p, wrapped_key, pending_key = self._con.execute('''
+                SELECT password, salt, key_version, rows_done, kdf_n, kdf_r, kdf_p, wrapped_key, pending_key FROM key_rotation WHERE user_id = ?
+            ''', (self._userinfo['userid'],)).fetchone()
+            if new_key is None and pending_key is not None:
+                new_key = unwrap_key(pending_key, old_key)
+            if new_key is None:
+                return None
+            # entries re-encrypted by the batches below are read with the new key until the change is finished
+            self._userinfo['pendingkey'] = new_key
+            total = done + self._con.execute('SELECT COUNT(*) FROM password WHERE user_id = ? AND key_version != ?',
+                                             (self._userinfo['userid'], key_version)).fetchone()[0]
+        start = time.perf_counter()
+        rotated = failed = 0
+        def finish() -> bool:
+            # entries added by another session after the last batch still have the old key, they need another batch
+            if self._con.execute('SELECT 1 FROM password WHERE user_id = ? AND key_version != ? LIMIT 1',
+                                 (self._userinfo['userid'], key_version)).fetchone() is not None:
+                return False
+            self._con.execute('UPDATE user SET password = ?, salt = ?, key_version = ?, kdf_n = ?, kdf_r = ?, kdf_p = ?, wrapped_key = ? WHERE id = ?',
+                              (new_hash, new_salt, key_version, kdf_n, kdf_r, kdf_p, wrapped_key, self._userinfo['userid']))
+            self._con.execute('DELETE FROM key_rotation WHERE user_id = ?', (self._userinfo['userid'],))
+            return True
+        while True:
+            # the lock is taken per batch, so the app stays responsive, and rows added meanwhile are picked up by later batches
+            with self._lock:
+                rows = self._con.execute('''
+                    SELECT id, password, salt, scheme FROM password WHERE user_id = ? AND key_version != ? ORDER BY id LIMIT ?
+                ''', (self._userinfo['userid'], key_version, batch_size)).fetchall()
+                if not rows:
+                    if self._transaction(finish):
+                        self._userinfo['vaultkey'], self._userinfo['keyversion'] = new_key, key_version
+                        self._userinfo['fingerprintkey'] = generate_fingerprint_key(new_key)
+                        del self._userinfo['pendingkey']
+                        break
+                    continue
+                results = reencrypt_batch([(token, salt) for _, token, salt, _ in rows], old_key, new_key, workers=workers)
+                # entries which cannot be decrypted with the old key are unreadable anyway, they keep their token
+                # the fingerprints are for the new key, like the tokens, so they stay comparable with new entries
+                updates = [(old, scheme, key_version, None, id, salt) if result is None else (result[0], RECORD_SCHEME, key_version, result[1], id, salt)
+                           for (id, old, salt, scheme), result in zip(rows, results)]
+                def commit_batch() -> None:
+                    # the salt check skips entries another process has updated since they were read, they are read again
+                    self._con.executemany('UPDATE password SET password = ?, scheme = ?, key_version = ?, fingerprint = ? WHERE id = ? AND salt = ?', updates)
+                    self._con.execute('UPDATE key_rotation SET rows_done = rows_done + ?, timestamp = CURRENT_TIMESTAMP WHERE user_id = ?',
+                                      (len(rows), self._userinfo['userid']))
+                self._transaction(commit_batch)
+                record_rows(len(rows))
+            rotated += len(rows)
+            failed += results.count(None)
+            seconds = time.perf_counter() - start
+            rate = rotated / seconds if seconds > 0 else 0.0
+            logger.info('Re-encrypted %d of %d entries, %.0f rows/s', done + rotated, total, rate)
+            if progress is not None:
+                progress(done + rotated, max(total, done + rotated), rate)
+        seconds = time.perf_counter() - start
+        if failed:
+            logger.warning('%d entries could not be decrypted and were left as they were', failed)
+        return {'rows': rotated, 'failed': failed, 'seconds': seconds, 'rows_per_second': rotated / seconds if seconds > 0 else 0.0}
+
+    def subscribe(self, callback: Callable[[str, list], None]) -> Callable[[], None]:
+        """
+        Get notified of every entry added, updated or deleted through this PMDatabase, so that views can patch
+        the affected rows instead of reloading everything.
+        :param callback: called with ENTRIES_INSERTED, ENTRIES_UPDATED or ENTRIES_DELETED and a list of entry ids
+                         after the change is committed, on the thread that made the change and with the lock held,
+                         so it must return quickly and not call back into the database
+        :return: a function cancelling the subscription
+        """
+        with self._lock:
+            self._subscribers.append(callback)
+        def unsubscribe() -> None:
+            with self._lock:
+                if callback in self._subscribers:
+                    self._subscribers.remove(callback)
+        return unsubscribe
+
+    def _notify(self, kind: str, ids: list) -> None:
+        for callback in list(self._subscribers):
+            try:
+                callback(kind, ids)
+            except Exception:
+                # the change is committed anyway, a broken view must not turn it into a failure
+                logger.exception('Change subscriber failed')
+
+    def cache_stats(self) -> dict:
+        """
+        Get the entries, hits, misses, evictions and hit rate of the decrypted password cache.
+        """
+        return self._cache.stats()
+
+    def stats(self) -> dict:
+        """
+        Get the measurements of the database operations and the crypto backend, see backend.instrumentation.
+        Empty unless instrumentation is enabled with instrumentation.enable() or the PM_SLOW_MS environment variable.
         """
-        Decrypt the encrypted token in the result list.
+        return instrumentation.stats()
+
+    def _reserve_ids(self, count: int) -> list:
         """
+        Reserve count ids for rows inserted in the current write transaction.
+        All connections to the database share its instance id, so the allocator first moves past the largest id
+        committed by any of them, which cannot change until the transaction ends.
+        """
+        self._ids.advance(self._con.execute(LAST_ID_QUERY).fetchone()[0] or 0)
+        return self._ids.reserve(count)
+
+    def _transaction(self, statements: Callable[[], Any], vault: bool = False) -> Any:
+        """
+        Run statements in a write transaction, committed if it returns and rolled back if it raises.
+        If another process still holds the write lock after the busy timeout, the transaction is retried
+        with exponential backoff and jitter, so that waiting writers do not retry in lockstep.
+        :param vault: statements write entries encrypted with the session's vault key, which must still be the user's
+        :return: the return value of statements
+        :raise VaultKeyChangedError: if vault is True and the master password has been changed since logging in
+        """
+        delay = BUSY_RETRY_DELAY
+        for attempt in range(BUSY_RETRIES + 1):
+            try:
+                with self._con:
+                    # sqlite3 only begins the transaction at the first INSERT, UPDATE or DELETE, so the checks made by
+                    # statements before writing, e.g. of key_version, would otherwise run outside it and race other writers
+                    if not self._con.in_transaction:
+                        self._con.execute('BEGIN IMMEDIATE')
+                    if vault:
+                        key_version = self._con.execute('SELECT key_version FROM user WHERE id = ?', (self._userinfo['userid'],)).fetchone()
+                        if key_version is None or key_version[0] != self._userinfo['keyversion']:
+                            raise VaultKeyChangedError('The master password has been changed, log in again')
+                    return statements()
+            except sqlite3.OperationalError as e:
+                if attempt == BUSY_RETRIES or not is_busy(e):
+                    raise
+                logger.warning('Database is locked, retrying in %.0fms', delay * 1000)
+                time.sleep(delay * random.uniform(0.5, 1.5))
+                delay *= 2
+
+    def decrypt_password(self, res: list, workers: Optional[int] = 1, use_processes: bool = False,
+                         progress: Optional[Callable[[int, int], None]] = None, cache: bool = True) -> list:
+        """
+        Decrypt the encrypted token in the result list, taking the passwords found in the cache from it.
+        :param workers: number of threads (or processes) to decrypt with, None for one per CPU
+        :param progress: called with (rows done, rows total) while decrypting
+        :param cache: keep the newly decrypted passwords in the cache
+        """
+        passwords = [self._cache.get(row[0], row[7]) for row in res]
+        misses = [i for i, password in enumerate(passwords) if password is None]
+        if misses:
+            decrypted = decrypt_batch([(res[i][4], res[i][7]) for i in misses], self._userinfo['vaultkey'],
+                                      workers=workers, use_processes=use_processes, progress=progress)
+            pending_key = self._pending_key() if None in decrypted else None
+            if pending_key is not None:
+                # entries already re-encrypted by a master password change in progress
+                failed = [k for k, password in enumerate(decrypted) if password is None]
+                for k, password in zip(failed, decrypt_batch([(res[misses[k]][4], res[misses[k]][7]) for k in failed], pending_key,
+                                                             workers=workers, use_processes=use_processes)):
+                    decrypted[k] = password
+            for i, password in zip(misses, decrypted):
+                passwords[i] = password
+                if cache:
+                    self._cache.put(res[i][0], res[i][7], password)
         for i in range(len(res)):
-            # decrypt password in each row
-            password = decrypt_message(res[i][4], self._userinfo['userpassword'], res[i][7])
             # slice the old tuple and concatenate the new value to replace the password hash
-            res[i] = res[i][:4] + (password,) + res[i][5:]
+            res[i] = res[i][:4] + (passwords[i],) + res[i][5:]
         return res
 
-def generate_id() -> int:
+    def lazy_records(self, res: list) -> list:
+        """
+        Wrap the rows in the result list in PasswordRecord objects without decrypting them.
+        """
+        return [PasswordRecord(row, self._decrypt_cached) for row in res]
+
+    def decrypt_token(self, token: bytes, salt: bytes) -> Optional[str]:
+        """
+        Decrypt a single password token with the current user's vault key.
+        :return: message decrypted, or None if not logged in
+        """
+        if self._login:
+            password = decrypt_record(token, self._userinfo['vaultkey'], salt)
+            pending_key = self._pending_key() if password is None else None
+            if pending_key is not None:
+                # already re-encrypted by a master password change in progress
+                password = decrypt_record(token, pending_key, salt)
+            return password
+        return None
+
+    def _pending_key(self) -> Optional[bytes]:
+        """
+        Get the new vault key of a master password change in progress, possibly started by another session,
+        to read the entries it has re-encrypted already.
+        :return: the key, or None if no change is in progress or it was started by a version not storing the key
+        """
+        with self._lock:
+            if 'pendingkey' not in self._userinfo and self._login:
+                res = self._con.execute('SELECT pending_key FROM key_rotation WHERE user_id = ? AND key_version = ?',
+                                        (self._userinfo['userid'], self._userinfo['keyversion'] + 1)).fetchone()
+                if res is not None and res[0] is not None:
+                    pending_key = unwrap_key(res[0], self._userinfo['vaultkey'])
+                    if pending_key is not None:
+                        self._userinfo['pendingkey'] = pending_key
+            return self._userinfo.get('pendingkey')
+
+    def _decrypt_cached(self, id: int, token: bytes, salt: bytes) -> Optional[str]:
+        password = self._cache.get(id, salt)
+        if password is None:
+            password = self.decrypt_token(token, salt)
+            # a record read before logging out must not put its password into the next session's cache
+            if self._login:
+                self._cache.put(id, salt, password)
+        return password
+
+    @instrumented
+    def _build_index(self) -> None:
+        """
+        Build the prefix index of the current user's entries.
+        """
+        self._index.clear()
+        for id, *fields in self._con.execute('SELECT id, description, site, account_id, notes FROM password WHERE user_id = ?',
+                                             (self._userinfo['userid'],)):
+            self._index.add(id, *fields)
+        record_rows(len(self._index))
+
+    @instrumented
+    def _migrate_records(self, master_password: str) -> int:
+        """
+        One-time migration of the current user's scheme 1 records (per-record scrypt keys) to the vault key scheme.
+        Each record keeps its salt, so the modified-at timestamp is left untouched.
+        :return: number of records migrated
+        """
+        rows = self._con.execute('SELECT id, password, salt FROM password WHERE user_id = ? AND scheme = ?',
+                                 (self._userinfo['userid'], RECORD_SCHEME_SCRYPT)).fetchall()
+        record_rows(len(rows))
+        # every scheme 1 record costs a full scrypt run, which releases the GIL, so decrypt them with a thread per CPU
+        passwords = decrypt_batch([(token, salt) for _, token, salt in rows], master_password, RECORD_SCHEME_SCRYPT,
+                                  workers=None, chunk_size=16)
+        migrated = []
+        for (id, _, salt), password in zip(rows, passwords):
+            # leave records that cannot be decrypted as they are
+            if password is not None:
+                migrated.append((encrypt_record(password, self._userinfo['vaultkey'], salt)[0], RECORD_SCHEME,
+                                 password_fingerprint(password, self._userinfo['fingerprintkey']), id))
+        if migrated:
+            # skip records another process has updated meanwhile
+            self._transaction(lambda: self._con.executemany('UPDATE password SET password = ?, scheme = ?, key_version = ?, fingerprint = ? WHERE id = ? AND scheme = ?',
+                                                            [(token, scheme, self._userinfo['keyversion'], fingerprint, id, RECORD_SCHEME_SCRYPT)
+                                                             for token, scheme, fingerprint, id in migrated]),
+                              vault=True)
+        return len(migrated)
+
+    @instrumented
+    def _backfill_fingerprints(self) -> int:
+        """
+        Fingerprint the current user's entries written before fingerprints existed, decrypting them in parallel once.
+        Entries still encrypted with another key, during an interrupted master password change, get theirs when re-encrypted.
+        :return: number of entries fingerprinted
+        """
+        rows = self._con.execute('SELECT id, password, salt FROM password WHERE user_id = ? AND key_version = ? AND fingerprint IS NULL',
+                                 (self._userinfo['userid'], self._userinfo['keyversion'])).fetchall()
+        if not rows:
+            return 0
+        record_rows(len(rows))
+        fingerprints = fingerprint_batch([(token, salt) for _, token, salt in rows], self._userinfo['vaultkey'])
+        # entries which cannot be decrypted are left without one, the salt check skips entries another process has updated meanwhile
+        updates = [(fingerprint, id, salt) for (id, _, salt), fingerprint in zip(rows, fingerprints) if fingerprint is not None]
+        if updates:
+            self._transaction(lambda: self._con.executemany('UPDATE password SET fingerprint = ? WHERE id = ? AND salt = ?', updates), vault=True)
+        return len(updates)
+
+def is_busy(error: sqlite3.OperationalError) -> bool:
     """
-    Generate a snowflake-style id.
+    Check whether an error is caused by another connection holding a lock.
     """
-    return next(snowflake.SnowflakeGenerator(randint(1, 1023)))
+    code = getattr(error, 'sqlite_errorcode', None)
+    if code is not None:
+        # the primary result code is the low byte of an extended one, e.g. SQLITE_BUSY_SNAPSHOT
+        return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return 'locked' in str(error) or 'busy' in str(error)
+
+def search_query(user_id: int, keyword: str) -> str:
+    """
+    Build an FTS5 query matching every term of keyword as a prefix within one user's entries.
+    """
+    # quote each term as a string so that FTS5 operators and punctuation in keyword are taken literally
+    terms = ' AND '.join('"' + term.replace('"', '""') + '"*' for term in keyword.split())
+    return f'user_id : "{user_id}" AND {{description site account_id notes}} : ({terms})'
 
 if __name__ == '__main__':
     pmd = PMDatabase()
@@ -235,6 +967,45 @@ if __name__ == '__main__':
     # pmd.delete_password(id)
     # print(pmd.show_all_passwords())
 
+    # interrupt a master password change after its first batch, then log in with either password
+    import tempfile
+    class Interrupted(Exception):
+        pass
+    def interrupt(done, total, rate):
+        raise Interrupted
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'rotation.db')
+        for password in ('old', 'new'):
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            pmd = PMDatabase(path)
+            pmd.add_new_user('rotation', 'old')
+            assert pmd.user_login('rotation', 'old')
+            for i in range(10):
+                pmd.add_new_password(f'site{i}', 'site.com', 'account', f'password{i}', None)
+            other = PMDatabase(path)
+            assert other.user_login('rotation', 'old')
+            try:
+                pmd.change_master_password('old', 'new', batch_size=4, progress=interrupt)
+            except Interrupted:
+                pass
+            # a session opened before the change still reads the entries already re-encrypted
+            assert other.rotation_pending()
+            assert sorted(row[4] for row in other.show_all_passwords()) == [f'password{i}' for i in range(10)]
+            other.close()
+            pmd.close()
+            pmd = PMDatabase(path)
+            assert pmd.user_login('rotation', password)
+            assert not pmd.rotation_pending()
+            assert sorted(row[4] for row in pmd.show_all_passwords()) == [f'password{i}' for i in range(10)]
+            pmd.close()
+            for login, expected in (('new', True), ('old', False)):
+                pmd = PMDatabase(path)
+                assert pmd.user_login('rotation', login) == expected
+                pmd.close()
+    print('interrupted master password change: ok')
+
 
     
 
@@ -0,0 +1,130 @@
+"""
+Functions relating to caching decrypted passwords for the current session
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+class RecordCache:
+    """
+    LRU cache of decrypted passwords keyed by record id and salt, with a time to live.
+    A new salt is generated whenever a record is updated, so a cached password never outlives the token it was decrypted from.
+    Plaintext is held in bytearrays which are overwritten with zeros when expired, evicted, invalidated or cleared.
+    Expired entries are removed on every get and put, and by a timer when no call comes.
+    Passwords are handed in and out as str, so copies may still live in the caller until garbage collected.
+    """
+    def __init__(self, max_entries: int = 256, ttl: float = 300.0, clock: Callable[[], float] = time.monotonic):
+        """
+        :param max_entries: number of passwords kept, 0 disables the cache
+        :param ttl: seconds a password is kept after being decrypted
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        # id -> (salt, plaintext, expiry), least recently used first
+        self._entries = OrderedDict()
+        # id -> expiry, in the order the entries were put, which is the order they expire in as ttl is the same for all
+        self._expiries = OrderedDict()
+        self._timer = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, id: int, salt: bytes) -> Optional[str]:
+        """
+        :return: the cached password, or None on a miss
+        """
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(id)
+            if entry is not None and entry[0] == salt:
+                self._entries.move_to_end(id)
+                self.hits += 1
+                return entry[1].decode()
+            if entry is not None:
+                # decrypted from an older version of the record
+                self._remove(id)
+            self.misses += 1
+            return None
+
+    def put(self, id: int, salt: bytes, password: Optional[str]) -> None:
+        if password is None or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._expire()
+            if id in self._entries:
+                self._remove(id)
+            expiry = self._clock() + self.ttl
+            self._entries[id] = (salt, bytearray(password.encode()), expiry)
+            self._expiries[id] = expiry
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            self._schedule()
+
+    def invalidate(self, id: int) -> None:
+        with self._lock:
+            if id in self._entries:
+                self._remove(id)
+
+    def clear(self) -> None:
+        with self._lock:
+            for id in list(self._entries):
+                self._remove(id)
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def _remove(self, id: int) -> None:
+        _, plaintext, _ = self._entries.pop(id)
+        del self._expiries[id]
+        plaintext[:] = bytes(len(plaintext))
+
+    def _expire(self) -> None:
+        now = self._clock()
+        while self._expiries and next(iter(self._expiries.values())) <= now:
+            self._remove(next(iter(self._expiries)))
+
+    def _schedule(self) -> None:
+        """
+        Start a timer removing the next entry to expire, so that plaintext does not outlive its ttl while the cache is idle.
+        """
+        if self._timer is None and self._expiries:
+            self._timer = threading.Timer(max(next(iter(self._expiries.values())) - self._clock(), 0), self._sweep)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _sweep(self) -> None:
+        with self._lock:
+            self._timer = None
+            self._expire()
+            self._schedule()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+if __name__ == '__main__':
+    cache = RecordCache(max_entries=2, ttl=60)
+    cache.put(1, b'salt1', 'hello')
+    assert cache.get(1, b'salt1') == 'hello'
+    assert cache.get(1, b'salt2') is None
+    cache.put(1, b'salt1', 'hello')
+    cache.put(2, b'salt2', 'world')
+    cache.put(3, b'salt3', '!')
+    assert cache.get(1, b'salt1') is None
+    cache.clear()
+    cache = RecordCache(ttl=0.1)
+    cache.put(1, b'salt1', 'hunter2')
+    plaintext = cache._entries[1][1]
+    time.sleep(0.2)
+    assert len(cache) == 0 and plaintext == bytes(7)
+    print(cache.stats())
@@ -0,0 +1,264 @@
+"""
+Functions relating to the unlock agent, which keeps one user's vault unlocked in memory and answers
+lookups over a Unix domain socket, so scripts pay for scrypt once instead of once per lookup.
+
+Protocol: one JSON object per line each way, on a connection that may carry any number of requests.
+    {"op": "ping"}                              -> {"ok": true, "result": {"user": ..., "db": ...}}
+    {"op": "get", "id": "..."}                  -> {"ok": true, "result": {entry with password}}
+    {"op": "search", "keyword": "..."}          -> {"ok": true, "result": [entries without passwords]}
+    {"op": "list"}                              -> {"ok": true, "result": [entries without passwords]}
+    {"op": "lock"}                              -> {"ok": true, "result": null}, then the agent exits
+A request may carry "user" and "db", which must match the vault the agent serves.
+Failures are answered with {"ok": false, "error": message}.
+"""
+
+import json
+import os
+import socket
+import struct
+import sys
+import time
+from typing import Optional, TYPE_CHECKING
+
+# the client side is used by the CLI on every lookup, so the database and asyncio are only imported to serve
+if TYPE_CHECKING:
+    from database.pm_database import PMDatabase
+
+AGENT_IDLE_TIMEOUT = 900
+# longest request line accepted
+AGENT_LINE_LIMIT = 1 << 16
+
+class AgentError(Exception):
+    """
+    Raised by the client when the agent answers a request with an error.
+    """
+
+def agent_socket_path() -> str:
+    """
+    Get the socket path from PM_AGENT_SOCK, otherwise a per-user path in XDG_RUNTIME_DIR or the temp directory.
+    """
+    path = os.environ.get('PM_AGENT_SOCK')
+    if path:
+        return path
+    runtime = os.environ.get('XDG_RUNTIME_DIR') or os.path.join('/tmp', f'pmagent-{os.getuid()}')
+    return os.path.join(runtime, 'pmagent.sock')
+
+def peer_uid(sock: socket.socket) -> Optional[int]:
+    """
+    Get the user id of the process on the other end of a Unix socket, None where SO_PEERCRED is not supported.
+    """
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    _, uid, _ = struct.unpack('3i', sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i')))
+    return uid
+
+class UnlockAgent:
+    """
+    Serves lookups in the vault of the user logged into pmd, until it is locked or idle for idle_timeout seconds.
+    Only the owner of the socket can connect: the socket is created with mode 0600 in a directory of mode 0700,
+    and every connection is checked to come from the same user id.
+    """
+    def __init__(self, pmd: 'PMDatabase', db: str, user: str, idle_timeout: float = AGENT_IDLE_TIMEOUT):
+        self.pmd = pmd
+        self.db = os.path.realpath(db)
+        self.user = user
+        self.idle_timeout = idle_timeout
+        self.last_request = time.monotonic()
+        self.requests = 0
+
+    def handle(self, request: dict):
+        """
+        Answer a single request.
+        :return: the result, or raises AgentError
+        """
+        if request.get('user', self.user) != self.user or os.path.realpath(request.get('db', self.db)) != self.db:
+            raise AgentError('The agent serves another vault')
+        op = request.get('op')
+        if op == 'ping':
+            return {'user': self.user, 'db': self.db, 'requests': self.requests, 'cache': self.pmd.cache_stats()}
+        if op == 'get':
+            try:
+                records = self.pmd.get_passwords([int(request.get('id'))])
+            except (TypeError, ValueError):
+                raise AgentError(f'Invalid id {request.get("id")}')
+            if not records:
+                raise AgentError(f'No entry with id {request.get("id")}')
+            return records[0].as_dict(True)
+        if op == 'search':
+            return [record.as_dict() for record in self.pmd.search_password(str(request.get('keyword', '')), lazy=True)]
+        if op == 'list':
+            return [record.as_dict() for record in self.pmd.show_all_passwords(lazy=True)]
+        if op == 'lock':
+            return None
+        raise AgentError(f'Unknown operation {op}')
+
+    async def serve_connection(self, reader, writer) -> None:
+        sock = writer.get_extra_info('socket')
+        uid = peer_uid(sock) if sock is not None else None
+        if uid is not None and uid != os.getuid():
+            writer.close()
+            return
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                self.last_request = time.monotonic()
+                self.requests += 1
+                request = {}
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        request = {}
+                        raise ValueError
+                    # lookups take well under a millisecond, so they run on the event loop instead of a thread
+                    response = {'ok': True, 'result': self.handle(request)}
+                except AgentError as e:
+                    response = {'ok': False, 'error': str(e)}
+                except ValueError:
+                    response = {'ok': False, 'error': 'Invalid request'}
+                writer.write(json.dumps(response, ensure_ascii=False).encode() + b'\n')
+                await writer.drain()
+                if request.get('op') == 'lock':
+                    self.stopped.set()
+                    break
+        except (ConnectionError, ValueError):
+            # ValueError: request line over the limit
+            pass
+        finally:
+            writer.close()
+
+    async def watch_idle(self) -> None:
+        import asyncio
+        while not self.stopped.is_set():
+            remaining = self.last_request + self.idle_timeout - time.monotonic()
+            if remaining <= 0:
+                self.stopped.set()
+                return
+            try:
+                await asyncio.wait_for(self.stopped.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def serve(self, path: str) -> None:
+        import asyncio
+        self.stopped = asyncio.Event()
+        prepare_socket_path(path)
+        # no window in which the socket exists with looser permissions
+        umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(self.serve_connection, path, limit=AGENT_LINE_LIMIT)
+        finally:
+            os.umask(umask)
+        try:
+            async with server:
+                await self.watch_idle()
+        finally:
+            # forget the vault key before exiting
+            self.pmd.user_logout()
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def run(self, path: str) -> None:
+        import asyncio
+        asyncio.run(self.serve(path))
+
+def prepare_socket_path(path: str) -> None:
+    """
+    Create the socket directory with mode 0700 and remove a stale socket left by an agent that died.
+    :raise AgentError: if the directory is accessible to other users, or an agent is already listening on path
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory, mode=0o700)
+    # another user could have created the directory beforehand to intercept lookups
+    status = os.stat(directory)
+    if status.st_uid != os.getuid() or status.st_mode & 0o077:
+        raise AgentError(f'{directory} must be owned by the user and inaccessible to others')
+    if os.path.exists(path):
+        client = AgentClient(path)
+        try:
+            client.request('ping')
+        except OSError:
+            os.unlink(path)
+            return
+        except AgentError:
+            pass
+        finally:
+            client.close()
+        raise AgentError(f'An agent is already running on {path}')
+
+def detach() -> None:
+    """
+    Fork into the background like ssh-agent: the parent exits, the child leaves the session of the terminal.
+    """
+    if os.fork() > 0:
+        os._exit(0)
+    os.setsid()
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+
+class AgentClient:
+    """
+    Client of the unlock agent, keeping one connection open for any number of requests.
+    """
+    def __init__(self, path: Optional[str] = None, timeout: float = 5.0):
+        self.path = path or agent_socket_path()
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+
+    def connect(self) -> None:
+        """
+        :raise OSError: if no agent listens on the socket, or it is run by another user
+        """
+        # never send lookups to a socket another user has put in place
+        if os.stat(self.path).st_uid != os.getuid():
+            raise PermissionError(f'{self.path} is owned by another user')
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(self.timeout)
+        try:
+            self._sock.connect(self.path)
+            uid = peer_uid(self._sock)
+            if uid is not None and uid != os.getuid():
+                raise PermissionError(f'{self.path} is served by another user')
+        except OSError:
+            self.close()
+            raise
+        self._file = self._sock.makefile('rb')
+
+    def request(self, op: str, **params):
+        """
+        Send a request and wait for the answer.
+        :return: the result
+        :raise AgentError: if the agent answers with an error
+        :raise OSError: if the agent cannot be reached
+        """
+        if self._sock is None:
+            self.connect()
+        self._sock.sendall(json.dumps({'op': op, **params}).encode() + b'\n')
+        line = self._file.readline()
+        if not line:
+            self.close()
+            raise ConnectionError('The agent closed the connection')
+        response = json.loads(line)
+        if not response['ok']:
+            raise AgentError(response['error'])
+        return response['result']
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        if self._sock is not None:
+            self._sock.close()
+        self._sock = self._file = None
+
+if __name__ == '__main__':
+    # time lookups through a running agent: python database/unlock_agent.py ID [COUNT]
+    client = AgentClient()
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    start = time.perf_counter()
+    for _ in range(count):
+        client.request('get', id=sys.argv[1])
+    print(f'{(time.perf_counter() - start) / count * 1000:.3f}ms per lookup')
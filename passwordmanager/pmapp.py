@@ -1,15 +1,19 @@
 from tkinter import *
-import ctypes
+import sys
 
-from database.pm_database import PMDatabase
+# only the modules needed to paint the login window are imported here,
+# the database and crypto modules are imported by EntryFrame on the worker thread
 from view.entry_frame import EntryFrame
+from view.task_executor import TaskExecutor
 
 app = Tk()
 
 # improve Tkinter window resolution
 # https://coderslegacy.com/python/problem-solving/improve-tkinter-resolution/
 # https://stackoverflow.com/questions/44398075/can-dpi-scaling-be-enabled-disabled-programmatically-on-a-per-session-basis
-ctypes.windll.shcore.SetProcessDpiAwareness(2)
+if sys.platform == 'win32':
+    import ctypes
+    ctypes.windll.shcore.SetProcessDpiAwareness(2)
 
 # Disable resize window from both x and y axis
 app.resizable(False, False)
@@ -21,7 +25,5 @@ app.title('Password Manager')
 photo = PhotoImage(file='./passwordmanager/img/cyber-crime.png')
 app.wm_iconphoto(False, photo)
 
-pmd = PMDatabase()
-EntryFrame(app, pmd)
+EntryFrame(app, None, TaskExecutor(app))
 app.mainloop()
-
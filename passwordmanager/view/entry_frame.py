@@ -1,15 +1,22 @@
 from tkinter import *
 from tkinter import messagebox
-import ctypes
+from typing import Optional, TYPE_CHECKING
 
-from database.pm_database import *
 from view.password_dialog import PasswordDialog
+from view.task_executor import TaskExecutor
+
+# the database and crypto modules are imported on the worker thread, see open_database()
+if TYPE_CHECKING:
+    from database.pm_database import PMDatabase
 
 class EntryFrame(Frame):
     """
     The initial frame when starting the app, provding entry point for login and signup.
     """
-    def __init__(self, master, pmd: PMDatabase):
+    def __init__(self, master, pmd: Optional['PMDatabase'], executor: TaskExecutor):
+        """
+        :param pmd: the database, or None to open it on the worker thread while the frame is shown
+        """
         self.master = master
         super().__init__(master)
         self.grid()
@@ -24,6 +31,10 @@ class EntryFrame(Frame):
         self.button_signup = Button(self, text='Sign up', command=self.signup, width=10, font='Arial 20 bold')
         self.button_signup.grid(row=2, column=2, padx=10, pady=(10, 20))
         self.pmd = pmd
+        # runs pmd calls off the Tk thread
+        self.executor = executor
+        # tasks submitted by this frame, cancelled when it is destroyed
+        self.tasks = []
         # bind enter-key event
         # for entry_password
         self.entry_password.bind('<Return>', self.login_event)
@@ -31,58 +42,118 @@ class EntryFrame(Frame):
         self.button_login.bind('<Return>', lambda event: self.button_login.invoke())
         # for signup button
         self.button_signup.bind('<Return>', lambda event: self.button_signup.invoke())
+        if pmd is None:
+            # the worker runs tasks in order, so logins and signups submitted meanwhile wait for the database
+            self.submit(self.open_database, on_error=self.open_database_failed)
+
+    def submit(self, fn, **kwargs) -> None:
+        self.tasks = [task for task in self.tasks if not task.done]
+        self.tasks.append(self.executor.submit(fn, **kwargs))
+
+    def set_pending(self, pending: bool) -> None:
+        """
+        Disable login and signup while one of them runs, so a second click cannot queue another one behind it.
+        """
+        state = 'disabled' if pending else 'normal'
+        self.button_login['state'] = state
+        self.button_signup['state'] = state
+
+    def pending(self) -> bool:
+        return self.button_login['state'] == 'disabled'
+
+    def task_failed(self, error: BaseException) -> None:
+        self.set_pending(False)
+        messagebox.showerror('Error', f'{error}!')
+
+    def destroy(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        super().destroy()
+
+    def open_database(self) -> None:
+        """
+        Open the database, run on the worker thread so that the window is painted before the heavy imports.
+        """
+        from database.pm_database import PMDatabase
+        self.pmd = PMDatabase()
+        # warm up the modules of the frame shown after login, and the dictionaries of its strength check
+        import view.passwords_frame
+        from backend.password_utils import check_password_strength
+        check_password_strength('warm up')
+
+    def open_database_failed(self, error: BaseException) -> None:
+        messagebox.showerror('Error', f'{error}!')
+        self.master.destroy()
 
     def login(self) -> None:
-        from view.passwords_frame import PasswordsFrame
         username = self.entry_username.get().strip()
         password = self.entry_password.get()
+        if self.pending():
+            return
         if username and password:
-            if self.pmd.user_login(username, password):
-                PasswordsFrame(self.master, self.pmd)
-                self.master.title(f'Password Manager: [{username}]')
-                self.destroy()
-            else:
-                messagebox.showerror('Error', 'Username or password is incorrect!')
+            # scrypt runs on the worker thread
+            self.set_pending(True)
+            self.submit(lambda: self.pmd.user_login(username, password),
+                        on_done=lambda success: self.login_done(success, username), on_error=self.task_failed)
         else:
             messagebox.showerror('Error', 'Username or password cannot be empty!')
 
+    def login_done(self, success: bool, username: str) -> None:
+        from view.passwords_frame import PasswordsFrame
+        self.set_pending(False)
+        if success:
+            PasswordsFrame(self.master, self.pmd, self.executor)
+            self.master.title(f'Password Manager: [{username}]')
+            self.destroy()
+        else:
+            messagebox.showerror('Error', 'Username or password is incorrect!')
+
     def login_event(self, event):
         self.login()
 
-    def signup(self) -> bool:
+    def signup(self) -> None:
         username = self.entry_username.get().strip()
         password = self.entry_password.get()
+        if self.pending():
+            return
         if username and password:
-            if self.pmd.user_exists(username):
-                messagebox.showwarning('Warning', 'Username already exists!')
-                self.entry_username.delete(0, 'end')
-            else:
-                password_confirmed = PasswordDialog('Password Confirmation', 'Enter the password again to confirm it:').result
-                if password == password_confirmed:
-                    if self.pmd.add_new_user(username, password):
-                        messagebox.showinfo('Info', f'User [{username}] has been created successfully.')
-                        return True
-                    else:
-                        messagebox.showerror('Error', f'User [{username}] creation failed!')
-                elif password_confirmed is None: # cancelld, do nothing
-                    pass
-                else:
-                    messagebox.showerror('Error', 'Password confirmation failed!')
-            self.entry_password.delete(0, 'end')
-            self.entry_username.focus()
-            return False
+            self.set_pending(True)
+            self.submit(lambda: self.pmd.user_exists(username),
+                        on_done=lambda exists: self.signup_confirm(exists, username, password), on_error=self.task_failed)
         else:
             messagebox.showerror('Error', 'Username or password cannot be empty!')
-            return False
+
+    def signup_confirm(self, exists: bool, username: str, password: str) -> None:
+        self.set_pending(False)
+        if exists:
+            messagebox.showwarning('Warning', 'Username already exists!')
+            self.entry_username.delete(0, 'end')
+        else:
+            password_confirmed = PasswordDialog('Password Confirmation', 'Enter the password again to confirm it:').result
+            if password == password_confirmed:
+                self.set_pending(True)
+                self.submit(lambda: self.pmd.add_new_user(username, password),
+                            on_done=lambda success: self.signup_done(success, username), on_error=self.task_failed)
+            elif password_confirmed is None: # cancelld, do nothing
+                pass
+            else:
+                messagebox.showerror('Error', 'Password confirmation failed!')
+        self.entry_password.delete(0, 'end')
+        self.entry_username.focus()
+
+    def signup_done(self, success: bool, username: str) -> None:
+        self.set_pending(False)
+        if success:
+            messagebox.showinfo('Info', f'User [{username}] has been created successfully.')
+        else:
+            messagebox.showerror('Error', f'User [{username}] creation failed!')
 
 if __name__ == '__main__':
     app = Tk()
-    ctypes.windll.shcore.SetProcessDpiAwareness(2)
 
     # Disable resize window from both x and y axis
     app.resizable(False, False)
 
     app.title('Password Manager')
-    pmd = PMDatabase()
-    EntryFrame(app, pmd)
+    EntryFrame(app, None, TaskExecutor(app))
     app.mainloop()
\ No newline at end of file
@@ -2,22 +2,40 @@ from tkinter import *
 from tkinter import messagebox
 from tkinter import ttk
 from typing import Optional
-import ctypes
+import queue
+import sys
 
 from database.pm_database import *
 from view.password_dialog import *
+from view.task_executor import TaskExecutor
+from view.virtual_treeview import VirtualTreeview, ListSource, IdListSource, PMDatabaseSource
 
-from backend.password_utils import generate_password
+from backend.password_utils import generate_passwords, policy_for_site, DEFAULT_POLICY, check_password_strength
+
+# shown in the password column of the treeview, plaintext is only decrypted for the loaded entry
+PASSWORD_MASK = '********'
+# delay after the last keystroke in the search box before filtering the list
+FILTER_DELAY_MS = 120
+# text and color of each strength score, from 0 (too guessable) to 4 (very unguessable)
+STRENGTH_LABELS = ('very weak', 'weak', 'fair', 'strong', 'very strong')
+STRENGTH_COLORS = ('red', 'red', 'dark orange', 'forest green', 'forest green')
 
 class PasswordsFrame(Frame):
     """
     The frame for passwords display and manipulation.
     """
-    def __init__(self, master, pmd: PMDatabase):
+    def __init__(self, master, pmd: PMDatabase, executor: TaskExecutor):
         self.master = master
         self.pmd = pmd
+        # runs pmd calls off the Tk thread
+        self.executor = executor
         super().__init__(master)
         self.grid()
+        # changes made by pmd on the worker thread, applied to the list on the Tk thread when a task is done
+        self.changes = queue.Queue()
+        # the only pmd calls on the Tk thread, both just take the lock to edit the list of subscribers, and are made
+        # when the worker is idle: after logging in, and in logout_done() after the logout task
+        self.unsubscribe = self.pmd.subscribe(lambda kind, ids: self.changes.put((kind, ids)))
 
         # first group: search area and view all button
         subframe_search = Frame(self)
@@ -30,6 +48,10 @@ class PasswordsFrame(Frame):
         self.showall_button.grid(row=0, column=4, padx=(10, 0))
         # bind enter-key event
         self.entry_search.bind('<Return>', self.search_event)
+        # filter the list while typing
+        self.entry_search.bind('<KeyRelease>', self.filter_event)
+        self.filter_job = None
+        self.filter_text = ''
 
         # second group: details of each password entry
         subframe_details = LabelFrame(self, text='Details', font='Arial 18')
@@ -45,13 +67,15 @@ class PasswordsFrame(Frame):
         self.entry_accountid.grid(row=2, column=1, columnspan=4, padx=(10, 0), pady=10, ipady=10)
         Label(subframe_details, text="Password", font='Arial 20').grid(row=3, column=0, padx=(40, 10), pady=10)
         self.text_password = Text(subframe_details, font='Consolas 20', width=80, height=3)
-        self.text_password.grid(row=3, column=1, columnspan=4, padx=(10, 0), pady=10, ipady=10)
-        Label(subframe_details, text="Notes", font='Arial 20').grid(row=4, column=0, padx=(40, 10), pady=10)
+        self.text_password.grid(row=3, column=1, columnspan=4, padx=(10, 0), pady=(10, 0), ipady=10)
+        self.label_strength = Label(subframe_details, font='Arial 16', anchor='w')
+        self.label_strength.grid(row=4, column=1, columnspan=4, padx=(10, 0), sticky='w')
+        Label(subframe_details, text="Notes", font='Arial 20').grid(row=5, column=0, padx=(40, 10), pady=10)
         self.text_notes = Text(subframe_details, font='Consolas 20', width=80, height=3)
-        self.text_notes.grid(row=4, column=1, columnspan=4, padx=(10, 0), pady=10, ipady=10)
-        Label(subframe_details, text="Modified At", font='Arial 20').grid(row=5, column=0, padx=(40, 10), pady=(10, 20))
+        self.text_notes.grid(row=5, column=1, columnspan=4, padx=(10, 0), pady=10, ipady=10)
+        Label(subframe_details, text="Modified At", font='Arial 20').grid(row=6, column=0, padx=(40, 10), pady=(10, 20))
         self.label_modifiedat = Label(subframe_details, font='Consolas 20', width=80, anchor='w')
-        self.label_modifiedat.grid(row=5, column=1, columnspan=4, padx=(10, 0), pady=(10, 20))
+        self.label_modifiedat.grid(row=6, column=1, columnspan=4, padx=(10, 0), pady=(10, 20))
         # bind enter-key event
         self.entry_description.bind('<Return>', self.focus_next_input)
         self.entry_site.bind('<Return>', self.focus_next_input)
@@ -61,6 +85,8 @@ class PasswordsFrame(Frame):
         # also bind tab-key event for text widgets
         self.text_password.bind('<Tab>', self.focus_next_and_change)
         self.text_notes.bind('<Tab>', self.focus_next_input)
+        # estimate the strength of the password while typing
+        self.text_password.bind('<KeyRelease>', self.strength_event)
         
         # third group: buttons for logout and password manipulation
         subframe_ldau = Frame(self)
@@ -84,12 +110,14 @@ class PasswordsFrame(Frame):
         style.configure('Treeview.Heading', font=('Arial', 22, 'bold'))
         columns = ('ID', 'Description', 'Site', 'Account ID', 'Password', 'Notes', 'Modified At', 'Salt')
         display_columns = ('Description', 'Site', 'Account ID', 'Password', 'Notes', 'Modified At')
-        self.treeview_passwords = ttk.Treeview(subframe_treeview, columns=columns, displaycolumns=display_columns, show='headings', style='Treeview')
+        # only the visible rows are materialized, records are fetched from pmd page by page on the worker thread while scrolling
+        self.treeview_passwords = VirtualTreeview(subframe_treeview, mask=PASSWORD_MASK, executor=self.executor, columns=columns,
+                                                  displaycolumns=display_columns, show='headings', style='Treeview')
         # x, y scroll bars
         scrollbar_x = ttk.Scrollbar(subframe_treeview, command=self.treeview_passwords.xview, orient=HORIZONTAL)
         scrollbar_y = ttk.Scrollbar(subframe_treeview, command=self.treeview_passwords.yview, orient=VERTICAL)
         self.treeview_passwords.configure(xscrollcommand=scrollbar_x.set)
-        self.treeview_passwords.configure(yscrollcommand=scrollbar_y.set)
+        self.treeview_passwords.set_yscrollcommand(scrollbar_y.set)
         for column in columns:
             self.treeview_passwords.heading(column, text=column)
             self.treeview_passwords.column(column, minwidth=180, width=234, stretch=False)
@@ -105,30 +133,93 @@ class PasswordsFrame(Frame):
         """
         keyword = self.entry_search.get().strip()
         if keyword:
-            res = self.pmd.search_password(keyword)
-            if res:
-                self.showall(res)
-            else:
-                messagebox.showinfo('Info', 'No matching results were found.')
+            # repeated searches while one is still waiting are coalesced
+            self.executor.submit(self.pmd.search_password, keyword, lazy=True, key='search',
+                                 on_done=lambda res: self.search_done(res, keyword))
+
+    def search_done(self, res: Optional[list], keyword: str) -> None:
+        if res:
+            # entries added while the results are shown are listed only if they match too, the in-memory index matches
+            # word prefixes like the search, looked up on the worker thread
+            def matching(records: list) -> list:
+                ids = set(self.pmd.filter_passwords(keyword) or [])
+                return [record for record in records if record.id in ids]
+            self.treeview_passwords.set_source(ListSource(res, matching))
+        else:
+            messagebox.showinfo('Info', 'No matching results were found.')
     
+    def live_filter(self) -> None:
+        """
+        Filter the list with the keyword in entry_search using the in-memory index of pmd.
+        """
+        self.filter_job = None
+        keyword = self.entry_search.get().strip()
+        if keyword:
+            # the index is in memory, but looking it up waits for the pmd lock held by any write
+            self.executor.submit(self.pmd.filter_passwords, keyword, key='filter', on_done=lambda ids: self.filter_done(ids, keyword))
+        else:
+            self.treeview_passwords.set_source(PMDatabaseSource(self.pmd))
+
+    def filter_done(self, ids: Optional[list], keyword: str) -> None:
+        # the keyword may have changed meanwhile, its own filter follows
+        if keyword == self.entry_search.get().strip():
+            self.treeview_passwords.set_source(IdListSource(self.pmd, ids or [], keyword))
+
     def showall(self, records: Optional[list] = None) -> None:
         """
         Show all passwords from records or pmd.
         """
-        # delete all entires first
-        self.treeview_passwords.delete(*self.treeview_passwords.get_children())
         if records:
-            # insert from records
-            for record in records:
-                self.treeview_passwords.insert('', 'end', values=record)
+            # show from records
+            self.treeview_passwords.set_source(ListSource(records))
         else:
-            # insert from pmd
-            records = self.pmd.show_all_passwords()
-            if not records:
-                messagebox.showinfo('Info', 'No passwords found.')
-                return
-            for record in self.pmd.show_all_passwords():
-                self.treeview_passwords.insert('', 'end', values=record)
+            # show from pmd, only the visible pages are read
+            self.treeview_passwords.set_source(PMDatabaseSource(self.pmd), on_loaded=self.showall_done)
+
+    def showall_done(self, total: int) -> None:
+        if not total:
+            messagebox.showinfo('Info', 'No passwords found.')
+
+    def apply_changes(self) -> None:
+        """
+        Patch only the rows of the entries added, updated or deleted since the last call, instead of reloading the list.
+        """
+        source = self.treeview_passwords.source
+        if source is None:
+            # nothing listed yet, list all entries with the changes in them
+            self.changes = queue.Queue()
+            self.treeview_passwords.set_source(PMDatabaseSource(self.pmd))
+            return
+        self.executor.submit(self.read_changes, source, key='changes', on_done=lambda changes: self.changes_read(changes, source))
+
+    def read_changes(self, source) -> list:
+        """
+        Read the records of the changes since the last call on the worker thread, lazy records so nothing is decrypted.
+        :return: (kind, ids) of deletions and (kind, records) of the others, only the added records belonging in source
+        """
+        changes = []
+        while True:
+            try:
+                kind, ids = self.changes.get_nowait()
+            except queue.Empty:
+                return changes
+            if kind == ENTRIES_DELETED:
+                changes.append((kind, ids))
+            else:
+                records = self.pmd.get_passwords(ids) or []
+                changes.append((kind, source.select(records) if kind == ENTRIES_INSERTED else records))
+
+    def changes_read(self, changes: list, source) -> None:
+        if source is not self.treeview_passwords.source:
+            # the list has been reloaded from pmd meanwhile, with the changes in it
+            return
+        for kind, items in changes:
+            if kind == ENTRIES_DELETED:
+                self.treeview_passwords.records_deleted(items)
+            elif kind == ENTRIES_INSERTED:
+                self.treeview_passwords.records_inserted(items)
+            else:
+                self.treeview_passwords.records_updated(items)
 
     def add(self):
         """
@@ -137,15 +228,22 @@ class PasswordsFrame(Frame):
         inputs = self.get_inputs()
         # check if account, password, and description are not empty before add new entry
         if inputs:
-            if messagebox.askyesno('Addition Confirmation', 'Are you sure you want to add the password to the database?'):
-                # add to pmd
-                if not self.pmd.add_new_password(*inputs):
-                    messagebox.showerror('Error', 'Password addition failed!')
-                self.showall()
-                # clear inputs after addition
-                self.clear_inputs()
-                self.button_update['state'] = 'disabled'
-                self.button_delete['state'] = 'disabled'
+            # a lookup of the password's fingerprint, no other entry is decrypted
+            self.executor.submit(self.pmd.password_in_use, inputs[3], on_done=lambda reused: self.add_confirm(inputs, reused))
+
+    def add_confirm(self, inputs: tuple, reused: Optional[list]) -> None:
+        if messagebox.askyesno('Addition Confirmation', 'Are you sure you want to add the password to the database?' + self.reuse_warning(reused)):
+            # add to pmd
+            self.executor.submit(self.pmd.add_new_password, *inputs, on_done=self.add_done, on_error=self.write_failed)
+
+    def add_done(self, success: bool) -> None:
+        if not success:
+            messagebox.showerror('Error', 'Password addition failed!')
+        self.apply_changes()
+        # clear inputs after addition
+        self.clear_inputs()
+        self.button_update['state'] = 'disabled'
+        self.button_delete['state'] = 'disabled'
 
     def update(self):
         """
@@ -153,41 +251,71 @@ class PasswordsFrame(Frame):
         """
         inputs = self.get_inputs()
         if inputs:
-            if messagebox.askyesno('Update Confirmation', 'Are you sure you want to update the password to the database?'):
-                if not self.pmd.update_password(self.passwordid, *inputs):
-                    messagebox.showerror('Error', 'Password updating failed!')
-                else:
-                    self.passwordid = None
-                    self.showall()
-                    self.clear_inputs()
-                    # disable update button after updated
-                    self.button_update['state'] = 'disabled'
-                    # disable delete button after updated
-                    self.button_delete['state'] = 'disabled'
+            id, version = self.passwordid, self.passwordversion
+            self.executor.submit(self.pmd.password_in_use, inputs[3], int(id),
+                                 on_done=lambda reused: self.update_confirm(id, version, inputs, reused))
+
+    def update_confirm(self, id: str, version: int, inputs: tuple, reused: Optional[list]) -> None:
+        if messagebox.askyesno('Update Confirmation', 'Are you sure you want to update the password to the database?'
+                               + self.reuse_warning(reused)):
+            self.executor.submit(self.pmd.update_password, id, *inputs, version=version,
+                                 on_done=self.update_done, on_error=self.write_failed)
+
+    def write_failed(self, error: BaseException) -> None:
+        if isinstance(error, VaultKeyChangedError):
+            # nothing was written, entries must not be stored with the vault key of the old master password
+            messagebox.showerror('Error', 'The master password has been changed elsewhere. Log in again to save changes.')
+        elif isinstance(error, UpdateConflictError):
+            # the entry was changed in another window or by a script, keep the inputs so nothing typed is lost
+            messagebox.showwarning('Warning', 'The password has been changed or deleted elsewhere since it was loaded. '
+                                   'Load it again to see the current version.')
+            self.showall()
+        else:
+            self.report_callback_exception(type(error), error, error.__traceback__)
+
+    def update_done(self, success: Optional[bool]) -> None:
+        if not success:
+            messagebox.showerror('Error', 'Password updating failed!')
+        else:
+            self.passwordid = None
+            self.apply_changes()
+            self.clear_inputs()
+            # disable update button after updated
+            self.button_update['state'] = 'disabled'
+            # disable delete button after updated
+            self.button_delete['state'] = 'disabled'
 
     def delete(self):
         """
         Delete the password that has been double-clicked before and is currently shown in the details section.
         """
         if messagebox.askyesno('Deletion Confirmation', 'Are you sure you want to delete the password from the database?'):
-            if self.pmd.delete_password(self.passwordid):
-                self.passwordid = None
-                self.showall()
-                self.clear_inputs()
-                # disable delete button after deletion
-                self.button_delete['state'] = 'disabled'
-                # disable update button after deletion
-                self.button_update['state'] = 'disabled'
-            else:
-                messagebox.showerror('Error', 'Password deletion failed!')
+            self.executor.submit(self.pmd.delete_password, self.passwordid, on_done=self.delete_done, on_error=self.write_failed)
+
+    def delete_done(self, success: Optional[bool]) -> None:
+        if success:
+            self.passwordid = None
+            self.apply_changes()
+            self.clear_inputs()
+            # disable delete button after deletion
+            self.button_delete['state'] = 'disabled'
+            # disable update button after deletion
+            self.button_update['state'] = 'disabled'
+        else:
+            messagebox.showerror('Error', 'Password deletion failed!')
 
     def logout(self):
         """
         Log out the current user as shown in the window title.
         """
-        self.pmd.user_logout()
+        # results of outstanding tasks would arrive after this frame is destroyed
+        self.executor.cancel_all()
+        self.executor.submit(self.pmd.user_logout, on_done=self.logout_done)
+
+    def logout_done(self, result) -> None:
+        self.unsubscribe()
         from view.entry_frame import EntryFrame
-        EntryFrame(self.master, self.pmd)
+        EntryFrame(self.master, self.pmd, self.executor)
         self.destroy()
 
     def get_inputs(self) -> Optional[tuple]:
@@ -197,7 +325,7 @@ class PasswordsFrame(Frame):
         password = self.text_password.get('1.0', 'end-1c')
         # generate random password, if password=='[random]'
         if password == '[random]':
-            password = generate_password()
+            password = self.random_password()
         notes = self.text_notes.get('1.0', 'end-1c').strip()
         # description, accountid and password must not be empty
         if not (description and accountid and password):
@@ -215,6 +343,7 @@ class PasswordsFrame(Frame):
         self.text_password.delete('1.0', 'end')
         self.text_notes.delete('1.0', 'end')
         self.label_modifiedat.config(text='')
+        self.label_strength.config(text='')
         self.entry_description.focus()
     
     def clear(self):
@@ -229,14 +358,53 @@ class PasswordsFrame(Frame):
     def search_event(self, event):
         self.search()
 
+    def filter_event(self, event):
+        # ignore keys not changing the keyword, e.g. enter-key which runs a full search
+        keyword = self.entry_search.get().strip()
+        if keyword == self.filter_text:
+            return
+        self.filter_text = keyword
+        # debounce, only filter once typing pauses
+        if self.filter_job is not None:
+            self.after_cancel(self.filter_job)
+        self.filter_job = self.after(FILTER_DELAY_MS, self.live_filter)
+
+    def strength_event(self, event):
+        self.show_strength()
+
+    def show_strength(self) -> None:
+        """
+        Show the estimated strength of the password input, which should not be based on the site or account id entered.
+        """
+        password = self.text_password.get('1.0', 'end-1c')
+        if not password or password == '[random]':
+            self.label_strength.config(text='')
+            return
+        result = check_password_strength(password, (self.entry_site.get(), self.entry_accountid.get()))
+        text = f"{STRENGTH_LABELS[result['score']].capitalize()}, cracked offline in {result['crack_time']}"
+        if result['warning']:
+            text += f": {result['warning']}"
+        self.label_strength.config(text=text, fg=STRENGTH_COLORS[result['score']])
+
+    def reuse_warning(self, reused: Optional[list]) -> str:
+        # reused are the other entries with the same password, see pmd.password_in_use()
+        if not reused:
+            return ''
+        return f"\n\nThis password is already used by {len(reused)} other {'entry' if len(reused) == 1 else 'entries'}."
+
     def focus_next_input(self, event):
         event.widget.tk_focusNext().focus()
         return 'break'
 
+    def random_password(self) -> str:
+        # follow the policy of the site entered, if it has one
+        return generate_passwords(1, policy_for_site(self.entry_site.get().strip()) or DEFAULT_POLICY)[0]
+
     def focus_next_and_change(self, event):
         if self.text_password.get('1.0', 'end-1c') == '[random]':
             self.text_password.delete(1.0, 'end')
-            self.text_password.insert(1.0, generate_password())
+            self.text_password.insert(1.0, self.random_password())
+            self.show_strength()
         event.widget.tk_focusNext().focus()
         return 'break'
 
@@ -251,17 +419,39 @@ class PasswordsFrame(Frame):
             selection_id = selection[0]
             # get values from selected item
             values = self.treeview_passwords.item(selection_id, 'values')
+            # read the entry again, as another window or a script may have changed it since the list was loaded
+            self.executor.submit(self.read_entry, int(values[0]), key='details', on_done=lambda entry: self.details_read(entry, values[0]))
+
+    def read_entry(self, id: int) -> Optional[tuple]:
+        """
+        Read an entry and decrypt its password only, on the worker thread.
+        :return: the record and its password, or None if the entry has been deleted
+        """
+        records = self.pmd.get_passwords([id])
+        if not records:
+            return None
+        return records[0], records[0].password
+
+    def details_read(self, entry: Optional[tuple], id: str) -> None:
+        if entry is None:
+            messagebox.showwarning('Warning', 'The password has been deleted elsewhere.')
+            self.showall()
+        else:
+            record, password = entry
             # get the id of the password entry in password table
-            self.passwordid = values[0]
+            self.passwordid = id
+            # the version the update will be based on
+            self.passwordversion = record.version
             # first clear all existing inputs in details seciton
             self.clear_inputs()
             # then load details to entries and textbox
-            self.entry_description.insert(0, values[1])
-            self.entry_site.insert(0, values[2])
-            self.entry_accountid.insert(0, values[3])
-            self.text_password.insert('1.0', values[4])
-            self.text_notes.insert('1.0', values[5])
-            self.label_modifiedat.config(text=values[6])
+            self.entry_description.insert(0, record.description)
+            self.entry_site.insert(0, record.site or '')
+            self.entry_accountid.insert(0, record.account_id)
+            self.text_password.insert('1.0', password if password is not None else '')
+            self.show_strength()
+            self.text_notes.insert('1.0', record.notes or '')
+            self.label_modifiedat.config(text=record.timestamp)
             # enable edit button
             self.button_update['state'] = 'normal'
             # enable delete button
@@ -269,12 +459,14 @@ class PasswordsFrame(Frame):
 
 if __name__ == '__main__':
     app = Tk()
-    ctypes.windll.shcore.SetProcessDpiAwareness(2)
+    if sys.platform == 'win32':
+        import ctypes
+        ctypes.windll.shcore.SetProcessDpiAwareness(2)
 
     # Disable resize window from both x and y axis
     app.resizable(False, False)
 
     app.title('Password Manager')
     pmd = PMDatabase()
-    PasswordsFrame(app, pmd)
+    PasswordsFrame(app, pmd, TaskExecutor(app))
     app.mainloop()
\ No newline at end of file
@@ -0,0 +1,143 @@
+from tkinter import *
+import queue
+import threading
+from typing import Any, Callable, Optional
+
+# interval of checking finished tasks while any task is outstanding
+POLL_INTERVAL_MS = 20
+
+class Task:
+    """
+    A unit of work submitted to TaskExecutor.
+    """
+    def __init__(self, fn: Callable, args: tuple, kwargs: dict, on_done: Optional[Callable], on_error: Optional[Callable], key: Optional[str]):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.on_done = on_done
+        self.on_error = on_error
+        self.key = key
+        self.started = False
+        self.cancelled = False
+        # result handled on the Tk thread, or dropped if cancelled
+        self.done = False
+
+    def cancel(self) -> None:
+        """
+        Skip the task if not started yet, otherwise drop its result when it finishes.
+        A running task cannot be interrupted.
+        """
+        self.cancelled = True
+
+class TaskExecutor:
+    """
+    Runs database and crypto work on a single worker thread, so the Tk mainloop never blocks on it.
+    Callbacks are always invoked on the Tk thread, the worker never touches any widget.
+    Tasks submitted with the same key while one is still waiting are coalesced into the latest one.
+    The mouse cursor of the window shows busy state while tasks are outstanding.
+    """
+    def __init__(self, widget: Misc):
+        self.widget = widget
+        self._tasks = queue.Queue()
+        self._results = queue.Queue()
+        # all submitted tasks without their result handled yet, and the latest of them by key
+        self._outstanding = set()
+        self._pending = dict()
+        self._polling = False
+        # guards a waiting task being started by the worker while it is coalesced on the Tk thread
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._work, name='TaskExecutor', daemon=True)
+        self._worker.start()
+
+    def submit(self, fn: Callable, *args, on_done: Optional[Callable[[Any], None]] = None,
+               on_error: Optional[Callable[[BaseException], None]] = None, key: Optional[str] = None, **kwargs) -> Task:
+        """
+        Run fn(*args, **kwargs) on the worker thread.
+        :param on_done: called with the return value of fn on the Tk thread
+        :param on_error: called with the exception raised by fn on the Tk thread, reported by Tk if not given
+        :param key: coalesce with the waiting task of the same key, e.g. repeated clicks of a button
+        """
+        if key is not None:
+            waiting = self._pending.get(key)
+            with self._lock:
+                if waiting is not None and not waiting.started and not waiting.cancelled:
+                    # not started yet, let it run with the latest arguments and callbacks instead
+                    waiting.fn, waiting.args, waiting.kwargs = fn, args, kwargs
+                    waiting.on_done, waiting.on_error = on_done, on_error
+                    return waiting
+        task = Task(fn, args, kwargs, on_done, on_error, key)
+        if key is not None:
+            self._pending[key] = task
+        self._outstanding.add(task)
+        self._set_busy(True)
+        self._tasks.put(task)
+        if not self._polling:
+            self._polling = True
+            self.widget.after(POLL_INTERVAL_MS, self._poll)
+        return task
+
+    def cancel_all(self) -> None:
+        """
+        Cancel every outstanding task, e.g. before the frame owning the callbacks is destroyed.
+        """
+        for task in self._outstanding:
+            task.cancel()
+
+    def busy(self) -> bool:
+        return bool(self._outstanding)
+
+    def shutdown(self) -> None:
+        self.cancel_all()
+        self._tasks.put(None)
+
+    def _work(self) -> None:
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            with self._lock:
+                if not task.cancelled:
+                    task.started = True
+                fn, args, kwargs = task.fn, task.args, task.kwargs
+            if not task.started:
+                self._results.put((task, None, None))
+                continue
+            try:
+                self._results.put((task, fn(*args, **kwargs), None))
+            except BaseException as e:
+                self._results.put((task, None, e))
+
+    def _poll(self) -> None:
+        while True:
+            try:
+                task, result, error = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._outstanding.discard(task)
+            task.done = True
+            if task.key is not None and self._pending.get(task.key) is task:
+                del self._pending[task.key]
+            if task.cancelled:
+                continue
+            try:
+                if error is not None:
+                    if task.on_error is not None:
+                        task.on_error(error)
+                    else:
+                        self.widget.report_callback_exception(type(error), error, error.__traceback__)
+                elif task.on_done is not None:
+                    task.on_done(result)
+            except Exception as e:
+                self.widget.report_callback_exception(type(e), e, e.__traceback__)
+        if self._outstanding:
+            self.widget.after(POLL_INTERVAL_MS, self._poll)
+        else:
+            self._polling = False
+            self._set_busy(False)
+
+    def _set_busy(self, busy: bool) -> None:
+        try:
+            self.widget.winfo_toplevel().config(cursor='watch' if busy else '')
+        except TclError:
+            # window already destroyed
+            pass
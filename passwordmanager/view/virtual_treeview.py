@@ -0,0 +1,367 @@
+from tkinter import *
+from tkinter import ttk
+from collections import OrderedDict
+from typing import Callable, Optional
+
+# number of records fetched from the source at a time
+PAGE_SIZE = 100
+# number of pages kept in memory, the rest are fetched again when scrolled back to
+CACHED_PAGES = 8
+# rows scrolled per mouse wheel notch
+WHEEL_ROWS = 3
+
+class ListSource:
+    """
+    Record source backed by an in-memory list, e.g. search results.
+    """
+    def __init__(self, records: list, matching: Optional[Callable[[list], list]] = None):
+        """
+        :param matching: get those of the records added later which belong in the list, e.g. those matching the search,
+                         all of them if None
+        """
+        self.records = records
+        self.matching = matching
+
+    def count(self) -> int:
+        return len(self.records)
+
+    def fetch(self, offset: int, limit: int) -> list:
+        return self.records[offset:offset + limit]
+
+    def select(self, records: list) -> list:
+        return self.matching(records) if self.matching is not None else records
+
+    def insert(self, records: list) -> int:
+        self.records += records
+        return len(records)
+
+    def update(self, records: list) -> None:
+        changed = {record.id: record for record in records}
+        self.records = [changed.get(record.id, record) for record in self.records]
+
+    def delete(self, ids: list) -> int:
+        count = len(self.records)
+        self.records = [record for record in self.records if record.id not in ids]
+        return count - len(self.records)
+
+class PMDatabaseSource:
+    """
+    Record source reading pages of the current user's entries from pmd.
+    """
+    def __init__(self, pmd):
+        self.pmd = pmd
+
+    def count(self) -> int:
+        return self.pmd.count_passwords() or 0
+
+    def fetch(self, offset: int, limit: int) -> list:
+        return self.pmd.get_passwords_page(offset, limit) or []
+
+    def select(self, records: list) -> list:
+        return records
+
+    def insert(self, records: list) -> int:
+        # ids only grow, so new entries come last in id order
+        return len(records)
+
+    def update(self, records: list) -> None:
+        pass
+
+    def delete(self, ids: list) -> int:
+        return len(ids)
+
+class IdListSource:
+    """
+    Record source backed by a list of entry ids, e.g. from pmd.filter_passwords(), reading records page by page.
+    """
+    def __init__(self, pmd, ids: list, query: Optional[str] = None):
+        """
+        :param query: the filter of pmd.filter_passwords() the ids come from, which records added later must match
+        """
+        self.pmd = pmd
+        self.ids = ids
+        self.query = query
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def fetch(self, offset: int, limit: int) -> list:
+        return self.pmd.get_passwords(self.ids[offset:offset + limit]) or []
+
+    def select(self, records: list) -> list:
+        if self.query is None:
+            return records
+        # the index already has the new entries
+        matching = set(self.pmd.filter_passwords(self.query) or [])
+        return [record for record in records if record.id in matching]
+
+    def insert(self, records: list) -> int:
+        self.ids += [record.id for record in records]
+        return len(records)
+
+    def update(self, records: list) -> None:
+        pass
+
+    def delete(self, ids: list) -> int:
+        count = len(self.ids)
+        self.ids = [id for id in self.ids if id not in ids]
+        return count - len(self.ids)
+
+class VirtualTreeview(ttk.Treeview):
+    """
+    A treeview that only materializes the visible rows of a record source.
+    Records are fetched from the source page by page as the user scrolls, and the vertical scrollbar
+    attached with set_yscrollcommand() reflects the position within the whole source.
+    Records must provide an id attribute and a values(password) method, like PasswordRecord.
+    Sources provide count() and fetch(offset, limit), and insert(records), update(records) and delete(ids)
+    for patching them in place with records_inserted(), records_updated() and records_deleted(),
+    after select(records) has picked those of the added records which belong in the source.
+    With an executor, count(), fetch() and select() run on its worker thread, so reading pmd never blocks the Tk mainloop,
+    and the rows shown stay until the pages they need have arrived.
+    """
+    def __init__(self, master, mask: str = '', executor=None, **kw):
+        """
+        :param executor: TaskExecutor to read the source with, the source is read on the Tk thread if None
+        """
+        super().__init__(master, **kw)
+        self.mask = mask
+        self.executor = executor
+        self.source = None
+        self.total = 0
+        self.top = 0
+        self.selected_id = None
+        self._pages = OrderedDict()
+        # bumped whenever the source changes, so that pages read before are not cached
+        self._generation = 0
+        self._yscrollcommand = None
+        self.bind('<<TreeviewSelect>>', self._on_select)
+        # scroll ourselves instead of letting the treeview scroll its few materialized rows
+        self.bind('<MouseWheel>', lambda event: self._scroll_by(-WHEEL_ROWS if event.delta > 0 else WHEEL_ROWS))
+        self.bind('<Button-4>', lambda event: self._scroll_by(-WHEEL_ROWS))
+        self.bind('<Button-5>', lambda event: self._scroll_by(WHEEL_ROWS))
+        self.bind('<Up>', lambda event: self._on_arrow(-1))
+        self.bind('<Down>', lambda event: self._on_arrow(1))
+        self.bind('<Prior>', lambda event: self._scroll_by(-self.rows()))
+        self.bind('<Next>', lambda event: self._scroll_by(self.rows()))
+
+    def set_yscrollcommand(self, command: Callable) -> None:
+        self._yscrollcommand = command
+        self._update_scrollbar()
+
+    def set_source(self, source, on_loaded: Optional[Callable[[int], None]] = None) -> None:
+        """
+        Show records from a new source, starting from the top.
+        :param on_loaded: called with the number of records once they are counted and the first ones are shown
+        """
+        self.source = source
+        self.top = 0
+        self.selected_id = None
+        self.refresh(on_loaded)
+
+    def refresh(self, on_loaded: Optional[Callable[[int], None]] = None) -> None:
+        """
+        Drop cached pages and re-read the source, keeping the scroll position if possible.
+        :param on_loaded: called with the number of records once they are counted and the visible ones are shown
+        """
+        self._pages.clear()
+        self._generation += 1
+        source, generation = self.source, self._generation
+        if self.executor is None:
+            self._loaded(source, generation, self._load(source, self.top, self.rows()), on_loaded)
+        else:
+            # a newer refresh replaces a waiting one
+            self.executor.submit(self._load, source, self.top, self.rows(), key=f'treeview-load-{id(self)}',
+                                 on_done=lambda loaded: self._loaded(source, generation, loaded, on_loaded))
+
+    @staticmethod
+    def _load(source, top: int, rows: int) -> tuple[int, int, dict]:
+        """
+        Count the records of source and read the pages of the visible ones, touching no widget.
+        :return: number of records, first visible row, page number -> records
+        """
+        total = source.count() if source is not None else 0
+        top = max(0, min(top, total - rows))
+        return total, top, VirtualTreeview._fetch(source, VirtualTreeview._pages_of(top, min(rows, total - top)))
+
+    def _loaded(self, source, generation: int, loaded: tuple[int, int, dict], on_loaded: Optional[Callable[[int], None]]) -> None:
+        if source is not self.source:
+            # replaced by another source meanwhile
+            return
+        if generation != self._generation:
+            # records were patched in while counting, count again
+            self.refresh(on_loaded)
+            return
+        self.total, self.top, pages = loaded
+        self._store(pages)
+        self._render()
+        if on_loaded is not None:
+            on_loaded(self.total)
+
+    def records_inserted(self, records: list) -> None:
+        """
+        Append new records to the source, only re-rendering if they land within the visible rows.
+        """
+        if self.source is None or not records:
+            return
+        self._generation += 1
+        first = self.total
+        self.total += self.source.insert(records)
+        # only the last page, which may be partial, changes
+        self._drop_pages(first // PAGE_SIZE)
+        if first < self.top + self.rows():
+            self._render()
+        else:
+            self._update_scrollbar()
+
+    def records_updated(self, records: list) -> None:
+        """
+        Replace changed records in the source and the cached pages, and their rows if visible.
+        """
+        if self.source is None or not records:
+            return
+        self._generation += 1
+        self.source.update(records)
+        changed = {record.id: record for record in records}
+        for page in self._pages.values():
+            for i, record in enumerate(page):
+                if record.id in changed:
+                    page[i] = changed[record.id]
+        for record in records:
+            if self.exists(str(record.id)):
+                self.item(str(record.id), values=record.values(self.mask))
+
+    def records_deleted(self, ids: list) -> None:
+        """
+        Remove records from the source, dropping only the cached pages from the first deleted record onwards.
+        """
+        if self.source is None or not ids:
+            return
+        self._generation += 1
+        ids = set(ids)
+        # records after a deleted one move up a row, pages before it stay valid
+        first = min((page for page, records in self._pages.items() if any(record.id in ids for record in records)), default=0)
+        self._drop_pages(first)
+        self.total = max(0, self.total - self.source.delete(ids))
+        if self.selected_id is not None and int(self.selected_id) in ids:
+            self.selected_id = None
+        self.top = max(0, min(self.top, self.total - self.rows()))
+        self._render()
+
+    def _drop_pages(self, first: int) -> None:
+        for page in [page for page in self._pages if page >= first]:
+            del self._pages[page]
+
+    def rows(self) -> int:
+        """
+        Number of visible rows.
+        """
+        return int(self.cget('height'))
+
+    def yview(self, *args):
+        """
+        Handle the scrollbar commands 'moveto fraction' and 'scroll number units|pages'.
+        """
+        if not args:
+            return self._fractions()
+        if args[0] == 'moveto':
+            self._scroll_to(int(float(args[1]) * self.total))
+        elif args[0] == 'scroll':
+            step = int(args[1])
+            self._scroll_by(step * self.rows() if args[2] == 'pages' else step)
+
+    def _fractions(self) -> tuple[float, float]:
+        if self.total <= 0:
+            return 0.0, 1.0
+        return self.top / self.total, min(self.top + self.rows(), self.total) / self.total
+
+    def _scroll_to(self, top: int) -> str:
+        top = max(0, min(top, self.total - self.rows()))
+        if top != self.top:
+            self.top = top
+            self._render()
+        return 'break'
+
+    def _scroll_by(self, rows: int) -> str:
+        return self._scroll_to(self.top + rows)
+
+    def _on_arrow(self, step: int) -> Optional[str]:
+        """
+        Scroll when moving the selection past the first or last visible row.
+        """
+        children = self.get_children()
+        if not children:
+            return None
+        edge = children[0] if step < 0 else children[-1]
+        if self.focus() == edge:
+            self._scroll_by(step)
+            children = self.get_children()
+            edge = children[0] if step < 0 else children[-1]
+            self.focus(edge)
+            self.selection_set(edge)
+            return 'break'
+        return None
+
+    def _on_select(self, event) -> None:
+        selection = self.selection()
+        if selection:
+            self.selected_id = selection[0]
+
+    @staticmethod
+    def _pages_of(offset: int, limit: int) -> list:
+        if limit <= 0:
+            return []
+        return list(range(offset // PAGE_SIZE, (offset + limit - 1) // PAGE_SIZE + 1))
+
+    @staticmethod
+    def _fetch(source, pages: list) -> dict:
+        return {page: source.fetch(page * PAGE_SIZE, PAGE_SIZE) for page in pages}
+
+    def _store(self, pages: dict) -> None:
+        for page, records in pages.items():
+            self._pages[page] = records
+            self._pages.move_to_end(page)
+            if len(self._pages) > CACHED_PAGES:
+                self._pages.popitem(last=False)
+
+    def _fetched(self, source, generation: int, pages: dict) -> None:
+        if source is not self.source:
+            return
+        if generation == self._generation:
+            self._store(pages)
+        # fetches again if the pages were dropped meanwhile
+        self._render()
+
+    def _records(self, offset: int, limit: int) -> list:
+        """
+        Get records in [offset, offset + limit) from the page cache, fetching missing pages from the source.
+        """
+        self._store(self._fetch(self.source, [page for page in self._pages_of(offset, limit) if page not in self._pages]))
+        records = []
+        for page in self._pages_of(offset, limit):
+            self._pages.move_to_end(page)
+            records += self._pages[page]
+        start = offset - offset // PAGE_SIZE * PAGE_SIZE
+        return records[start:start + limit]
+
+    def _render(self) -> None:
+        if self.executor is not None and self.total > 0:
+            missing = [page for page in self._pages_of(self.top, min(self.rows(), self.total - self.top)) if page not in self._pages]
+            if missing:
+                # keep the rows shown until the pages arrive, a newer fetch replaces a waiting one
+                source, generation = self.source, self._generation
+                self.executor.submit(self._fetch, source, missing, key=f'treeview-fetch-{id(self)}',
+                                     on_done=lambda pages: self._fetched(source, generation, pages))
+                self._update_scrollbar()
+                return
+        self.delete(*self.get_children())
+        if self.total > 0:
+            for record in self._records(self.top, min(self.rows(), self.total - self.top)):
+                self.insert('', 'end', iid=str(record.id), values=record.values(self.mask))
+            # keep the selection when the selected record is still visible
+            if self.selected_id is not None and self.exists(self.selected_id):
+                self.selection_set(self.selected_id)
+        self._update_scrollbar()
+
+    def _update_scrollbar(self) -> None:
+        if self._yscrollcommand is not None:
+            self._yscrollcommand(*self._fractions())